@@ -0,0 +1,5 @@
+#!/bin/bash
+set -euo pipefail
+# Runs without poetry: the client needs only the standard library
+export PYTHONPATH="$(dirname "${0}")/src${PYTHONPATH:+:${PYTHONPATH}}"
+exec python3 -m compiler.client "$@"
@@ -1,30 +1,238 @@
-from base64 import b64encode
-import json
+import cProfile
+import pstats
 import re
 import sys
-from socketserver import ForkingTCPServer, StreamRequestHandler
-from traceback import format_exception
-from typing import Any
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import IO
 
+import compiler.ast as ast
+from compiler.bytecode import disassemble, lower
+from compiler.cache import CompileCache, default_directory
+from compiler.folding import fold_constants
+import compiler.limits as limits
+import compiler.metrics as metrics
+import compiler.profiling as profiling
+from compiler.parser import parse
+from compiler.server import FORK, run_async_server, run_prefork_server, run_server
+from compiler.tokenizer import tokenize, tokenize_stream
+from compiler.vm import Value, check_variables, format_value, interpret
+from compiler.watch import Watch
 
-def call_compiler(source_code: str, input_file_name: str) -> bytes:
+# Functions listed by --profile without a file
+PROFILE_LINES = 30
+
+
+def call_compiler(source_code: str | IO[bytes], input_file_name: str) -> bytes:
+    with limits.deadline():
+        # Source files are tokenized as a stream and parsed as the tokens
+        # come, so their tokenizing time counts as parsing time
+        if isinstance(source_code, str):
+            limits.check_source(source_code)
+            with metrics.timed(metrics.TOKENIZE), profiling.phase("tokenize"):
+                tokens = tokenize(source_code)
+            limits.check_tokens(len(tokens))
+            with metrics.timed(metrics.PARSE), profiling.phase("parse"):
+                expr = parse(tokens)
+        else:
+            with metrics.timed(metrics.PARSE), profiling.phase("parse"):
+                expr = parse(limits.counted(tokenize_stream(source_code)))
+        with profiling.phase("check"):
+            limits.check_depth(expr)
+        return compile_expression(expr)
+
+
+def compile_expression(expr: ast.Expression) -> bytes:
+    with profiling.phase("fold"):
+        expr, _ = fold_constants(expr)
+    with profiling.phase("generate"):
+        return generate_code(expr)
+
+
+def generate_code(expr: ast.Expression) -> bytes:
     # *** TODO ***
-    # Call your compiler here and return the compiled executable.
+    # Generate code and return the compiled executable.
     # Raise an exception on compilation error.
     # *** TODO ***
-    raise NotImplementedError("Compiler not implemented")
+    raise NotImplementedError("Code generation not implemented")
+
+
+def compile_file(input_file: str) -> bytes:
+    with open(input_file, 'rb') as f:
+        return call_compiler(f, input_file)
+
+
+def compile_single(
+    input_file: str | None, output_file: str, cache: CompileCache | None
+) -> None:
+    name = input_file or '(source code)'
+    # The cache key needs the whole source, and reading it first keeps
+    # tokenizing and parsing apart in profiles
+    profiled = profiling.installed() is not None
+    if input_file is None or cache is not None or profiled:
+        with profiling.phase("read"):
+            if input_file is not None:
+                with open(input_file) as f:
+                    source_code = f.read()
+            else:
+                source_code = sys.stdin.read()
+        if cache is not None:
+            executable = cache.get_or_compile(
+                source_code, lambda code: call_compiler(code, name)
+            )
+        else:
+            executable = call_compiler(source_code, name)
+    else:
+        with open(input_file, 'rb') as f:
+            executable = call_compiler(f, input_file)
+    with profiling.phase("write"):
+        with open(output_file, 'wb') as f:
+            f.write(executable)
+
+
+def compile_files(
+    inputs: list[str],
+    output_dir: str,
+    workers: int | None,
+    cache: CompileCache | None,
+) -> int:
+    """
+    Compile files and the files under directories in parallel processes,
+    writing each executable under `output_dir` as it finishes. Returns the
+    number of failures, which are reported on stderr.
+    """
+    jobs: list[tuple[Path, Path]] = []
+    for input in map(Path, inputs):
+        if input.is_dir():
+            jobs += [
+                (path, Path(output_dir) / path.relative_to(input))
+                for path in sorted(input.rglob('*'))
+                if path.is_file()
+            ]
+        else:
+            jobs.append((input, Path(output_dir) / input.name))
+    targets: dict[Path, Path] = {}
+    for input, output in jobs:
+        if output in targets:
+            raise Exception(
+                f"{targets[output]} and {input} would both be written to {output}"
+            )
+        targets[output] = input
+
+    failures = 0
+    with ProcessPoolExecutor(workers, mp_context=FORK) as pool:
+        # Cache misses also carry their cache key
+        pending: dict[Future[bytes], tuple[Path, Path, str | None]] = {}
+        key: str | None
+        for input, output in jobs:
+            if cache is None:
+                pending[pool.submit(compile_file, str(input))] = (input, output, None)
+                continue
+            source_code = input.read_text()
+            key = cache.key(source_code)
+            executable = cache.get(key)
+            if executable is not None:
+                output.parent.mkdir(parents=True, exist_ok=True)
+                output.write_bytes(executable)
+            else:
+                future = pool.submit(call_compiler, source_code, str(input))
+                pending[future] = (input, output, key)
+
+        for future in as_completed(pending):
+            input, output, key = pending[future]
+            try:
+                executable = future.result()
+            except Exception as e:
+                print(f"{input}: {e}", file=sys.stderr)
+                failures += 1
+                continue
+            if cache is not None and key is not None:
+                cache.put(key, executable)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_bytes(executable)
+    return failures
+
+
+def parse_value(text: str) -> Value:
+    if text in ("true", "false"):
+        return text == "true"
+    try:
+        return int(text)
+    except ValueError:
+        raise Exception(f"Not an integer or a bool: {text}") from None
 
 
 def main() -> int:
     # === Option parsing ===
     command: str | None = None
-    input_file: str | None = None
+    inputs: list[str] = []
     output_file: str | None = None
     host = "127.0.0.1"
     port = 3000
+    cache_dir: str | None = None
+    disk_cache = True
+    cache_entries = 256
+    cache_size = 256 << 20
+    workers = 0
+    backlog = 128
+    max_requests = 0
+    reuse_port = False
+    async_mode = False
+    poll = False
+    variables: dict[str, Value] = {}
+    show_bytecode = False
+    timings = False
+    memstats = False
+    profile_file: str | None = None
+    metrics_file: str | None = None
+    max_pending: int | None = None
+    request_limits = limits.Limits()
     for arg in sys.argv[1:]:
         if (m := re.fullmatch(r'--output=(.+)', arg)) is not None:
             output_file = m[1]
+        elif (m := re.fullmatch(r'--cache-dir=(.+)', arg)) is not None:
+            cache_dir = m[1]
+        elif arg == '--no-cache-dir':
+            disk_cache = False
+        elif (m := re.fullmatch(r'--cache-entries=(\d+)', arg)) is not None:
+            cache_entries = int(m[1])
+        elif (m := re.fullmatch(r'--cache-size=(\d+)', arg)) is not None:
+            cache_size = int(m[1])
+        elif (m := re.fullmatch(r'--workers=(\d+)', arg)) is not None:
+            workers = int(m[1])
+        elif (m := re.fullmatch(r'--backlog=(\d+)', arg)) is not None:
+            backlog = int(m[1])
+        elif (m := re.fullmatch(r'--max-requests=(\d+)', arg)) is not None:
+            max_requests = int(m[1])
+        elif arg == '--reuse-port':
+            reuse_port = True
+        elif arg == '--async':
+            async_mode = True
+        elif arg == '--poll':
+            poll = True
+        elif (m := re.fullmatch(r'--var=(\w+)=(.*)', arg)) is not None:
+            variables[m[1]] = parse_value(m[2])
+        elif arg == '--disassemble':
+            show_bytecode = True
+        elif arg == '--timings':
+            timings = True
+        elif arg == '--memstats':
+            memstats = True
+        elif (m := re.fullmatch(r'--profile(?:=(.+))?', arg)) is not None:
+            # Printed to stderr without a file name
+            profile_file = m[1] or ''
+        elif (m := re.fullmatch(r'--metrics-file=(.+)', arg)) is not None:
+            metrics_file = m[1]
+        elif (m := re.fullmatch(r'--max-pending=(\d+)', arg)) is not None:
+            max_pending = int(m[1])
+        elif (m := re.fullmatch(r'--max-source-bytes=(\d+)', arg)) is not None:
+            request_limits.max_source_bytes = int(m[1])
+        elif (m := re.fullmatch(r'--max-tokens=(\d+)', arg)) is not None:
+            request_limits.max_tokens = int(m[1])
+        elif (m := re.fullmatch(r'--max-depth=(\d+)', arg)) is not None:
+            request_limits.max_depth = int(m[1])
+        elif (m := re.fullmatch(r'--deadline=([\d.]+)', arg)) is not None:
+            request_limits.deadline = float(m[1])
         elif (m := re.fullmatch(r'--host=(.+)', arg)) is not None:
             host = m[1]
         elif (m := re.fullmatch(r'--port=(.+)', arg)) is not None:
@@ -33,34 +241,98 @@ def main() -> int:
             raise Exception(f"Unknown argument: {arg}")
         elif command is None:
             command = arg
-        elif input_file is None:
-            input_file = arg
         else:
-            raise Exception("Multiple input files not supported")
+            inputs.append(arg)
 
     if command is None:
         print(f"Error: command argument missing", file=sys.stderr)
         return 1
 
-    def read_source_code() -> str:
-        if input_file is not None:
-            with open(input_file) as f:
-                return f.read()
-        else:
-            return sys.stdin.read()
-
     # === Command implementations ===
 
     if command == 'compile':
-        source_code = read_source_code()
         if output_file is None:
             raise Exception("Output file flag --output=... required")
-        executable = call_compiler(source_code, input_file or '(source code)')
-        with open(output_file, 'wb') as f:
-            f.write(executable)
+        if len(inputs) > 1 or (inputs and Path(inputs[0]).is_dir()):
+            if timings or memstats or profile_file is not None:
+                raise Exception("Profiling flags need a single input file")
+            # --output names a directory
+            cache = None
+            if cache_dir is not None:
+                cache = CompileCache(cache_entries, cache_dir, cache_size)
+            failures = compile_files(inputs, output_file, workers or None, cache)
+            return 1 if failures > 0 else 0
+        input_file = inputs[0] if inputs else None
+        cache = None
+        if cache_dir is not None:
+            cache = CompileCache(cache_entries, cache_dir, cache_size)
+        profiler = None
+        if timings or memstats:
+            profiler = profiling.Profiler(memory=memstats)
+            profiling.install(profiler)
+            profiler.start()
+        profile = cProfile.Profile() if profile_file is not None else None
+        try:
+            if profile is not None:
+                profile.enable()
+            compile_single(input_file, output_file, cache)
+        finally:
+            if profile is not None:
+                profile.disable()
+                if profile_file:
+                    profile.dump_stats(profile_file)
+                else:
+                    stats = pstats.Stats(profile, stream=sys.stderr)
+                    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+            if profiler is not None:
+                profiler.stop()
+                profiling.install(None)
+                print(profiler.report(), file=sys.stderr)
     elif command == 'serve':
+        if max_pending is not None and workers > 0 and not async_mode:
+            # Prefork workers take connections straight from the backlog,
+            # so there is no queue of pending requests to bound
+            raise Exception("--max-pending needs --async, or no --workers")
+        # Forked processes only share cache entries on disk
+        if cache_dir is None and disk_cache:
+            cache_dir = default_directory()
+        try:
+            cache = CompileCache(cache_entries, cache_dir, cache_size)
+            metrics.install(metrics.Metrics(metrics_file))
+            limits.install(request_limits)
+            if async_mode:
+                run_async_server(
+                    host, port, call_compiler, cache,
+                    workers or None, backlog, max_pending,
+                )
+            elif workers > 0:
+                run_prefork_server(
+                    host, port, call_compiler, cache,
+                    workers, backlog, max_requests, reuse_port,
+                )
+            else:
+                run_server(host, port, call_compiler, cache, max_pending)
+        except KeyboardInterrupt:
+            pass
+    elif command == 'interpret':
+        if len(inputs) > 1:
+            raise Exception("Interpret takes one input file")
+        if inputs:
+            with open(inputs[0]) as f:
+                source_code = f.read()
+        else:
+            source_code = sys.stdin.read()
+        if show_bytecode:
+            print(disassemble(lower(parse(tokenize(source_code)))))
+        else:
+            print(format_value(interpret(source_code, check_variables(variables))))
+    elif command == 'watch':
+        if output_file is None:
+            raise Exception("Output file flag --output=... required")
+        if not inputs:
+            raise Exception("Files or directories to watch required")
         try:
-            run_server(host, port)
+            Watch(inputs, output_file, compile_expression, poll).run()
         except KeyboardInterrupt:
             pass
     else:
@@ -69,34 +341,5 @@ def main() -> int:
     return 0
 
 
-def run_server(host: str, port: int) -> None:
-    class Server(ForkingTCPServer):
-        allow_reuse_address = True
-        request_queue_size = 32
-
-    class Handler(StreamRequestHandler):
-        def handle(self) -> None:
-            result: dict[str, Any] = {}
-            try:
-                input_str = self.rfile.read().decode()
-                input = json.loads(input_str)
-                if input["command"] == "compile":
-                    source_code = input["code"]
-                    executable = call_compiler(source_code, "(source code)")
-                    result["program"] = b64encode(executable).decode()
-                elif input["command"] == "ping":
-                    pass
-                else:
-                    result["error"] = "Unknown command: " + input['command']
-            except Exception as e:
-                result["error"] = "".join(format_exception(e))
-            result_str = json.dumps(result)
-            self.request.sendall(str.encode(result_str))
-
-    print(f"Starting TCP server at {host}:{port}")
-    with Server((host, port), Handler) as server:
-        server.serve_forever()
-
-
 if __name__ == '__main__':
     sys.exit(main())
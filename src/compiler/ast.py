@@ -1,22 +1,22 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class Expression:
     """Base class for AST nodes representing expressions."""
 
 
-@dataclass
+@dataclass(slots=True)
 class Literal(Expression):
     value: int | bool
 
 
-@dataclass
+@dataclass(slots=True)
 class Identifier(Expression):
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class IfThenElse(Expression):
     """AST node for an if-then-else statement like `if A then B else C`"""
 
@@ -25,7 +25,7 @@ class IfThenElse(Expression):
     else_branch: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class IfThen(Expression):
     """AST node for an if-then statement like `if A then B`"""
 
@@ -33,7 +33,7 @@ class IfThen(Expression):
     then_branch: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class BinaryOp(Expression):
     """AST node for a binary operation like `A + B`"""
 
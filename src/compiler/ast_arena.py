@@ -0,0 +1,187 @@
+from array import array
+from typing import Generic, Hashable, Iterator, TypeVar
+
+import compiler.ast as ast
+
+"""
+Flat AST representation for very large programs.
+
+Nodes live in parallel arrays and refer to their children by index.
+Children are always added before their parents, so every node's children
+have smaller indices. Literal values, identifier names and operators are
+interned into small integer IDs.
+"""
+
+LITERAL = 0
+IDENTIFIER = 1
+BINARY_OP = 2
+IF_THEN = 3
+IF_THEN_ELSE = 4
+
+
+T = TypeVar("T", bound=Hashable)
+
+
+class Interner(Generic[T]):
+    """Assigns consecutive IDs to distinct values."""
+
+    def __init__(self) -> None:
+        self.values: list[T] = []
+        self.ids: dict[tuple[type, T], int] = {}
+
+    def __call__(self, value: T) -> int:
+        # Keyed by type too, since True == 1
+        key = (type(value), value)
+        index = self.ids.get(key)
+        if index is None:
+            index = self.ids[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+class AstArena:
+    """
+    AST nodes as columns: `kinds[i]` is the node kind and `a[i]`, `b[i]`,
+    `c[i]` its operands:
+
+    - LITERAL: constant ID
+    - IDENTIFIER: name ID
+    - BINARY_OP: left child, operator ID, right child
+    - IF_THEN: condition, then branch
+    - IF_THEN_ELSE: condition, then branch, else branch
+    """
+
+    def __init__(self) -> None:
+        self.kinds = array("B")
+        self.a = array("i")
+        self.b = array("i")
+        self.c = array("i")
+        self.constants: Interner[int | bool] = Interner()
+        self.names: Interner[str] = Interner()
+        self.operators: Interner[str] = Interner()
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def _add(self, kind: int, a: int, b: int = -1, c: int = -1) -> int:
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        return len(self.kinds) - 1
+
+    def literal(self, value: int | bool) -> int:
+        return self._add(LITERAL, self.constants(value))
+
+    def identifier(self, name: str) -> int:
+        return self._add(IDENTIFIER, self.names(name))
+
+    def binary_op(self, left: int, op: str, right: int) -> int:
+        return self._add(BINARY_OP, left, self.operators(op), right)
+
+    def if_then(self, condition: int, then_branch: int) -> int:
+        return self._add(IF_THEN, condition, then_branch)
+
+    def if_then_else(
+        self, condition: int, then_branch: int, else_branch: int
+    ) -> int:
+        return self._add(IF_THEN_ELSE, condition, then_branch, else_branch)
+
+    def children(self, node: int) -> Iterator[int]:
+        kind = self.kinds[node]
+        if kind == BINARY_OP:
+            yield self.a[node]
+            yield self.c[node]
+        elif kind == IF_THEN:
+            yield self.a[node]
+            yield self.b[node]
+        elif kind == IF_THEN_ELSE:
+            yield self.a[node]
+            yield self.b[node]
+            yield self.c[node]
+
+
+def to_arena(
+    expr: ast.Expression, arena: AstArena | None = None
+) -> tuple[AstArena, int]:
+    """
+    Add `expr` to an arena, a new one by default, and return the arena and
+    the index of the root. Subtrees shared by identity are added once.
+    """
+    if arena is None:
+        arena = AstArena()
+    added: dict[int, int] = {}
+    # Post-order traversal with an explicit stack: a node is added on its
+    # second visit, after its children
+    stack: list[tuple[ast.Expression, bool]] = [(expr, False)]
+    while stack:
+        node, children_added = stack.pop()
+        if id(node) in added:
+            continue
+        if not children_added:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(_children(node)))
+            continue
+
+        match node:
+            case ast.Literal(value):
+                index = arena.literal(value)
+            case ast.Identifier(name):
+                index = arena.identifier(name)
+            case ast.BinaryOp(left, op, right):
+                index = arena.binary_op(added[id(left)], op, added[id(right)])
+            case ast.IfThen(condition, then_branch):
+                index = arena.if_then(added[id(condition)], added[id(then_branch)])
+            case ast.IfThenElse(condition, then_branch, else_branch):
+                index = arena.if_then_else(
+                    added[id(condition)],
+                    added[id(then_branch)],
+                    added[id(else_branch)],
+                )
+            case _:
+                raise Exception(f"Unknown AST node: {node}")
+        added[id(node)] = index
+    return arena, added[id(expr)]
+
+
+def from_arena(arena: AstArena, root: int) -> ast.Expression:
+    """Build `ast` classes for the subtree of `root`, sharing repeated children."""
+    # Children precede their parents, so one pass in index order suffices
+    needed = bytearray(root + 1)
+    needed[root] = 1
+    for i in range(root, -1, -1):
+        if needed[i]:
+            for child in arena.children(i):
+                needed[child] = 1
+
+    constants = arena.constants.values
+    names = arena.names.values
+    operators = arena.operators.values
+    kinds, a, b, c = arena.kinds, arena.a, arena.b, arena.c
+    nodes: dict[int, ast.Expression] = {}
+    for i in range(root + 1):
+        if not needed[i]:
+            continue
+        kind = kinds[i]
+        if kind == LITERAL:
+            nodes[i] = ast.Literal(constants[a[i]])
+        elif kind == IDENTIFIER:
+            nodes[i] = ast.Identifier(names[a[i]])
+        elif kind == BINARY_OP:
+            nodes[i] = ast.BinaryOp(nodes[a[i]], operators[b[i]], nodes[c[i]])
+        elif kind == IF_THEN:
+            nodes[i] = ast.IfThen(nodes[a[i]], nodes[b[i]])
+        else:
+            nodes[i] = ast.IfThenElse(nodes[a[i]], nodes[b[i]], nodes[c[i]])
+    return nodes[root]
+
+
+def _children(node: ast.Expression) -> list[ast.Expression]:
+    match node:
+        case ast.BinaryOp(left, _, right):
+            return [left, right]
+        case ast.IfThen(condition, then_branch):
+            return [condition, then_branch]
+        case ast.IfThenElse(condition, then_branch, else_branch):
+            return [condition, then_branch, else_branch]
+    return []
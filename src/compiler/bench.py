@@ -0,0 +1,269 @@
+import json
+import math
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import compiler.ast as ast
+from compiler.bytecode import lower
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.vm import execute, walk
+from compiler.workloads import WORKLOADS
+
+"""
+Tokenizer and parser benchmarks over the synthetic workloads.
+
+Each workload is timed several times and the fastest run is kept, since
+slower runs measure interference rather than the code. Peak memory is
+measured in a separate run under tracemalloc, which would skew the
+timings. Results are saved as JSON, and comparing them with a baseline
+reports throughput drops and memory growth over the thresholds.
+
+`--interpret` also times lowering to bytecode and running it on the
+stack machine against the recursive AST walker, on the `well_typed`
+workload, which is the one that runs without errors.
+
+    poetry run bench --size=1000000 --output=new.json --baseline=old.json
+"""
+
+DEFAULT_SIZE = 1 << 20
+DEFAULT_REPEAT = 3
+# Allowed relative change from the baseline before it is a regression
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_MEMORY_THRESHOLD = 0.20
+# The throughput measured for each stage
+RATES = [("tokenize", "tokens_per_second"), ("parse", "nodes_per_second")]
+INTERPRET_STAGES = ["lower", "execute", "walk"]
+
+
+def count_nodes(expr: ast.Expression) -> int:
+    count = 0
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        count += 1
+        match node:
+            case ast.BinaryOp(left, _, right):
+                stack += [left, right]
+            case ast.IfThen(condition, then_branch):
+                stack += [condition, then_branch]
+            case ast.IfThenElse(condition, then_branch, else_branch):
+                stack += [condition, then_branch, else_branch]
+    return count
+
+
+def best_time(function: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(function: Callable[[], object]) -> int:
+    """Peak bytes allocated while running `function`, including its result."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scaling_exponent(sizes: list[int], seconds: list[float]) -> float:
+    """
+    Least-squares slope of log(seconds) over log(size): about 1 for linear
+    growth and 2 for quadratic.
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(s) for s in seconds]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return covariance / variance
+
+
+def run_workload(source: str, repeat: int = DEFAULT_REPEAT) -> dict[str, Any]:
+    tokens = tokenize(source)
+    nodes = count_nodes(parse(tokens))
+    tokenize_seconds = best_time(lambda: tokenize(source), repeat)
+    parse_seconds = best_time(lambda: parse(tokens), repeat)
+    return {
+        "bytes": len(source),
+        "tokens": len(tokens),
+        "nodes": nodes,
+        "tokenize": {
+            "seconds": tokenize_seconds,
+            "tokens_per_second": len(tokens) / tokenize_seconds,
+            "peak_bytes": peak_memory(lambda: tokenize(source)),
+        },
+        "parse": {
+            "seconds": parse_seconds,
+            "nodes_per_second": nodes / parse_seconds,
+            "peak_bytes": peak_memory(lambda: parse(tokens)),
+        },
+    }
+
+
+def run_interpreters(source: str, repeat: int = DEFAULT_REPEAT) -> dict[str, Any]:
+    expr = parse(tokenize(source))
+    nodes = count_nodes(expr)
+    code = lower(expr)
+    if execute(code) != walk(expr, {}):
+        raise Exception("The stack machine and the AST walker disagree")
+    seconds = {
+        "lower": best_time(lambda: lower(expr), repeat),
+        "execute": best_time(lambda: execute(code), repeat),
+        "walk": best_time(lambda: walk(expr, {}), repeat),
+    }
+    result: dict[str, Any] = {
+        "bytes": len(source),
+        "nodes": nodes,
+        "instructions": len(code.instructions) // 2,
+    }
+    for stage in INTERPRET_STAGES:
+        result[stage] = {
+            "seconds": seconds[stage],
+            "nodes_per_second": nodes / seconds[stage],
+        }
+    result["speedup"] = seconds["walk"] / seconds["execute"]
+    return result
+
+
+def run(
+    names: list[str],
+    size: int = DEFAULT_SIZE,
+    repeat: int = DEFAULT_REPEAT,
+    seed: int = 0,
+) -> dict[str, Any]:
+    results = {}
+    for name in names:
+        results[name] = run_workload(WORKLOADS[name](size, seed), repeat)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "size": size,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+    memory_threshold: float = DEFAULT_MEMORY_THRESHOLD,
+) -> list[str]:
+    """Regressions of `current` from `baseline`, on the workloads both ran."""
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        for stage, rate in RATES:
+            change = result[stage][rate] / old[stage][rate] - 1
+            if change < -threshold:
+                regressions.append(f"{name} {stage}: {rate} {change:+.1%}")
+            peak = old[stage]["peak_bytes"]
+            change = result[stage]["peak_bytes"] / max(peak, 1) - 1
+            if change > memory_threshold:
+                regressions.append(f"{name} {stage}: peak_bytes {change:+.1%}")
+    if "interpret" in baseline and "interpret" in current:
+        for stage in INTERPRET_STAGES:
+            new_rate = current["interpret"][stage]["nodes_per_second"]
+            change = new_rate / baseline["interpret"][stage]["nodes_per_second"] - 1
+            if change < -threshold:
+                regressions.append(f"interpret {stage}: nodes_per_second {change:+.1%}")
+    return regressions
+
+
+def report(results: dict[str, Any]) -> str:
+    lines = [
+        f"{'workload':<18}{'bytes':>10}{'tokens/s':>13}{'nodes/s':>13}"
+        f"{'tokenize MB':>13}{'parse MB':>10}"
+    ]
+    for name, result in results["results"].items():
+        lines.append(
+            f"{name:<18}{result['bytes']:>10}"
+            f"{result['tokenize']['tokens_per_second']:>13.0f}"
+            f"{result['parse']['nodes_per_second']:>13.0f}"
+            f"{result['tokenize']['peak_bytes'] / 1e6:>13.1f}"
+            f"{result['parse']['peak_bytes'] / 1e6:>10.1f}"
+        )
+    if "interpret" in results:
+        interpret = results["interpret"]
+        lines.append(
+            f"\n{'interpret':<18}{'nodes':>10}{'lower/s':>13}{'execute/s':>13}"
+            f"{'walk/s':>13}{'speedup':>10}"
+        )
+        lines.append(
+            f"{'well_typed':<18}{interpret['nodes']:>10}"
+            + "".join(
+                f"{interpret[stage]['nodes_per_second']:>13.0f}"
+                for stage in INTERPRET_STAGES
+            )
+            + f"{interpret['speedup']:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> int:
+    names: list[str] = []
+    size = DEFAULT_SIZE
+    repeat = DEFAULT_REPEAT
+    seed = 0
+    output_file: str | None = None
+    baseline_file: str | None = None
+    threshold = DEFAULT_THRESHOLD
+    memory_threshold = DEFAULT_MEMORY_THRESHOLD
+    interpret = False
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r"--size=(\d+)", arg)) is not None:
+            size = int(m[1])
+        elif (m := re.fullmatch(r"--repeat=(\d+)", arg)) is not None:
+            repeat = max(1, int(m[1]))
+        elif (m := re.fullmatch(r"--seed=(\d+)", arg)) is not None:
+            seed = int(m[1])
+        elif (m := re.fullmatch(r"--output=(.+)", arg)) is not None:
+            output_file = m[1]
+        elif (m := re.fullmatch(r"--baseline=(.+)", arg)) is not None:
+            baseline_file = m[1]
+        elif (m := re.fullmatch(r"--threshold=([\d.]+)", arg)) is not None:
+            threshold = float(m[1])
+        elif (m := re.fullmatch(r"--memory-threshold=([\d.]+)", arg)) is not None:
+            memory_threshold = float(m[1])
+        elif arg == "--interpret":
+            interpret = True
+        elif arg.startswith("-"):
+            raise Exception(f"Unknown argument: {arg}")
+        elif arg in WORKLOADS:
+            names.append(arg)
+        else:
+            raise Exception(f"Unknown workload: {arg}")
+
+    results = run(names or list(WORKLOADS), size, repeat, seed)
+    if interpret:
+        source = WORKLOADS["well_typed"](size, seed)
+        results["interpret"] = run_interpreters(source, repeat)
+    print(report(results))
+    if output_file is not None:
+        with open(output_file, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline_file is not None:
+        with open(baseline_file) as f:
+            regressions = compare(json.load(f), results, threshold, memory_threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
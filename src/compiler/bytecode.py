@@ -0,0 +1,206 @@
+from array import array
+from dataclasses import dataclass, field
+
+import compiler.ast as ast
+from compiler.folding import BOOLEANS, wrap
+
+"""
+Lowering from the AST to bytecode for the stack machine in `vm`.
+
+Instructions are (opcode, argument) pairs of 32-bit integers in one flat
+array, with the constants and variable names they refer to in pools
+beside it. Branches jump to instruction offsets in the array. `and` and
+`or` jump over their right side, so it is only evaluated when the left
+one doesn't decide the result. `if` without `else` evaluates to the unit
+value, None.
+
+The tree is lowered with an explicit stack, so arbitrarily deep trees
+lower without recursion.
+"""
+
+Value = int | bool | None
+
+# Opcodes. Arguments are noted after each.
+CONST = 0  # constant pool index
+LOAD = 1  # name pool index
+STORE = 2  # name pool index; leaves the value on the stack
+BINARY = 3  # index in OPERATORS
+POP = 4
+JUMP = 5  # target offset
+JUMP_IF_FALSE = 6  # target offset; pops the condition
+# Target offset; pops the condition unless it jumps
+JUMP_IF_FALSE_OR_POP = 7
+JUMP_IF_TRUE_OR_POP = 8
+CHECK_BOOL = 9
+JUMPS = {JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP}
+
+OPCODES = [
+    "CONST",
+    "LOAD",
+    "STORE",
+    "BINARY",
+    "POP",
+    "JUMP",
+    "JUMP_IF_FALSE",
+    "JUMP_IF_FALSE_OR_POP",
+    "JUMP_IF_TRUE_OR_POP",
+    "CHECK_BOOL",
+]
+
+# Operators of the BINARY instruction, by argument
+OPERATORS = ["+", "-", "*", "/", "%", "<", "<=", ">", ">=", "==", "!="]
+OPERATOR_INDEX = {op: index for index, op in enumerate(OPERATORS)}
+
+
+@dataclass
+class Code:
+    # Opcode and argument pairs
+    instructions: array[int] = field(default_factory=lambda: array("i"))
+    constants: list[Value] = field(default_factory=list)
+    names: list[str] = field(default_factory=list)
+
+
+# A pseudo-instruction of the lowering stack that marks where a label is
+MARK = -1
+
+
+class _Assembler:
+    def __init__(self) -> None:
+        self.instructions: list[int] = []
+        self.constants: list[Value] = []
+        self.names: list[str] = []
+        self.constant_index: dict[tuple[type, Value], int] = {}
+        self.name_index: dict[str, int] = {}
+        # Offsets of labels, and offsets of jumps whose argument is a label
+        self.labels: list[int] = []
+        self.jumps: list[int] = []
+
+    def constant(self, value: Value) -> int:
+        # The type keeps True and 1 apart
+        key = (type(value), value)
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def name(self, name: str) -> int:
+        index = self.name_index.get(name)
+        if index is None:
+            index = self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def label(self) -> int:
+        self.labels.append(-1)
+        return len(self.labels) - 1
+
+    def finish(self) -> Code:
+        for offset in self.jumps:
+            self.instructions[offset + 1] = self.labels[self.instructions[offset + 1]]
+        return Code(array("i", self.instructions), self.constants, self.names)
+
+
+# Instructions to emit, or a node to lower in their place. Jumps have a
+# label as their argument until the end.
+Work = tuple[int, int] | ast.Expression
+
+# The BINARY instruction of each operator
+_BINARY_INSTRUCTIONS = {op: (BINARY, index) for op, index in OPERATOR_INDEX.items()}
+
+
+def lower(expr: ast.Expression) -> Code:
+    """Lower `expr` to bytecode that leaves its value on the stack."""
+    assembler = _Assembler()
+    instructions = assembler.instructions
+    # Pushed in reverse, so items run in the order they are listed
+    stack: list[Work] = [expr]
+    while stack:
+        item = stack.pop()
+        if type(item) is tuple:
+            opcode, argument = item
+            if opcode == MARK:
+                assembler.labels[argument] = len(instructions)
+                continue
+            if opcode in JUMPS:
+                assembler.jumps.append(len(instructions))
+            instructions += item
+            continue
+
+        # Binary operators are most of a typical tree
+        if type(item) is ast.BinaryOp and item.op in _BINARY_INSTRUCTIONS:
+            stack += (_BINARY_INSTRUCTIONS[item.op], item.right, item.left)
+            continue
+        work: list[Work]
+        if isinstance(item, ast.Literal):
+            value = item.value
+            if type(value) is int:
+                value = wrap(value)
+            instructions += (CONST, assembler.constant(value))
+            continue
+        elif isinstance(item, ast.Identifier):
+            if item.name in BOOLEANS:
+                constant = assembler.constant(BOOLEANS[item.name])
+                instructions += (CONST, constant)
+            else:
+                instructions += (LOAD, assembler.name(item.name))
+            continue
+        elif isinstance(item, ast.BinaryOp):
+            work = _lower_binary_op(assembler, item)
+        elif isinstance(item, ast.IfThen):
+            end = assembler.label()
+            work = [
+                item.condition,
+                (JUMP_IF_FALSE, end),
+                item.then_branch,
+                (POP, 0),
+                (MARK, end),
+                (CONST, assembler.constant(None)),
+            ]
+        elif isinstance(item, ast.IfThenElse):
+            otherwise = assembler.label()
+            end = assembler.label()
+            work = [
+                item.condition,
+                (JUMP_IF_FALSE, otherwise),
+                item.then_branch,
+                (JUMP, end),
+                (MARK, otherwise),
+                item.else_branch,
+                (MARK, end),
+            ]
+        else:
+            raise Exception(f"Unknown AST node: {item}")
+        stack += reversed(work)
+    return assembler.finish()
+
+
+def _lower_binary_op(assembler: _Assembler, node: ast.BinaryOp) -> list[Work]:
+    if node.op == "=":
+        target = node.left
+        if not isinstance(target, ast.Identifier) or target.name in BOOLEANS:
+            raise Exception(f"Cannot assign to {target}")
+        return [node.right, (STORE, assembler.name(target.name))]
+    if node.op in ("and", "or"):
+        end = assembler.label()
+        opcode = JUMP_IF_FALSE_OR_POP if node.op == "and" else JUMP_IF_TRUE_OR_POP
+        return [node.left, (opcode, end), node.right, (CHECK_BOOL, 0), (MARK, end)]
+    raise Exception(f"Unknown operator: {node.op}")
+
+
+def disassemble(code: Code) -> str:
+    lines = []
+    instructions = code.instructions
+    for offset in range(0, len(instructions), 2):
+        opcode, argument = instructions[offset], instructions[offset + 1]
+        line = f"{offset:>6} {OPCODES[opcode]:<22}"
+        if opcode == CONST:
+            line += f"{argument} ({code.constants[argument]!r})"
+        elif opcode in (LOAD, STORE):
+            line += f"{argument} ({code.names[argument]})"
+        elif opcode == BINARY:
+            line += f"{argument} ({OPERATORS[argument]})"
+        elif opcode in JUMPS:
+            line += str(argument)
+        lines.append(line.rstrip())
+    return "\n".join(lines)
@@ -0,0 +1,210 @@
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+from functools import cache
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+"""
+Content-addressed cache for compiled executables.
+
+Entries are keyed by a hash of the source code and of the compiler's own
+source, so any change to the compiler invalidates them. There is an
+in-memory LRU tier per process and an optional on-disk tier that forked
+server workers share: files are written to a temporary name and renamed
+into place, and eviction runs under an exclusive lock. The counters are
+shared too, so only `memory_entries_in_process` in the stats is about a
+single process.
+"""
+
+HITS = 0
+MISSES = 1
+DISK_HITS = 2
+MEMORY_EVICTIONS = 3
+DISK_BYTES = 4
+DISK_EVICTIONS = 5
+COUNTERS = [
+    "hits",
+    "misses",
+    "disk_hits",
+    "memory_evictions",
+    "disk_bytes",
+    "disk_evictions",
+]
+
+
+def default_directory() -> str:
+    """The disk tier's directory for `serve` when none is given."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "pycompiler")
+
+
+@cache
+def compiler_version() -> str:
+    """Hash of the compiler package's source files."""
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """Two-tier executable cache. Only successful compilations are cached."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        directory: str | None = None,
+        max_disk_bytes: int = 256 << 20,
+    ) -> None:
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        # Shared memory, so counts from forked workers add up
+        self.counters = multiprocessing.Array("q", len(COUNTERS))
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._evict_disk()
+
+    def key(self, source_code: str) -> str:
+        digest = hashlib.sha256(compiler_version().encode())
+        digest.update(b"\0")
+        digest.update(source_code.encode())
+        return digest.hexdigest()
+
+    def get_or_compile(
+        self, source_code: str, compile: Callable[[str], bytes]
+    ) -> bytes:
+        """Return the cached executable, or compile and cache it."""
+        key = self.key(source_code)
+        executable = self.get(key)
+        if executable is None:
+            executable = compile(source_code)
+            self.put(key, executable)
+        return executable
+
+    def get(self, key: str) -> bytes | None:
+        entry = self.get_or_open(key)
+        if entry is None or isinstance(entry, bytes):
+            return entry
+        with entry:
+            executable = entry.read()
+        self.remember(key, executable)
+        return executable
+
+    def get_or_open(self, key: str) -> bytes | BinaryIO | None:
+        """
+        Like `get`, but an entry found only on disk is returned as an open
+        file, so it can be sent on without reading it into memory.
+        """
+        executable = self.get_memory(key)
+        if executable is not None:
+            return executable
+        return self.open_disk(key)
+
+    def get_memory(self, key: str) -> bytes | None:
+        """Look in the memory tier only. A miss isn't counted yet."""
+        executable = self.memory.get(key)
+        if executable is not None:
+            self.memory.move_to_end(key)
+            self._count(HITS)
+        return executable
+
+    def open_disk(self, key: str) -> BinaryIO | None:
+        """
+        Look in the disk tier only, after `get_memory` missed. Counts the
+        miss if the entry isn't there either.
+        """
+        if self.directory is not None:
+            path = self.directory / key
+            try:
+                file = open(path, "rb")
+                # The modification time orders disk entries for eviction
+                os.utime(file.fileno())
+            except FileNotFoundError:
+                pass
+            else:
+                self._count(HITS)
+                self._count(DISK_HITS)
+                return file
+
+        self._count(MISSES)
+        return None
+
+    def put(self, key: str, executable: bytes) -> None:
+        self.remember(key, executable)
+        self.put_disk(key, executable)
+
+    def put_disk(self, key: str, executable: bytes) -> None:
+        """Store in the disk tier only, if there is one."""
+        if self.directory is None:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(executable)
+            os.replace(temp_path, self.directory / key)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        # The directory is only scanned when the running total says it
+        # may be over budget
+        with self.counters.get_lock():
+            self.counters[DISK_BYTES] += len(executable)
+            over_budget = self.counters[DISK_BYTES] > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def stats(self) -> dict[str, int]:
+        counts = dict(zip(COUNTERS, self.counters[:]))
+        # The memory tier of whichever process answers
+        counts["memory_entries_in_process"] = len(self.memory)
+        return counts
+
+    def remember(self, key: str, executable: bytes) -> None:
+        """Store in the memory tier only."""
+        self.memory[key] = executable
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self._count(MEMORY_EVICTIONS)
+
+    def _evict_disk(self) -> None:
+        assert self.directory is not None
+        with open(self.directory / ".lock", "wb") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_disk_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._count(DISK_EVICTIONS)
+
+            with self.counters.get_lock():
+                self.counters[DISK_BYTES] = total
+
+    def _count(self, counter: int) -> None:
+        with self.counters.get_lock():
+            self.counters[counter] += 1
@@ -0,0 +1,153 @@
+import io
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+from compiler.protocol import read_frame
+
+"""
+Thin `compile` client for a warm `serve` daemon.
+
+Starting the interpreter and importing the compiler costs more than
+compiling a small file, so this entry point imports only the standard
+library and sends the source to a daemon, starting one in the background
+if none is listening. The executable is written locally. When no daemon
+can be reached, or it is busy, the file is compiled in-process instead.
+"""
+
+# How long to wait for a daemon this client started to begin listening
+START_TIMEOUT = 5.0
+CONNECT_TIMEOUT = 1.0
+
+
+def main() -> int:
+    # The compiler's own arguments, for falling back to it
+    forwarded = [arg for arg in sys.argv[1:] if arg != "--no-start"]
+    output_file: str | None = None
+    host = "127.0.0.1"
+    port = 3000
+    start = "--no-start" not in sys.argv[1:]
+    positional: list[str] = []
+    for arg in forwarded:
+        if (m := re.fullmatch(r"--output=(.+)", arg)) is not None:
+            output_file = m[1]
+        elif (m := re.fullmatch(r"--host=(.+)", arg)) is not None:
+            host = m[1]
+        elif (m := re.fullmatch(r"--port=(\d+)", arg)) is not None:
+            port = int(m[1])
+        elif arg.startswith("-"):
+            # Caching and the like are left to the full compiler
+            return compile_locally(forwarded)
+        else:
+            positional.append(arg)
+
+    # Only single-file compiles go to the daemon
+    if positional[:1] != ["compile"] or len(positional) > 2 or output_file is None:
+        return compile_locally(forwarded)
+    if len(positional) == 2:
+        with open(positional[1]) as f:
+            source_code = f.read()
+    else:
+        source_code = sys.stdin.read()
+
+    try:
+        header, executable = compile_remotely(host, port, source_code, start)
+    except OSError:
+        return compile_locally(forwarded, source_code)
+    if header.get("code") == "busy":
+        return compile_locally(forwarded, source_code)
+    if "error" in header:
+        print(header["error"], file=sys.stderr, end="")
+        return 1
+    with open(output_file, "wb") as f:
+        f.write(executable)
+    return 0
+
+
+def compile_remotely(
+    host: str, port: int, source_code: str, start: bool = True
+) -> tuple[dict[str, Any], bytes]:
+    """
+    Compile on the daemon at `host`:`port`, starting one if `start` is set
+    and nothing is listening. Returns the response header and executable.
+    Raises OSError if no daemon can be reached.
+    """
+    try:
+        connection = socket.create_connection((host, port), CONNECT_TIMEOUT)
+    except ConnectionRefusedError:
+        if not start:
+            raise
+        start_daemon(host, port)
+        connection = wait_for_daemon(host, port, START_TIMEOUT)
+
+    with connection:
+        # Compiling may take longer than connecting
+        connection.settimeout(None)
+        message = {"command": "compile", "code": source_code, "format": "binary"}
+        connection.sendall(json.dumps(message).encode())
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile("rb") as file:
+            try:
+                header = read_frame(file)
+            except (EOFError, ValueError) as e:
+                raise ConnectionError(f"Bad response from daemon: {e}") from e
+            executable = file.read(header.get("size", 0))
+    if len(executable) < header.get("size", 0):
+        raise ConnectionError("Daemon closed the connection mid-response")
+    return header, executable
+
+
+def start_daemon(host: str, port: int) -> subprocess.Popen[bytes]:
+    """
+    Start `serve --async` in its own session, so it outlives this client.
+    If several clients race to start one, the losers fail to bind and exit.
+    """
+    env = dict(os.environ)
+    # The daemon imports the compiler from wherever this client came from
+    source_root = str(Path(__file__).resolve().parent.parent)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [source_root, env.get("PYTHONPATH")])
+    )
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "compiler", "serve", "--async",
+            f"--host={host}", f"--port={port}",
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+        start_new_session=True,
+    )
+
+
+def wait_for_daemon(host: str, port: int, timeout: float) -> socket.socket:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection((host, port), CONNECT_TIMEOUT)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+
+def compile_locally(args: list[str], source_code: str | None = None) -> int:
+    """Run the full compiler in this process with the same arguments."""
+    import compiler.__main__ as compiler_main
+
+    if source_code is not None:
+        # The source may have come from standard input, which is now read
+        sys.stdin = io.StringIO(source_code)
+    sys.argv = [sys.argv[0], *args]
+    return compiler_main.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
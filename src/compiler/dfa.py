@@ -0,0 +1,209 @@
+from array import array
+from dataclasses import dataclass
+from sys import intern
+from typing import Iterator
+from .tokenizer import KINDS
+from .utils import SPAN_BITS, Token, Kind, LineIndex
+
+"""
+Table-driven scanner for ASCII sources.
+
+The fixed token texts of the language (the tables in `tokenizer`) are
+compiled into a DFA together with the identifier and integer literal
+character classes. Scanning runs the transition table over the raw bytes
+and keeps the longest match, so its speed does not depend on how many
+operators the language has.
+"""
+
+WORD_START = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_"
+DIGITS = b"0123456789"
+WORD_CHARS = WORD_START + DIGITS
+
+# Bytes `str.splitlines` treats as line boundaries in ASCII text
+LINE_BREAKS = b"\n\r\v\f\x1c\x1d\x1e"
+
+DEAD = 0
+START = 1
+
+
+@dataclass
+class Dfa:
+    # transitions[state << 8 | byte] is the next state, DEAD if none
+    transitions: array
+    # accepts[state] is an index into `kinds`, 0 if the state doesn't accept
+    accepts: array
+    kinds: list[Kind]
+
+
+def build_dfa(literals: dict[str, Kind]) -> Dfa:
+    """
+    Build a DFA recognizing `literals`, identifiers and integer literals.
+
+    Literals made of word characters (keywords) take precedence over
+    identifiers of the same text.
+    """
+    kinds: list[Kind] = ["other"]
+    transitions = array("H")
+    accepts = array("B")
+
+    def kind_index(kind: Kind | None) -> int:
+        if kind is None:
+            return 0
+        if kind not in kinds:
+            kinds.append(kind)
+        return kinds.index(kind)
+
+    def new_state(kind: Kind | None) -> int:
+        transitions.extend([DEAD] * 256)
+        accepts.append(kind_index(kind))
+        return len(accepts) - 1
+
+    def set_transitions(state: int, chars: bytes, target: int) -> None:
+        for c in chars:
+            transitions[state << 8 | c] = target
+
+    new_state(None)
+    new_state(None)
+    identifier = new_state("identifier")
+    int_literal = new_state("int_literal")
+    set_transitions(START, WORD_START, identifier)
+    set_transitions(START, DIGITS, int_literal)
+    set_transitions(identifier, WORD_CHARS, identifier)
+    set_transitions(int_literal, DIGITS, int_literal)
+
+    for text, kind in literals.items():
+        data = text.encode("ascii")
+        is_word = data[0] in WORD_START and all(c in WORD_CHARS for c in data)
+        if not is_word and any(c in WORD_CHARS for c in data[:1]):
+            raise ValueError(f"Token text {text!r} overlaps identifiers or literals")
+
+        state = START
+        for c in data:
+            target = transitions[state << 8 | c]
+            if target == DEAD or target == identifier:
+                # Keyword prefixes stay identifiers until the keyword is complete
+                target = new_state("identifier" if is_word else None)
+                if is_word:
+                    set_transitions(target, WORD_CHARS, identifier)
+                transitions[state << 8 | c] = target
+            state = target
+        accepts[state] = kind_index(kind)
+
+    return Dfa(transitions, accepts, kinds)
+
+
+DFA = build_dfa(KINDS)
+
+
+def scan(
+    data: bytes | bytearray | memoryview, dfa: Dfa = DFA
+) -> Iterator[tuple[Kind, int, int]]:
+    """
+    Yield `(kind, start, end)` for the longest token at each position.
+
+    Bytes that don't start a token are skipped, like the regex tokenizer
+    skips unmatched characters. Line breaks are yielded with kind "other"
+    so callers can track lines.
+    """
+    view = memoryview(data).cast("B")
+    transitions = dfa.transitions
+    accepts = dfa.accepts
+    kinds = dfa.kinds
+    n = len(view)
+    pos = 0
+    while pos < n:
+        state = START
+        i = pos
+        accepted = 0
+        end = pos
+        while i < n:
+            state = transitions[state << 8 | view[i]]
+            if state == DEAD:
+                break
+            i += 1
+            if accepts[state]:
+                accepted = accepts[state]
+                end = i
+
+        if accepted:
+            yield kinds[accepted], pos, end
+            pos = end
+        else:
+            c = view[pos]
+            start = pos
+            pos += 1
+            if c in LINE_BREAKS:
+                if c == 13 and pos < n and view[pos] == 10:
+                    pos += 1
+                yield "other", start, pos
+
+
+def tokenize_bytes(
+    data: bytes | bytearray | memoryview, dfa: Dfa = DFA
+) -> list[Token]:
+    """Tokenize ASCII source code with the DFA scanner."""
+    # Same loop as `scan`, inlined with the comment handling since this is
+    # the hot path. Plain lists index faster than arrays.
+    view = memoryview(data).cast("B")
+    transitions = dfa.transitions.tolist()
+    accepts = dfa.accepts.tolist()
+    kinds = dfa.kinds
+    comment = kind_code(dfa, "comment")
+    comment_start = kind_code(dfa, "comment_start")
+    comment_end = kind_code(dfa, "comment_end")
+    texts: dict[bytes, str] = {}
+
+    tokens: list[Token] = []
+    index = LineIndex()
+    index.starts.append(0)
+    multi_comment = False
+    n = len(view)
+    pos = 0
+    while pos < n:
+        state = START
+        i = pos
+        accepted = 0
+        end = pos
+        while i < n:
+            state = transitions[state << 8 | view[i]]
+            if state == DEAD:
+                break
+            i += 1
+            if accepts[state]:
+                accepted = accepts[state]
+                end = i
+
+        if not accepted:
+            c = view[pos]
+            pos += 1
+            if c in LINE_BREAKS:
+                if c == 13 and pos < n and view[pos] == 10:
+                    pos += 1
+                index.starts.append(pos)
+            continue
+
+        start = pos
+        pos = end
+        if multi_comment:
+            if accepted == comment_end:
+                multi_comment = False
+        elif accepted == comment:
+            # Skip to the line break, which is handled as usual
+            while pos < n and view[pos] not in LINE_BREAKS:
+                pos += 1
+        elif accepted == comment_start:
+            multi_comment = True
+        else:
+            raw = view[start:end].tobytes()
+            text = texts.get(raw)
+            if text is None:
+                text = texts[raw] = intern(raw.decode("ascii"))
+            span = start << SPAN_BITS | end
+            tokens.append(Token(text, kinds[accepted], span, index))
+
+    return tokens
+
+
+def kind_code(dfa: Dfa, kind: Kind) -> int:
+    """Index of `kind` in the accept table, -1 if no state accepts it."""
+    return dfa.kinds.index(kind) if kind in dfa.kinds else -1
@@ -8,3 +8,20 @@ class UnexpectedTokenError(Exception):
 
 class MissingTokenError(Exception):
     pass
+
+
+class LimitExceededError(Exception):
+    """A request went over one of the configured `Limits`."""
+
+    def __init__(self, message: str, limit: str, maximum: int | float) -> None:
+        # All in args, so the error survives pickling out of a pool worker
+        super().__init__(message, limit, maximum)
+        self.limit = limit
+        self.maximum = maximum
+
+    def __str__(self) -> str:
+        return str(self.args[0])
+
+
+class EvaluationError(Exception):
+    """A program failed while running, like dividing by zero."""
@@ -0,0 +1,243 @@
+import compiler.ast as ast
+
+"""
+Constant folding and algebraic simplification.
+
+Operators on constants are evaluated with the language's semantics:
+integers are 64-bit two's complement and wrap on overflow, `/` truncates
+toward zero, and `%` takes the sign of the dividend. The identifiers
+`true` and `false` are the boolean constants. `if` expressions whose
+condition is a constant are replaced by the branch taken, `and` and `or`
+short-circuit on a constant left side, and identities like `x + 0` and
+`x * 1` are reduced to `x`.
+
+Nothing that could fail or have an effect at run time is removed:
+division by a constant zero is left for run time, and an operand is only
+dropped when the language wouldn't have evaluated it either. There is no
+type checker yet, so the pass tracks the types it can tell without one,
+like an arithmetic result being an int. `x + 0` becomes `x` and
+`true and c` becomes `c` only when `x` is known to be an int and `c` a
+bool, so type errors like `true + 0` still reach run time.
+"""
+
+INT_BITS = 64
+INT_MIN = -(1 << (INT_BITS - 1))
+BOOLEANS = {"true": True, "false": False}
+
+ARITHMETIC = {"+", "-", "*", "/", "%"}
+ORDERING = {"<", "<=", ">", ">="}
+EQUALITY = {"==", "!="}
+
+# Operators with a neutral operand: (operand, whether it may be on the left)
+IDENTITIES = {
+    "+": (0, True),
+    "-": (0, False),
+    "*": (1, True),
+    "/": (1, False),
+}
+
+
+INT = "int"
+BOOL = "bool"
+UNIT = "unit"
+
+# The type of an operator's result, if it has one
+RESULT_TYPES = {op: INT for op in ARITHMETIC} | {
+    op: BOOL for op in ORDERING | EQUALITY | {"and", "or"}
+}
+
+# A folded node: the replacement, the original's and replacement's sizes
+# as trees, and the replacement's type, or None if it isn't known
+Folded = tuple[ast.Expression, int, int, str | None]
+
+
+def wrap(value: int) -> int:
+    """`value` as a 64-bit two's complement integer."""
+    return (value - INT_MIN) % (1 << INT_BITS) + INT_MIN
+
+
+def constant(expr: ast.Expression) -> int | bool | None:
+    if isinstance(expr, ast.Literal):
+        value = expr.value
+        return wrap(value) if type(value) is int else value
+    if isinstance(expr, ast.Identifier):
+        return BOOLEANS.get(expr.name)
+    return None
+
+
+def evaluate(op: str, left: int | bool, right: int | bool) -> int | bool | None:
+    """The value of `left op right`, or None if it can't be folded."""
+    # bool is a subclass of int, so types are compared exactly
+    if type(left) is not type(right):
+        return None
+    if op in EQUALITY:
+        return (left == right) == (op == "==")
+    if type(left) is bool:
+        if op == "and":
+            return left and right
+        if op == "or":
+            return left or right
+        return None
+
+    if op in ORDERING:
+        match op:
+            case "<":
+                return left < right
+            case "<=":
+                return left <= right
+            case ">":
+                return left > right
+            case _:
+                return left >= right
+    if op not in ARITHMETIC:
+        return None
+    match op:
+        case "+":
+            return wrap(left + right)
+        case "-":
+            return wrap(left - right)
+        case "*":
+            return wrap(left * right)
+    if right == 0:
+        # A run-time error, not a compile-time one
+        return None
+    quotient = abs(left) // abs(right)
+    if (left < 0) != (right < 0):
+        quotient = -quotient
+    if op == "/":
+        return wrap(quotient)
+    return wrap(left - right * quotient)
+
+
+def fold_constants(expr: ast.Expression) -> tuple[ast.Expression, int]:
+    """
+    Fold and simplify `expr`, returning the new tree and how many nodes
+    were removed. Unchanged subtrees are returned as they are, so shared
+    subtrees stay shared.
+    """
+    folded: dict[int, Folded] = {}
+    # Post-order with an explicit stack, so deep trees are fine
+    stack: list[tuple[ast.Expression, bool]] = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in folded:
+            continue
+        if not children_done:
+            if isinstance(node, (ast.Literal, ast.Identifier)):
+                folded[id(node)] = (node, 1, 1, _type_of(constant(node)))
+                continue
+            stack.append((node, True))
+            if isinstance(node, ast.BinaryOp):
+                stack += [(node.right, False), (node.left, False)]
+            elif isinstance(node, ast.IfThen):
+                stack += [(node.then_branch, False), (node.condition, False)]
+            elif isinstance(node, ast.IfThenElse):
+                stack += [
+                    (node.else_branch, False),
+                    (node.then_branch, False),
+                    (node.condition, False),
+                ]
+            else:
+                raise Exception(f"Unknown AST node: {node}")
+            continue
+
+        if isinstance(node, ast.BinaryOp):
+            folded[id(node)] = _fold_binary_op(
+                node, folded[id(node.left)], folded[id(node.right)]
+            )
+        elif isinstance(node, ast.IfThen):
+            folded[id(node)] = _rebuild(
+                node,
+                [folded[id(node.condition)], folded[id(node.then_branch)]],
+                UNIT,
+            )
+        elif isinstance(node, ast.IfThenElse):
+            folded[id(node)] = _fold_if_then_else(
+                node,
+                folded[id(node.condition)],
+                folded[id(node.then_branch)],
+                folded[id(node.else_branch)],
+            )
+
+    result, size, new_size, _ = folded[id(expr)]
+    return result, size - new_size
+
+
+def _type_of(value: int | bool | None) -> str | None:
+    if value is None:
+        return None
+    return BOOL if type(value) is bool else INT
+
+
+def _rebuild(
+    node: ast.Expression, children: list[Folded], result_type: str | None
+) -> Folded:
+    """`node` with its children replaced, or `node` itself if none changed."""
+    size = 1 + sum(child[1] for child in children)
+    new_size = 1 + sum(child[2] for child in children)
+    new = [child[0] for child in children]
+    match node:
+        case ast.BinaryOp(left, op, right):
+            if new[0] is not left or new[1] is not right:
+                node = ast.BinaryOp(new[0], op, new[1])
+        case ast.IfThen(condition, then_branch):
+            if new[0] is not condition or new[1] is not then_branch:
+                node = ast.IfThen(new[0], new[1])
+        case ast.IfThenElse(condition, then_branch, else_branch):
+            if (
+                new[0] is not condition
+                or new[1] is not then_branch
+                or new[2] is not else_branch
+            ):
+                node = ast.IfThenElse(new[0], new[1], new[2])
+    return node, size, new_size, result_type
+
+
+def _fold_binary_op(node: ast.BinaryOp, left: Folded, right: Folded) -> Folded:
+    op = node.op
+    size = 1 + left[1] + right[1]
+    left_value = constant(left[0])
+    right_value = constant(right[0])
+    if left_value is not None and right_value is not None:
+        value = evaluate(op, left_value, right_value)
+        if value is not None:
+            return ast.Literal(value), size, 1, _type_of(value)
+
+    # The right side of `and` and `or` is only evaluated when the left one
+    # doesn't decide the result, and otherwise it must be a bool
+    if type(left_value) is bool and op in ("and", "or"):
+        if left_value == (op == "or"):
+            return left[0], size, left[2], BOOL
+        if right[3] == BOOL:
+            return right[0], size, right[2], BOOL
+
+    # The remaining operand must be an int for the operator not to fail
+    if op in IDENTITIES:
+        neutral, commutes = IDENTITIES[op]
+        if type(right_value) is int and right_value == neutral and left[3] == INT:
+            return left[0], size, left[2], INT
+        if (
+            commutes
+            and type(left_value) is int
+            and left_value == neutral
+            and right[3] == INT
+        ):
+            return right[0], size, right[2], INT
+
+    result_type = right[3] if op == "=" else RESULT_TYPES.get(op)
+    return _rebuild(node, [left, right], result_type)
+
+
+def _fold_if_then_else(
+    node: ast.IfThenElse,
+    condition: Folded,
+    then_branch: Folded,
+    else_branch: Folded,
+) -> Folded:
+    value = constant(condition[0])
+    if type(value) is bool:
+        size = 1 + condition[1] + then_branch[1] + else_branch[1]
+        taken = then_branch if value else else_branch
+        return taken[0], size, taken[2], taken[3]
+    result_type = then_branch[3] if then_branch[3] == else_branch[3] else None
+    return _rebuild(node, [condition, then_branch, else_branch], result_type)
@@ -0,0 +1,150 @@
+import compiler.ast as ast
+
+"""
+Hash-consing for AST nodes.
+
+A `HashConsTable` hands out one canonical instance per distinct subtree,
+so structurally equal subtrees are the same object: equality is an
+identity check, repeated subexpressions are stored once, and passes can
+memoize results by node identity. Canonical nodes are shared and must not
+be mutated.
+"""
+
+
+class HashConsTable:
+    """
+    Canonical AST nodes, with the same constructor methods as `AstArena`
+    so `parse` can build through it.
+    """
+
+    def __init__(self) -> None:
+        # Children are canonical, so keying on their ids is structural
+        self.nodes: dict[tuple, ast.Expression] = {}
+        self.hashes: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def _add(
+        self, key: tuple, node_hash: int, node: ast.Expression
+    ) -> ast.Expression:
+        self.nodes[key] = node
+        self.hashes[id(node)] = node_hash
+        return node
+
+    def literal(self, value: int | bool) -> ast.Expression:
+        # The type keeps True and 1 apart
+        key = (ast.Literal, type(value), value)
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        return self._add(key, hash(key), ast.Literal(value))
+
+    def identifier(self, name: str) -> ast.Expression:
+        key = (ast.Identifier, name)
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        return self._add(key, hash(key), ast.Identifier(name))
+
+    def binary_op(
+        self, left: ast.Expression, op: str, right: ast.Expression
+    ) -> ast.Expression:
+        key = (ast.BinaryOp, id(left), op, id(right))
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        node_hash = hash((ast.BinaryOp, self.hash(left), op, self.hash(right)))
+        return self._add(key, node_hash, ast.BinaryOp(left, op, right))
+
+    def if_then(
+        self, condition: ast.Expression, then_branch: ast.Expression
+    ) -> ast.Expression:
+        key = (ast.IfThen, id(condition), id(then_branch))
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        node_hash = hash((ast.IfThen, self.hash(condition), self.hash(then_branch)))
+        return self._add(key, node_hash, ast.IfThen(condition, then_branch))
+
+    def if_then_else(
+        self,
+        condition: ast.Expression,
+        then_branch: ast.Expression,
+        else_branch: ast.Expression,
+    ) -> ast.Expression:
+        key = (ast.IfThenElse, id(condition), id(then_branch), id(else_branch))
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        node_hash = hash(
+            (
+                ast.IfThenElse,
+                self.hash(condition),
+                self.hash(then_branch),
+                self.hash(else_branch),
+            )
+        )
+        node = ast.IfThenElse(condition, then_branch, else_branch)
+        return self._add(key, node_hash, node)
+
+    def hash(self, node: ast.Expression) -> int:
+        """Structural hash of a canonical node, computed when it was built."""
+        return self.hashes[id(node)]
+
+    def is_canonical(self, node: ast.Expression) -> bool:
+        return id(node) in self.hashes
+
+    def equal(self, a: ast.Expression, b: ast.Expression) -> bool:
+        """Structural equality, O(1) when both nodes are canonical."""
+        if self.is_canonical(a) and self.is_canonical(b):
+            return a is b
+        return a == b
+
+    def intern(self, expr: ast.Expression) -> ast.Expression:
+        """Return the canonical version of an existing tree."""
+        canonical: dict[int, ast.Expression] = {}
+        # Post-order with an explicit stack, so deep trees are fine
+        stack: list[tuple[ast.Expression, bool]] = [(expr, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if id(node) in canonical:
+                continue
+            if not children_done:
+                stack.append((node, True))
+                match node:
+                    case ast.BinaryOp(left, _, right):
+                        stack += [(right, False), (left, False)]
+                    case ast.IfThen(condition, then_branch):
+                        stack += [(then_branch, False), (condition, False)]
+                    case ast.IfThenElse(condition, then_branch, else_branch):
+                        stack += [
+                            (else_branch, False),
+                            (then_branch, False),
+                            (condition, False),
+                        ]
+                continue
+
+            match node:
+                case ast.Literal(value):
+                    result = self.literal(value)
+                case ast.Identifier(name):
+                    result = self.identifier(name)
+                case ast.BinaryOp(left, op, right):
+                    result = self.binary_op(
+                        canonical[id(left)], op, canonical[id(right)]
+                    )
+                case ast.IfThen(condition, then_branch):
+                    result = self.if_then(
+                        canonical[id(condition)], canonical[id(then_branch)]
+                    )
+                case ast.IfThenElse(condition, then_branch, else_branch):
+                    result = self.if_then_else(
+                        canonical[id(condition)],
+                        canonical[id(then_branch)],
+                        canonical[id(else_branch)],
+                    )
+                case _:
+                    raise Exception(f"Unknown AST node: {node}")
+            canonical[id(node)] = result
+        return canonical[id(expr)]
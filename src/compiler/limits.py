@@ -0,0 +1,158 @@
+import signal
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import FrameType
+from typing import Iterable, Iterator
+
+import compiler.ast as ast
+from compiler.errors import LimitExceededError
+from compiler.utils import Token
+
+"""
+Per-request resource limits for serve mode.
+
+Like metrics, the limits are installed for the process and inherited by
+forked workers, and the checks do nothing while none are installed. Each
+check raises `LimitExceededError` as early as its quantity is known: the
+request size while reading it, the source size before compiling, the
+token count after tokenizing, and the AST depth after parsing, before any
+later pass walks the tree.
+"""
+
+# Bytes a request may take besides its source's, for the rest of the JSON
+REQUEST_OVERHEAD = 64 << 10
+# The most bytes a source byte can take in JSON, like \u0000
+ESCAPED_SIZE = 6
+
+
+@dataclass
+class Limits:
+    max_source_bytes: int | None = None
+    max_tokens: int | None = None
+    max_depth: int | None = None
+    # Wall-clock seconds per compile
+    deadline: float | None = None
+
+
+_installed = Limits()
+
+
+def install(limits: Limits) -> None:
+    global _installed
+    _installed = limits
+
+
+def installed() -> Limits:
+    return _installed
+
+
+def max_request_bytes() -> int | None:
+    """
+    The size of the largest request that could hold a source within
+    `max_source_bytes`, or None without a limit. Servers read at most one
+    byte more, so they reject larger requests without buffering them.
+    """
+    maximum = _installed.max_source_bytes
+    if maximum is None:
+        return None
+    return ESCAPED_SIZE * maximum + REQUEST_OVERHEAD
+
+
+def check_request(size: int) -> None:
+    maximum = _installed.max_source_bytes
+    request_maximum = max_request_bytes()
+    if maximum is not None and request_maximum is not None and size > request_maximum:
+        raise LimitExceededError(
+            f"Request is over {request_maximum} bytes, too large for a source"
+            f" within the limit of {maximum}",
+            "max_source_bytes",
+            maximum,
+        )
+
+
+def check_source(source_code: str) -> None:
+    maximum = _installed.max_source_bytes
+    # A character is one to four bytes, so most sources skip encoding
+    if maximum is not None and 4 * len(source_code) > maximum:
+        size = len(source_code.encode())
+        if size > maximum:
+            raise LimitExceededError(
+                f"Source is {size} bytes, over the limit of {maximum}",
+                "max_source_bytes",
+                maximum,
+            )
+
+
+def check_tokens(count: int) -> None:
+    maximum = _installed.max_tokens
+    if maximum is not None and count > maximum:
+        raise LimitExceededError(
+            f"Over the limit of {maximum} tokens", "max_tokens", maximum
+        )
+
+
+def counted(tokens: Iterable[Token]) -> Iterable[Token]:
+    """`tokens`, checking the token limit as they are produced."""
+    if _installed.max_tokens is None:
+        return tokens
+    return _counted(tokens)
+
+
+def _counted(tokens: Iterable[Token]) -> Iterator[Token]:
+    for count, token in enumerate(tokens, 1):
+        check_tokens(count)
+        yield token
+
+
+def check_depth(expr: ast.Expression) -> None:
+    maximum = _installed.max_depth
+    if maximum is None:
+        return
+    stack = [(expr, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if depth > maximum:
+            raise LimitExceededError(
+                f"Expression nesting is over the limit of {maximum}",
+                "max_depth",
+                maximum,
+            )
+        match node:
+            case ast.BinaryOp(left, _, right):
+                stack += [(left, depth + 1), (right, depth + 1)]
+            case ast.IfThen(condition, then_branch):
+                stack += [(condition, depth + 1), (then_branch, depth + 1)]
+            case ast.IfThenElse(condition, then_branch, else_branch):
+                stack += [
+                    (condition, depth + 1),
+                    (then_branch, depth + 1),
+                    (else_branch, depth + 1),
+                ]
+
+
+@contextmanager
+def deadline() -> Iterator[None]:
+    """
+    Raise `LimitExceededError` in the block once the deadline has passed.
+    Uses SIGALRM, so it only applies in the main thread.
+    """
+    seconds = _installed.deadline
+    if seconds is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum: int, frame: FrameType | None) -> None:
+        raise LimitExceededError(
+            f"Compilation took over the limit of {seconds} seconds",
+            "deadline",
+            seconds,
+        )
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
@@ -0,0 +1,205 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Iterator
+
+"""
+Latency histograms and counters for serve mode.
+
+Durations are counted in power-of-two buckets of nanoseconds held in shared
+memory, so forked server workers and compile processes all add to the same
+histograms, and recording one costs a lock and two additions. The module
+functions record into the installed `Metrics` and do nothing when there is
+none, so the compiler can be instrumented unconditionally.
+"""
+
+READ = 0
+DECODE = 1
+TOKENIZE = 2
+PARSE = 3
+COMPILE = 4
+ENCODE = 5
+SEND = 6
+REQUEST = 7
+INTERPRET = 8
+PHASES = [
+    "read",
+    "decode",
+    "tokenize",
+    "parse",
+    "compile",
+    "encode",
+    "send",
+    "request",
+    "interpret",
+]
+
+REQUESTS = 0
+ERRORS = 1
+ACTIVE = 2
+BUSY = 3
+COUNTERS = ["requests", "errors", "active", "busy"]
+
+# Bucket i counts durations of less than 2**i nanoseconds, and the last
+# bucket everything longer
+BUCKETS = 40
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+class Metrics:
+    def __init__(
+        self, export_path: str | None = None, export_interval: float = 1.0
+    ) -> None:
+        self.histograms = multiprocessing.Array("q", len(PHASES) * BUCKETS)
+        # Updated under the histograms' lock
+        self.totals = multiprocessing.Array("q", len(PHASES), lock=False)
+        self.counters = multiprocessing.Array("q", len(COUNTERS))
+        self.started = time.time()
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.exported = multiprocessing.Value("d", 0.0)
+
+    def observe(self, phase: int, nanoseconds: int) -> None:
+        bucket = min(nanoseconds.bit_length(), BUCKETS - 1)
+        with self.histograms.get_lock():
+            self.histograms[phase * BUCKETS + bucket] += 1
+            self.totals[phase] += nanoseconds
+
+    @contextmanager
+    def timed(self, phase: int) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter_ns() - start)
+
+    def count(self, counter: int, n: int = 1) -> None:
+        with self.counters.get_lock():
+            self.counters[counter] += n
+
+    def buckets(self, phase: int) -> list[int]:
+        with self.histograms.get_lock():
+            return self.histograms[phase * BUCKETS : (phase + 1) * BUCKETS]
+
+    def quantile(self, phase: int, q: float) -> float:
+        """Upper bound in seconds of the bucket holding the `q` quantile."""
+        counts = self.buckets(phase)
+        target = q * sum(counts)
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if count > 0 and seen >= target:
+                return 2**bucket / 1e9
+        return 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        uptime = time.time() - self.started
+        result: dict[str, Any] = dict(zip(COUNTERS, self.counters[:]))
+        result["uptime_seconds"] = round(uptime, 3)
+        result["throughput"] = round(result["requests"] / uptime, 3)
+        phases = {}
+        for phase, name in enumerate(PHASES):
+            count = sum(self.buckets(phase))
+            if count == 0:
+                continue
+            mean_ms = self.totals[phase] / count / 1e6
+            phases[name] = {"count": count, "mean_ms": round(mean_ms, 6)}
+            for q in QUANTILES:
+                quantile_ms = self.quantile(phase, q) * 1e3
+                phases[name][f"p{round(q * 100)}_ms"] = round(quantile_ms, 6)
+        result["phases"] = phases
+        return result
+
+    def prometheus(self, gauges: dict[str, int] | None = None) -> str:
+        """The metrics in Prometheus text format, with `gauges` added."""
+        lines = ["# TYPE compiler_phase_seconds histogram"]
+        for phase, name in enumerate(PHASES):
+            metric = "compiler_phase_seconds"
+            label = f'phase="{name}"'
+            buckets = self.buckets(phase)
+            seen = 0
+            for bucket, count in enumerate(buckets[:-1]):
+                seen += count
+                le = f"{2**bucket / 1e9:g}"
+                lines.append(f'{metric}_bucket{{{label},le="{le}"}} {seen}')
+            lines += [
+                f'{metric}_bucket{{{label},le="+Inf"}} {sum(buckets)}',
+                f"{metric}_sum{{{label}}} {self.totals[phase] / 1e9}",
+                f"{metric}_count{{{label}}} {sum(buckets)}",
+            ]
+        counters = dict(zip(COUNTERS, self.counters[:]))
+        for name in ["requests", "errors", "busy"]:
+            lines += [
+                f"# TYPE compiler_{name}_total counter",
+                f"compiler_{name}_total {counters[name]}",
+            ]
+        gauges = {"active_requests": counters["active"]} | (gauges or {})
+        for name, value in gauges.items():
+            lines += [f"# TYPE compiler_{name} gauge", f"compiler_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def export(self, gauges: dict[str, int] | None = None) -> None:
+        """Write the Prometheus text to `export_path`, replacing it atomically."""
+        assert self.export_path is not None
+        directory = os.path.dirname(os.path.abspath(self.export_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.prometheus(gauges))
+            os.replace(temp_path, self.export_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def maybe_export(self, gauges: Callable[[], dict[str, int]]) -> None:
+        """Export if there is a path and the last export is old enough."""
+        if self.export_path is None:
+            return
+        now = time.time()
+        with self.exported.get_lock():
+            if now - self.exported.value < self.export_interval:
+                return
+            self.exported.value = now
+        self.export(gauges())
+
+
+_installed: Metrics | None = None
+_untimed: ContextManager[None] = nullcontext()
+
+
+def install(metrics: Metrics | None) -> None:
+    """Record into `metrics` from now on, also in processes forked later."""
+    global _installed
+    _installed = metrics
+
+
+def installed() -> Metrics | None:
+    return _installed
+
+
+def timed(phase: int) -> ContextManager[None]:
+    if _installed is None:
+        return _untimed
+    return _installed.timed(phase)
+
+
+def count(counter: int, n: int = 1) -> None:
+    if _installed is not None:
+        _installed.count(counter, n)
+
+
+@contextmanager
+def request() -> Iterator[None]:
+    """Count a request and time it, tracking how many are in progress."""
+    if _installed is None:
+        yield
+        return
+    _installed.count(REQUESTS)
+    _installed.count(ACTIVE)
+    try:
+        with _installed.timed(REQUEST):
+            yield
+    finally:
+        _installed.count(ACTIVE, -1)
@@ -1,6 +1,11 @@
+from typing import Callable, Iterable, Iterator
+
 import compiler.ast as ast
 from compiler.errors import EmptyInputError, UnexpectedTokenError, MissingTokenError
-from compiler.utils import Token
+from compiler.hashcons import HashConsTable
+from compiler.token_buffer import TokenBuffer
+from compiler.tracing import Tracer
+from compiler.utils import Kind, Token
 
 """
 TODO:: todo
@@ -19,7 +24,30 @@ LEFT_ACCOSIATIVE_OPS = [
     ["+", "-"],
     ["*", "/", "%"],
 ]
-MAX_PRECEDENCE = len(LEFT_ACCOSIATIVE_OPS) - 1
+
+# Binding power of each binary operator: the right associative operators
+# bind looser than all left associative ones
+PRECEDENCE: dict[str, int] = {
+    op: level
+    for level, ops in enumerate(RIGHT_ASSOCIATIVE_OPS + LEFT_ACCOSIATIVE_OPS)
+    for op in ops
+}
+RIGHT_ASSOCIATIVE = {op for ops in RIGHT_ASSOCIATIVE_OPS for op in ops}
+
+# Stages of an open if-expression on the frame stack
+IF = "if"
+THEN = "then"
+ELSE = "else"
+ELSE_WITHOUT_THEN = "else without then"
+
+# Production names reported to tracers, by frame
+PRODUCTIONS = {
+    "(": "parenthesized",
+    IF: "conditional",
+    THEN: "conditional",
+    ELSE: "conditional",
+    ELSE_WITHOUT_THEN: "conditional",
+}
 
 
 def raise_error(token: Token) -> None:
@@ -36,147 +64,258 @@ def raise_error(token: Token) -> None:
     raise UnexpectedTokenError(f"{token.loc}: Unexpected token")
 
 
-def parse(tokens: list[Token]) -> ast.Expression:
-    pos = 0
-    open_parantheses = 0
-    open_ifs = 0
-
-    def peek() -> Token:
-        if pos < len(tokens):
-            print("peeking at:", pos, tokens[pos].text)
-            return tokens[pos]
-        elif pos == 0:
-            raise EmptyInputError("Input string is empty")
-        else:
-            return Token(
-                text="",
-                kind="end",
-                loc=tokens[-1].loc,
-            )
+# Tokens the parser can look ahead of the one it is at
+LOOKAHEAD = 1
 
-    def consume(expected: str | list[str] | None = None) -> Token:
-        nonlocal pos
-        token = peek()
-        print("consumed at:", pos, token.text)
-        if isinstance(expected, str) and token.text != expected:
-            raise UnexpectedTokenError(f'{token.loc}: expected "{expected}"')
-        if isinstance(expected, list) and token.text not in expected:
-            comma_separated = ", ".join([f'"{e}"' for e in expected])
-            raise UnexpectedTokenError(
-                f"{token.loc}: expected one of: {comma_separated}"
-            )
-        pos += 1
-        return token
 
-    def parse_int_literal() -> ast.Literal:
-        token = consume()
-        if token.kind != "int_literal":
-            raise UnexpectedTokenError(f"{token.loc}: expected an integer literal")
-        return ast.Literal(int(token.text))
+class Lookahead:
+    """
+    Bounded window over a token iterator. Tokens are pulled as the parser
+    peeks at them and dropped from the ring once `size` newer ones have
+    been read, so they can be freed as soon as they are consumed.
+    """
 
-    def parse_identifier() -> ast.Identifier:
-        token = consume()
-        if token.kind != "identifier":
-            raise UnexpectedTokenError(f"{token.loc}: expected an identifier")
-        return ast.Identifier(token.text)
+    def __init__(self, tokens: Iterable[Token], size: int = LOOKAHEAD + 1) -> None:
+        self.tokens: Iterator[Token] = iter(tokens)
+        self.ring: list[Token | None] = [None] * size
+        self.read = 0
+        self.end: Token | None = None
 
-    def parse_conditional() -> ast.Expression:
-        nonlocal open_ifs
+    def __getitem__(self, i: int) -> Token:
+        while i >= self.read and self.end is None:
+            token = next(self.tokens, None)
+            if token is not None:
+                self.ring[self.read % len(self.ring)] = token
+                self.read += 1
+            elif self.read == 0:
+                raise EmptyInputError("Input string is empty")
+            else:
+                last = self[self.read - 1]
+                self.end = Token("", "end", last.span, last.lines)
 
-        then_branch = None
-        else_branch = None
+        if self.end is not None and i >= self.read:
+            return self.end
+        token = self.ring[i % len(self.ring)]
+        if i < self.read - len(self.ring) or token is None:
+            raise IndexError(f"Token {i} is outside the lookahead window")
+        return token
 
-        if peek().text == "if":
-            consume("if")
-            open_ifs += 1
-            condition = parse_expression()
 
-        if peek().text == "then":
-            consume("then")
-            then_branch = parse_expression()
-        if peek().text == "else":
-            consume("else")
-            else_branch = parse_expression()
+def parse(
+    tokens: list[Token] | TokenBuffer | Iterable[Token],
+    tracer: Tracer | None = None,
+    hash_cons: HashConsTable | None = None,
+) -> ast.Expression:
+    """
+    Parse a token list or buffer, or consume any other token iterable
+    through a `Lookahead` window without keeping the consumed tokens.
 
-        open_ifs -= 1
+    With `hash_cons`, nodes are built through the table, so structurally
+    equal subtrees are shared.
+    """
+    pos = 0
 
-        if then_branch is None:
-            raise MissingTokenError(f"{peek().loc}: Missing then branch")
+    make_literal: Callable[[int], ast.Expression] = ast.Literal
+    make_identifier: Callable[[str], ast.Expression] = ast.Identifier
+    make_binary_op: Callable[
+        [ast.Expression, str, ast.Expression], ast.Expression
+    ] = ast.BinaryOp
+    make_if_then: Callable[[ast.Expression, ast.Expression], ast.Expression] = (
+        ast.IfThen
+    )
+    make_if_then_else: Callable[
+        [ast.Expression, ast.Expression, ast.Expression], ast.Expression
+    ] = ast.IfThenElse
+    if hash_cons is not None:
+        make_literal = hash_cons.literal
+        make_identifier = hash_cons.identifier
+        make_binary_op = hash_cons.binary_op
+        make_if_then = hash_cons.if_then
+        make_if_then_else = hash_cons.if_then_else
 
-        elif else_branch is None:
-            return ast.IfThen(condition, then_branch)
-        else:
-            return ast.IfThenElse(condition, then_branch, else_branch)
-
-    def parse_parenthesized() -> ast.Expression:
-        nonlocal open_parantheses
-        consume("(")
-        open_parantheses += 1
-        expr = parse_expression()
-        consume(")")
-        open_parantheses -= 1
-        return expr
-
-    def parse_factor() -> ast.Expression:
-        match peek().kind:
-            case "conditional":
-                print("CONDITIONAL")
-                return parse_conditional()
-            case "punctuator":
-                print("PUNCTUATOR", pos)
-                if peek().text == "(":
-                    return parse_parenthesized()
-                if peek().text == ")":
-                    print("ERROR")
-                    raise UnexpectedTokenError(
-                        f"{peek().loc}: Unexpected closing parenthesis"
-                    )
-                raise Exception(f"{peek().loc}: Unimplemented punctuator")
-            case "int_literal":
-                print("INT LITERAL")
-                return parse_int_literal()
-            case "identifier":
-                print("IDENTIFIER")
-                return parse_identifier()
-
-            case _:
-                raise UnexpectedTokenError(f"{peek().loc}: Invalid token")
-
-    def parse_term(level: int) -> ast.Expression:
-        if level is MAX_PRECEDENCE:
-            left = parse_factor()
+    if isinstance(tokens, (list, TokenBuffer)):
+        sequence = tokens
+        # Kinds and texts are read by index, so a TokenBuffer never has to
+        # build Token objects except for error messages
+        kind_at: Callable[[int], Kind]
+        text_at: Callable[[int], str]
+        if isinstance(sequence, TokenBuffer):
+            kind_at, text_at = sequence.kind, sequence.text
         else:
-            left = parse_term(level + 1)
-
-        while peek().text in LEFT_ACCOSIATIVE_OPS[level]:
-            print("curr ops: ", LEFT_ACCOSIATIVE_OPS[level])
-            operator_token = consume()
-            operator = operator_token.text
+            token_list = sequence
+            kind_at = lambda i: token_list[i].kind
+            text_at = lambda i: token_list[i].text
+        token_count = len(sequence)
 
-            print("RIGHT")
-            if level is MAX_PRECEDENCE:
-                right = parse_factor()
+        def peek() -> Token:
+            if pos < token_count:
+                return sequence[pos]
+            elif pos == 0:
+                raise EmptyInputError("Input string is empty")
             else:
-                right = parse_term(level + 1)
+                last = sequence[token_count - 1]
+                return Token("", "end", last.span, last.lines)
 
-            left = ast.BinaryOp(left, operator, right)
+        def peek_text() -> str:
+            if pos < token_count:
+                return text_at(pos)
+            return peek().text
 
-        if (
-            peek().kind not in ["operator", "end"]
-            and not open_parantheses
-            and not open_ifs
-        ):
-            print("Raising error at parse_term()")
-            raise_error(peek())
+        def peek_kind() -> Kind:
+            if pos < token_count:
+                return kind_at(pos)
+            return peek().kind
 
-        return left
+    else:
+        window = Lookahead(tokens)
+
+        def peek() -> Token:
+            return window[pos]
+
+        def peek_text() -> str:
+            return window[pos].text
+
+        def peek_kind() -> Kind:
+            return window[pos].kind
+
+    def consume(expected: str | list[str] | None = None) -> str:
+        nonlocal pos
+        text = peek_text()
+        if isinstance(expected, str) and text != expected:
+            raise UnexpectedTokenError(f'{peek().loc}: expected "{expected}"')
+        if isinstance(expected, list) and text not in expected:
+            comma_separated = ", ".join([f'"{e}"' for e in expected])
+            raise UnexpectedTokenError(
+                f"{peek().loc}: expected one of: {comma_separated}"
+            )
+        if tracer is not None:
+            tracer.consume(pos, text)
+        pos += 1
+        return text
+
+    def parse_int_literal() -> ast.Expression:
+        if peek_kind() != "int_literal":
+            raise UnexpectedTokenError(f"{peek().loc}: expected an integer literal")
+        if tracer is not None:
+            tracer.enter("int_literal", pos)
+            literal = make_literal(int(consume()))
+            tracer.exit("int_literal", pos)
+            return literal
+        return make_literal(int(consume()))
+
+    def parse_identifier() -> ast.Expression:
+        if peek_kind() != "identifier":
+            raise UnexpectedTokenError(f"{peek().loc}: expected an identifier")
+        if tracer is not None:
+            tracer.enter("identifier", pos)
+            identifier = make_identifier(consume())
+            tracer.exit("identifier", pos)
+            return identifier
+        return make_identifier(consume())
 
     def parse_expression() -> ast.Expression:
-        result = parse_term(level=0)
+        """
+        Operator precedence parser with explicit stacks instead of recursion,
+        so nesting depth is only limited by memory.
+        """
+        operands: list[ast.Expression] = []
+        # Pending binary operators, "(" and if-stages, innermost last
+        frames: list[str] = []
+
+        def reduce(precedence: int) -> None:
+            # Build the pending operators that bind at least this tight
+            while frames and PRECEDENCE.get(frames[-1], -1) >= precedence:
+                right = operands.pop()
+                operands[-1] = make_binary_op(operands[-1], frames.pop(), right)
+                if tracer is not None:
+                    tracer.exit("binary_op", pos)
+
+        def open_frame(frame: str) -> None:
+            if tracer is not None:
+                tracer.enter(PRODUCTIONS.get(frame, "binary_op"), pos)
+            frames.append(consume())
+
+        def close_frame(lookahead: bool = False) -> None:
+            frame = frames.pop()
+            if tracer is not None:
+                if lookahead:
+                    tracer.backtrack(PRODUCTIONS[frame], pos)
+                tracer.exit(PRODUCTIONS[frame], pos)
+
+        if tracer is not None:
+            tracer.enter("expression", pos)
 
-        if peek().kind not in ["end"] and not open_parantheses and not open_ifs:
-            print("Raising error at parse_expression()")
-            raise_error(peek())
-        return result
+        while True:
+            # Expecting an operand
+            match peek_kind():
+                case "int_literal":
+                    operands.append(parse_int_literal())
+                case "identifier":
+                    operands.append(parse_identifier())
+                case "punctuator":
+                    if peek_text() == "(":
+                        open_frame("(")
+                        continue
+                    if peek_text() == ")":
+                        raise UnexpectedTokenError(
+                            f"{peek().loc}: Unexpected closing parenthesis"
+                        )
+                    raise Exception(f"{peek().loc}: Unimplemented punctuator")
+                case "conditional":
+                    if peek_text() != "if":
+                        raise_error(peek())
+                    open_frame(IF)
+                    continue
+                case _:
+                    raise UnexpectedTokenError(f"{peek().loc}: Invalid token")
+
+            # Expecting an operator, or the end of the innermost frame
+            while True:
+                text = peek_text()
+                if text in PRECEDENCE:
+                    precedence = PRECEDENCE[text]
+                    reduce(precedence + 1 if text in RIGHT_ASSOCIATIVE else precedence)
+                    open_frame(text)
+                    break
+
+                reduce(0)
+                if not frames:
+                    if peek_kind() != "end":
+                        raise_error(peek())
+                    if tracer is not None:
+                        tracer.exit("expression", pos)
+                    return operands.pop()
+
+                frame = frames[-1]
+                if frame == "(":
+                    consume(")")
+                    close_frame()
+                elif frame == IF:
+                    if text == "then":
+                        consume("then")
+                        frames[-1] = THEN
+                        break
+                    if text == "else":
+                        consume("else")
+                        frames[-1] = ELSE_WITHOUT_THEN
+                        break
+                    raise MissingTokenError(f"{peek().loc}: Missing then branch")
+                elif frame == THEN:
+                    if text == "else":
+                        consume("else")
+                        frames[-1] = ELSE
+                        break
+                    close_frame(lookahead=True)
+                    then_branch = operands.pop()
+                    operands[-1] = make_if_then(operands[-1], then_branch)
+                elif frame == ELSE:
+                    close_frame(lookahead=True)
+                    else_branch = operands.pop()
+                    then_branch = operands.pop()
+                    operands[-1] = make_if_then_else(
+                        operands[-1], then_branch, else_branch
+                    )
+                else:
+                    raise MissingTokenError(f"{peek().loc}: Missing then branch")
 
     return parse_expression()
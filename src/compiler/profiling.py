@@ -0,0 +1,122 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import ContextManager, Iterator
+
+"""
+Per-phase timings and allocations for one compiler run.
+
+The compiler marks its phases with `phase(name)`, which does nothing
+unless a `Profiler` is installed, like the functions in `metrics`. With
+memory tracking on, tracemalloc records how much each phase allocated,
+the highest point it reached, and the source lines it allocated the
+most from.
+"""
+
+
+@dataclass
+class PhaseStats:
+    name: str
+    seconds: float = 0.0
+    # Bytes still allocated at the end of the phase, and the most at any
+    # point during it, relative to where it started
+    allocated: int = 0
+    peak: int = 0
+    # (file:line, bytes) of the largest net allocations
+    sites: list[tuple[str, int]] = field(default_factory=list)
+
+
+class Profiler:
+    def __init__(self, memory: bool = False, top: int = 5) -> None:
+        self.memory = memory
+        self.top = top
+        self.phases: list[PhaseStats] = []
+        self.peak = 0
+
+    def start(self) -> None:
+        if self.memory:
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        if self.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        stats = PhaseStats(name)
+        before = None
+        start_bytes = 0
+        if self.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds = time.perf_counter() - start
+            if before is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                stats.allocated = current - start_bytes
+                stats.peak = peak - start_bytes
+                self.peak = max(self.peak, peak)
+                stats.sites = self._sites(before)
+            self.phases.append(stats)
+
+    def _sites(self, before: tracemalloc.Snapshot) -> list[tuple[str, int]]:
+        sites: list[tuple[str, int]] = []
+        for diff in tracemalloc.take_snapshot().compare_to(before, "lineno"):
+            if len(sites) == self.top or diff.size_diff <= 0:
+                break
+            frame = diff.traceback[0]
+            # The snapshot taken before the phase
+            if frame.filename == tracemalloc.__file__:
+                continue
+            sites.append((f"{frame.filename}:{frame.lineno}", diff.size_diff))
+        return sites
+
+    def report(self) -> str:
+        total = sum(stats.seconds for stats in self.phases)
+        header = f"{'phase':<12}{'ms':>10}{'%':>7}"
+        if self.memory:
+            header += f"{'allocated KiB':>16}{'peak KiB':>12}"
+        lines = [header]
+        for stats in self.phases:
+            share = stats.seconds / total * 100 if total > 0 else 0.0
+            line = f"{stats.name:<12}{stats.seconds * 1e3:>10.3f}{share:>7.1f}"
+            if self.memory:
+                line += f"{stats.allocated / 1024:>16.1f}{stats.peak / 1024:>12.1f}"
+            lines.append(line)
+        lines.append(f"{'total':<12}{total * 1e3:>10.3f}")
+        if self.memory:
+            lines.append(f"peak traced memory: {self.peak / 1024:.1f} KiB")
+            for stats in self.phases:
+                if stats.sites:
+                    lines.append(f"top allocations in {stats.name}:")
+                    lines += [
+                        f"  {size / 1024:10.1f} KiB  {site}"
+                        for site, size in stats.sites
+                    ]
+        return "\n".join(lines)
+
+
+_installed: Profiler | None = None
+_unprofiled: ContextManager[None] = nullcontext()
+
+
+def install(profiler: Profiler | None) -> None:
+    global _installed
+    _installed = profiler
+
+
+def installed() -> Profiler | None:
+    return _installed
+
+
+def phase(name: str) -> ContextManager[None]:
+    if _installed is None:
+        return _unprofiled
+    return _installed.phase(name)
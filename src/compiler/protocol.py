@@ -0,0 +1,36 @@
+import json
+import struct
+from typing import Any, BinaryIO
+
+"""
+Wire format shared by the server and the client.
+
+Framed protocol: every message is a 4-byte big-endian length and then that
+many bytes of JSON. A legacy client's message starts with `{` or
+whitespace, which as a length would be far over MAX_FRAME_SIZE. Only the
+standard library is imported, so the client starts quickly.
+"""
+
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 << 20
+LEGACY_FIRST_BYTES = b"{ \t\r\n"
+
+
+def encode_frame(result: dict[str, Any]) -> bytes:
+    data = json.dumps(result).encode()
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def read_frame(file: BinaryIO) -> dict[str, Any]:
+    """Read one frame, raising EOFError if the stream ends first."""
+    header = file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError("Connection closed before a frame")
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Message too large: {size} bytes")
+    data = file.read(size)
+    if len(data) < size:
+        raise EOFError("Connection closed inside a frame")
+    result: dict[str, Any] = json.loads(data)
+    return result
@@ -0,0 +1,871 @@
+import asyncio
+from base64 import b64encode
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from socketserver import ForkingMixIn, StreamRequestHandler, TCPServer
+from traceback import format_exception
+from typing import Any, AsyncIterator, BinaryIO, Callable, Iterator
+
+from compiler.cache import CompileCache, compiler_version
+from compiler.errors import LimitExceededError
+import compiler.limits as limits
+import compiler.metrics as metrics
+from compiler.protocol import (
+    FRAME_HEADER,
+    LEGACY_FIRST_BYTES,
+    MAX_FRAME_SIZE,
+    encode_frame,
+)
+from compiler.vm import check_variables, interpret
+
+# call_compiler(source_code, input_file_name)
+CompileFunction = Callable[[str, str], bytes]
+
+# Requests read ahead of the response being written, per connection
+MAX_PIPELINED = 64
+
+# Bytes to send as they are, or a file to send with sendfile
+Chunk = bytes | BinaryIO
+
+FORK = multiprocessing.get_context("fork")
+
+BUSY = {"error": "Server busy", "code": "busy"}
+
+# Seconds a prefork worker waits before accepting again after an error,
+# like running out of file descriptors
+ACCEPT_RETRY = 0.05
+
+# Seconds to wait for the rest of a request that was answered without
+# reading it. Closing with unread input resets the connection, and the
+# client can lose the answer.
+LINGER = 1.0
+
+
+def handle_request(
+    input: dict[str, Any], compile: CompileFunction, cache: CompileCache
+) -> dict[str, Any]:
+    """Run one decoded JSON request and return the JSON response."""
+    result: dict[str, Any] = {}
+    if input["command"] == "compile":
+        source_code = input["code"]
+        limits.check_source(source_code)
+        with metrics.timed(metrics.COMPILE):
+            executable = cache.get_or_compile(
+                source_code, lambda code: compile(code, "(source code)")
+            )
+        result["program"] = b64encode(executable).decode()
+    elif input["command"] == "compile_batch":
+        result["results"] = [
+            batch_result(index, outcome)
+            for index, outcome in compile_batch(input["codes"], compile, cache)
+        ]
+    elif input["command"] == "interpret":
+        result = interpret_request(input)
+    elif input["command"] == "ping":
+        pass
+    elif input["command"] == "stats":
+        result["cache"] = cache.stats()
+        if (installed := metrics.installed()) is not None:
+            result["metrics"] = installed.snapshot()
+    else:
+        result["error"] = "Unknown command: " + input["command"]
+    return result
+
+
+def interpret_request(input: dict[str, Any]) -> dict[str, Any]:
+    """
+    Run a program on the stack machine, with `variables` as the initial
+    values, and answer with its value and the variables' final values.
+    """
+    variables = check_variables(input.get("variables", {}))
+    with metrics.timed(metrics.INTERPRET):
+        value = interpret(input["code"], variables)
+    return {"value": value, "variables": variables}
+
+
+def error_result(e: Exception) -> dict[str, Any]:
+    """
+    The response to a failed request: the traceback, or the limit that a
+    rejected request went over.
+    """
+    if isinstance(e, LimitExceededError):
+        return {
+            "error": str(e),
+            "code": "limit_exceeded",
+            "limit": e.limit,
+            "maximum": e.maximum,
+        }
+    return {"error": "".join(format_exception(e))}
+
+
+def compile_batch(
+    codes: list[str],
+    compile: CompileFunction,
+    cache: CompileCache,
+    workers: int | None = None,
+) -> Iterator[tuple[int, bytes | Exception]]:
+    """
+    Compile programs in parallel processes and yield each one's index in
+    `codes` and its executable or exception as it finishes. Cached and
+    rejected programs are answered first. The pool is only started when
+    at least two programs need compiling, with no more workers than that.
+    """
+    misses: list[tuple[int, str, str]] = []
+    for index, source_code in enumerate(codes):
+        try:
+            limits.check_source(source_code)
+        except LimitExceededError as e:
+            yield index, e
+            continue
+        key = cache.key(source_code)
+        executable = cache.get(key)
+        if executable is not None:
+            yield index, executable
+        else:
+            misses.append((index, key, source_code))
+
+    if len(misses) == 1:
+        index, key, source_code = misses[0]
+        try:
+            executable = compile(source_code, "(source code)")
+        except Exception as e:
+            yield index, e
+        else:
+            cache.put(key, executable)
+            yield index, executable
+        return
+    if not misses:
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(misses))
+    with ProcessPoolExecutor(workers, mp_context=FORK) as pool:
+        pending: dict[Future[bytes], tuple[int, str]] = {
+            pool.submit(compile, source_code, "(source code)"): (index, key)
+            for index, key, source_code in misses
+        }
+        for future in as_completed(pending):
+            index, key = pending[future]
+            try:
+                executable = future.result()
+            except Exception as e:
+                yield index, e
+            else:
+                cache.put(key, executable)
+                yield index, executable
+
+
+def batch_result(index: int, outcome: bytes | Exception) -> dict[str, Any]:
+    if isinstance(outcome, Exception):
+        return {"index": index} | error_result(outcome)
+    return {"index": index, "program": b64encode(outcome).decode()}
+
+
+def binary_chunks(
+    input: dict[str, Any], compile: CompileFunction, cache: CompileCache
+) -> Iterator[Chunk]:
+    """
+    Answer a request in the binary format. It is framed like the framed
+    protocol, and a frame with a `size` is followed by that many bytes of
+    executable instead of base64 in the JSON. `compile_batch` answers with
+    a frame per program, as they finish, and then `{"count": n}`.
+    """
+    if input["command"] == "compile":
+        try:
+            limits.check_source(input["code"])
+            with metrics.timed(metrics.COMPILE):
+                key = cache.key(input["code"])
+                entry = cache.get_or_open(key)
+                if entry is None:
+                    entry = compile(input["code"], "(source code)")
+                    cache.put(key, entry)
+        except Exception as e:
+            metrics.count(metrics.ERRORS)
+            yield from binary_program({}, e)
+            return
+        yield from binary_program({}, entry)
+    elif input["command"] == "compile_batch":
+        for index, outcome in compile_batch(input["codes"], compile, cache):
+            yield from binary_program({"index": index}, outcome)
+        yield encode_frame({"count": len(input["codes"])})
+    else:
+        yield encode_frame(handle_request(input, compile, cache))
+
+
+def binary_program(
+    header: dict[str, Any], outcome: bytes | BinaryIO | Exception
+) -> list[Chunk]:
+    if isinstance(outcome, Exception):
+        return [encode_frame(header | error_result(outcome))]
+    if isinstance(outcome, bytes):
+        size = len(outcome)
+    else:
+        size = os.fstat(outcome.fileno()).st_size
+    return [encode_frame(header | {"size": size}), outcome]
+
+
+def send_chunks(connection: socket.socket, chunks: Iterator[Chunk]) -> None:
+    """
+    Send a response's chunks as they are produced. A failure before the
+    first one is raised, to be answered with an error frame. After that
+    the client would read an error frame as part of the response, so the
+    failure is logged and the connection is shut down instead.
+    """
+    started = False
+    try:
+        for chunk in chunks:
+            started = True
+            if isinstance(chunk, bytes):
+                connection.sendall(chunk)
+            else:
+                with chunk:
+                    connection.sendfile(chunk)
+    except Exception as e:
+        if not started:
+            raise
+        metrics.count(metrics.ERRORS)
+        print("Response failed while sending:", file=sys.stderr)
+        print("".join(format_exception(e)), file=sys.stderr, end="")
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class CompileServer(TCPServer):
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        compile: CompileFunction,
+        cache: CompileCache,
+        bind_and_activate: bool = True,
+    ) -> None:
+        self.compile = compile
+        self.cache = cache
+        super().__init__(address, Handler, bind_and_activate)
+
+
+class ForkingCompileServer(ForkingMixIn, CompileServer):
+    """
+    Forks a process per connection. With `max_pending`, connections over
+    that many are answered "busy" instead of waiting for a process to end.
+    """
+
+    request_queue_size = 32
+    max_pending: int | None = None
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        compile: CompileFunction,
+        cache: CompileCache,
+        bind_and_activate: bool = True,
+    ) -> None:
+        # Connections answered "busy", by when to close them
+        self.shed: dict[socket.socket, float] = {}
+        super().__init__(address, compile, cache, bind_and_activate)
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        if self.max_pending is not None:
+            self.collect_children(blocking=False)
+            if len(self.active_children or ()) >= self.max_pending:
+                metrics.count(metrics.BUSY)
+                if send_busy(request):
+                    self.shed[request] = time.monotonic() + LINGER
+                else:
+                    self.shutdown_request(request)
+                return
+        super().process_request(request, client_address)
+
+    def service_actions(self) -> None:
+        super().service_actions()
+        # The rest of their requests is read between accepts, so a slow
+        # client never holds up the others
+        now = time.monotonic()
+        for connection, deadline in list(self.shed.items()):
+            if not discard_available(connection) or now > deadline:
+                del self.shed[connection]
+                connection.close()
+
+    def finish_request(self, request: Any, client_address: Any) -> None:
+        # In the forked child, which mustn't keep shed connections open
+        for connection in self.shed:
+            connection.close()
+        self.shed.clear()
+        super().finish_request(request, client_address)
+
+    def server_close(self) -> None:
+        for connection in self.shed:
+            connection.close()
+        self.shed.clear()
+        super().server_close()
+
+
+def send_busy(connection: socket.socket) -> bool:
+    """
+    Answer "busy" without blocking. Returns whether the connection is still
+    open for reading the rest of the request.
+    """
+    connection.setblocking(False)
+    try:
+        connection.send(json.dumps(BUSY).encode())
+        connection.shutdown(socket.SHUT_WR)
+    except OSError:
+        return False
+    return True
+
+
+def discard_available(connection: socket.socket) -> bool:
+    """
+    Read and drop the input that has arrived on a non-blocking connection.
+    Returns whether more can come.
+    """
+    try:
+        while connection.recv(1 << 16):
+            pass
+    except BlockingIOError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def discard_input(connection: socket.socket) -> None:
+    """Read and drop the rest of the input, for at most LINGER seconds."""
+    deadline = time.monotonic() + LINGER
+    try:
+        while (left := deadline - time.monotonic()) > 0:
+            connection.settimeout(left)
+            if not connection.recv(1 << 16):
+                break
+    except OSError:
+        pass
+
+
+class Handler(StreamRequestHandler):
+    server: CompileServer
+
+    def handle(self) -> None:
+        with metrics.request():
+            self.respond()
+        if (installed := metrics.installed()) is not None:
+            installed.maybe_export(self.server.cache.stats)
+
+    def respond(self) -> None:
+        binary = False
+        oversized = False
+        try:
+            maximum = limits.max_request_bytes()
+            with metrics.timed(metrics.READ):
+                input_bytes = self.rfile.read(-1 if maximum is None else maximum + 1)
+            oversized = maximum is not None and len(input_bytes) > maximum
+            limits.check_request(len(input_bytes))
+            with metrics.timed(metrics.DECODE):
+                input = json.loads(input_bytes.decode())
+            if input.get("format") == "binary":
+                binary = True
+                chunks = binary_chunks(input, self.server.compile, self.server.cache)
+                send_chunks(self.request, chunks)
+                return
+            result = handle_request(input, self.server.compile, self.server.cache)
+        except Exception as e:
+            metrics.count(metrics.ERRORS)
+            result = error_result(e)
+        with metrics.timed(metrics.ENCODE):
+            if binary:
+                result_bytes = encode_frame(result)
+            else:
+                result_bytes = str.encode(json.dumps(result))
+        with metrics.timed(metrics.SEND):
+            self.request.sendall(result_bytes)
+        if oversized:
+            self.request.shutdown(socket.SHUT_WR)
+            discard_input(self.request)
+
+
+def run_server(
+    host: str,
+    port: int,
+    compile: CompileFunction,
+    cache: CompileCache,
+    max_pending: int | None = None,
+) -> None:
+    """Serve requests, forking a new process for each connection."""
+    print(f"Starting TCP server at {host}:{port}")
+    with ForkingCompileServer((host, port), compile, cache) as server:
+        if max_pending is not None:
+            server.max_pending = max_pending
+            # ForkingMixIn would otherwise block at max_children
+            server.max_children = max_pending + 1
+        server.serve_forever()
+
+
+def run_prefork_server(
+    host: str,
+    port: int,
+    compile: CompileFunction,
+    cache: CompileCache,
+    workers: int,
+    backlog: int = 128,
+    max_requests: int = 0,
+    reuse_port: bool = False,
+) -> None:
+    """
+    Serve requests from a fixed pool of long-lived worker processes.
+
+    Workers are forked after imports and caches are warm. They accept from
+    one shared listening socket, or with `reuse_port` each bind their own
+    socket with SO_REUSEPORT and the kernel balances between them. A worker
+    that has handled `max_requests` requests (0 for no limit) exits after
+    finishing its last response and is replaced. That needs the shared
+    socket: closing a worker's own socket would reset the connections the
+    kernel had already queued on it.
+    """
+    if reuse_port and max_requests > 0:
+        raise Exception("--max-requests can't be used with --reuse-port")
+
+    def make_server() -> CompileServer:
+        server = CompileServer((host, port), compile, cache, bind_and_activate=False)
+        server.request_queue_size = backlog
+        if reuse_port:
+            server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            server.server_bind()
+            server.server_activate()
+        except BaseException:
+            server.server_close()
+            raise
+        return server
+
+    def work(server: CompileServer) -> None:
+        handled = 0
+        while max_requests == 0 or handled < max_requests:
+            try:
+                request, client_address = server.get_request()
+            except OSError:
+                time.sleep(ACCEPT_RETRY)
+                continue
+            try:
+                server.finish_request(request, client_address)
+            except Exception:
+                server.handle_error(request, client_address)
+            finally:
+                server.shutdown_request(request)
+            handled += 1
+
+    def spawn() -> int:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+            status = 0
+            try:
+                work(shared if shared is not None else make_server())
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        return pid
+
+    # Warm up what every worker needs before forking
+    compiler_version()
+    try:
+        compile("0", "(warm-up)")
+    except Exception:
+        pass
+    shared = None if reuse_port else make_server()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"Starting TCP server at {host}:{port} with {workers} workers")
+    children: set[int] = set()
+    # SIGTERM is only taken while waiting, so every forked worker is in
+    # `children` when it arrives
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+    try:
+        while True:
+            while len(children) < workers:
+                children.add(spawn())
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+            pid, _ = os.wait()
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+            children.discard(pid)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        if shared is not None:
+            shared.server_close()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+
+
+class AsyncCompileServer:
+    """
+    Serves the framed protocol and the legacy one-shot protocol on the same
+    port. Framed requests on a connection are handled concurrently and
+    answered in order; compiles run in `pool`. With `max_pending`, requests
+    over that many in progress are answered "busy".
+    """
+
+    def __init__(
+        self,
+        compile: CompileFunction,
+        cache: CompileCache,
+        pool: Executor,
+        max_pending: int | None = None,
+    ) -> None:
+        self.compile = compile
+        self.cache = cache
+        self.pool = pool
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            first = await reader.read(1)
+            if not first:
+                return
+            if first in LEGACY_FIRST_BYTES:
+                chunks: asyncio.Queue[Chunk | None] = asyncio.Queue()
+                with metrics.timed(metrics.READ):
+                    message = first + await read_bounded(
+                        reader, limits.max_request_bytes()
+                    )
+                try:
+                    limits.check_request(len(message))
+                except LimitExceededError as e:
+                    metrics.count(metrics.ERRORS)
+                    chunks.put_nowait(json.dumps(error_result(e)).encode())
+                    chunks.put_nowait(None)
+                    await self.write_chunks(chunks, writer)
+                    writer.write_eof()
+                    await discard_stream(reader)
+                    return
+                if self.admit():
+                    await self.respond(message, chunks, framed=False)
+                else:
+                    chunks.put_nowait(json.dumps(BUSY).encode())
+                    chunks.put_nowait(None)
+                await self.write_chunks(chunks, writer)
+            else:
+                await self.handle_frames(first, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_frames(
+        self,
+        first: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        # A queue of response chunks per request, ended by None
+        responses: asyncio.Queue[asyncio.Queue[Chunk | None] | None] = (
+            asyncio.Queue(MAX_PIPELINED)
+        )
+        writing = asyncio.create_task(self.write_responses(responses, writer))
+        running: set[asyncio.Task[None]] = set()
+        try:
+            header = first
+            while True:
+                try:
+                    header += await reader.readexactly(FRAME_HEADER.size - len(header))
+                except asyncio.IncompleteReadError:
+                    break
+                chunks: asyncio.Queue[Chunk | None] = asyncio.Queue()
+                await responses.put(chunks)
+                (size,) = FRAME_HEADER.unpack(header)
+                if size > MAX_FRAME_SIZE:
+                    # The stream can't be resynchronized after this
+                    chunks.put_nowait(
+                        encode_frame({"error": f"Message too large: {size} bytes"})
+                    )
+                    chunks.put_nowait(None)
+                    break
+                with metrics.timed(metrics.READ):
+                    message = await reader.readexactly(size)
+                header = b""
+                if not self.admit():
+                    chunks.put_nowait(encode_frame(BUSY))
+                    chunks.put_nowait(None)
+                    continue
+                task = asyncio.create_task(self.respond(message, chunks, framed=True))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            await responses.put(None)
+            await writing
+
+    async def write_responses(
+        self,
+        responses: asyncio.Queue[asyncio.Queue[Chunk | None] | None],
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        while (chunks := await responses.get()) is not None:
+            await self.write_chunks(chunks, writer)
+
+    async def write_chunks(
+        self, chunks: asyncio.Queue[Chunk | None], writer: asyncio.StreamWriter
+    ) -> None:
+        # Keeps draining the queue after the client goes away, so the reader
+        # never blocks on a full queue
+        while (chunk := await chunks.get()) is not None:
+            if writer.is_closing():
+                if not isinstance(chunk, bytes):
+                    chunk.close()
+                continue
+            try:
+                with metrics.timed(metrics.SEND):
+                    if isinstance(chunk, bytes):
+                        writer.write(chunk)
+                        await writer.drain()
+                    else:
+                        with chunk:
+                            await writer.drain()
+                            await asyncio.get_running_loop().sendfile(
+                                writer.transport, chunk
+                            )
+            except ConnectionError:
+                writer.close()
+
+    def admit(self) -> bool:
+        """Count a request as pending, unless there are too many already."""
+        if self.max_pending is not None and self.pending >= self.max_pending:
+            metrics.count(metrics.BUSY)
+            return False
+        self.pending += 1
+        return True
+
+    async def respond(
+        self, message: bytes, chunks: asyncio.Queue[Chunk | None], framed: bool
+    ) -> None:
+        """Answer an admitted request."""
+        try:
+            with metrics.request():
+                await self.answer(message, chunks, framed)
+        finally:
+            self.pending -= 1
+        if (installed := metrics.installed()) is not None:
+            installed.maybe_export(self.cache.stats)
+
+    async def answer(
+        self, message: bytes, chunks: asyncio.Queue[Chunk | None], framed: bool
+    ) -> None:
+        """
+        Answer a request. On framed connections, and in the binary format,
+        `compile_batch` answers with a frame per program as it finishes and
+        then `{"count": n}`.
+        """
+        result: dict[str, Any]
+        binary = False
+        try:
+            with metrics.timed(metrics.DECODE):
+                input = json.loads(message)
+            binary = input.get("format") == "binary"
+            if input["command"] == "compile_batch" and (framed or binary):
+                async for index, outcome in self.compile_batch(input["codes"]):
+                    if binary:
+                        for chunk in binary_program({"index": index}, outcome):
+                            chunks.put_nowait(chunk)
+                    else:
+                        chunks.put_nowait(encode_frame(batch_result(index, outcome)))
+                result = {"count": len(input["codes"])}
+            elif input["command"] == "compile" and binary:
+                entry: bytes | BinaryIO | Exception
+                try:
+                    entry = await self.compile_or_open(input["code"])
+                except Exception as e:
+                    entry = e
+                for chunk in binary_program({}, entry):
+                    chunks.put_nowait(chunk)
+                chunks.put_nowait(None)
+                return
+            else:
+                result = await self.result(input)
+        except Exception as e:
+            metrics.count(metrics.ERRORS)
+            result = error_result(e)
+        with metrics.timed(metrics.ENCODE):
+            if framed or binary:
+                chunks.put_nowait(encode_frame(result))
+            else:
+                chunks.put_nowait(json.dumps(result).encode())
+        chunks.put_nowait(None)
+
+    async def result(self, input: dict[str, Any]) -> dict[str, Any]:
+        if input["command"] == "compile":
+            executable = await self.compile_cached(input["code"])
+            return {"program": b64encode(executable).decode()}
+        elif input["command"] == "compile_batch":
+            items = self.compile_batch(input["codes"])
+            return {"results": [batch_result(*item) async for item in items]}
+        elif input["command"] == "interpret":
+            # Off the event loop, like compiles
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool, interpret_request, input
+            )
+        return handle_request(input, self.compile, self.cache)
+
+    async def compile_batch(
+        self, codes: list[str]
+    ) -> AsyncIterator[tuple[int, bytes | Exception]]:
+        async def compile_one(
+            index: int, source_code: str
+        ) -> tuple[int, bytes | Exception]:
+            try:
+                executable = await self.compile_cached(source_code)
+            except Exception as e:
+                return index, e
+            return index, executable
+
+        compiles = [compile_one(index, code) for index, code in enumerate(codes)]
+        for next_result in asyncio.as_completed(compiles):
+            yield await next_result
+
+    async def compile_cached(self, source_code: str) -> bytes:
+        limits.check_source(source_code)
+        with metrics.timed(metrics.COMPILE):
+            key = self.cache.key(source_code)
+            entry = await self.cache_lookup(key)
+            if entry is None:
+                return await self.compile_in_pool(key, source_code)
+            if isinstance(entry, bytes):
+                return entry
+            executable = await asyncio.get_running_loop().run_in_executor(
+                None, read_and_close, entry
+            )
+            self.cache.remember(key, executable)
+            return executable
+
+    async def compile_or_open(self, source_code: str) -> bytes | BinaryIO:
+        """
+        Like `compile_cached`, but an entry found only on disk is returned
+        as an open file.
+        """
+        limits.check_source(source_code)
+        with metrics.timed(metrics.COMPILE):
+            key = self.cache.key(source_code)
+            entry = await self.cache_lookup(key)
+            if entry is None:
+                entry = await self.compile_in_pool(key, source_code)
+            return entry
+
+    async def cache_lookup(self, key: str) -> bytes | BinaryIO | None:
+        """
+        `cache.get_or_open` with the disk tier's file system calls in a
+        thread, so they don't hold up the event loop. The memory tier is
+        only used from the event loop's thread.
+        """
+        executable = self.cache.get_memory(key)
+        if executable is not None:
+            return executable
+        if self.cache.directory is None:
+            # Only counts the miss
+            return self.cache.open_disk(key)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.cache.open_disk, key
+        )
+
+    async def compile_in_pool(self, key: str, source_code: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        executable = await loop.run_in_executor(
+            self.pool, self.compile, source_code, "(source code)"
+        )
+        self.cache.remember(key, executable)
+        if self.cache.directory is not None:
+            # Writing, and evicting if over budget, in a thread too
+            await loop.run_in_executor(None, self.cache.put_disk, key, executable)
+        return executable
+
+
+def read_and_close(file: BinaryIO) -> bytes:
+    with file:
+        return file.read()
+
+
+async def read_bounded(reader: asyncio.StreamReader, maximum: int | None) -> bytes:
+    """Read to the end of the stream, or until over `maximum` bytes."""
+    if maximum is None:
+        return await reader.read()
+    data = bytearray()
+    while len(data) <= maximum and (chunk := await reader.read(maximum + 1)):
+        data += chunk
+    return bytes(data)
+
+
+async def discard_stream(reader: asyncio.StreamReader) -> None:
+    """Read and drop the rest of the input, for at most LINGER seconds."""
+    try:
+        async with asyncio.timeout(LINGER):
+            while await reader.read(1 << 16):
+                pass
+    except TimeoutError:
+        pass
+
+
+def run_async_server(
+    host: str,
+    port: int,
+    compile: CompileFunction,
+    cache: CompileCache,
+    workers: int | None = None,
+    backlog: int = 128,
+    max_pending: int | None = None,
+) -> None:
+    """
+    Serve persistent, pipelined connections from one event loop, with
+    compiles in a pool of `workers` processes (one per CPU by default).
+    """
+    compiler_version()
+    pool = ProcessPoolExecutor(
+        workers,
+        mp_context=FORK,
+        initializer=_init_pool_worker,
+    )
+    with pool:
+        # Fork the workers now: forked while a connection is open, they
+        # would hold a copy of its socket, and a one-shot client reading
+        # to the end of the response would never see it end
+        pool.submit(int).result()
+        server = AsyncCompileServer(compile, cache, pool, max_pending)
+        asyncio.run(_serve_async(server, host, port, backlog))
+
+
+def _init_pool_worker() -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Workers are forked after the event loop took over SIGTERM, and its
+    # handler would only wake a loop that isn't running here
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+
+
+async def _serve_async(
+    server: AsyncCompileServer, host: str, port: int, backlog: int
+) -> None:
+    listener = await asyncio.start_server(
+        server.handle_connection, host, port, backlog=backlog, reuse_address=True
+    )
+    # Return on SIGTERM, so the pool is shut down and its workers don't
+    # outlive the server
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    print(f"Starting asyncio server at {host}:{port}")
+    await stop.wait()
+    listener.close()
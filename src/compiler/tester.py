@@ -1,18 +1,315 @@
+import json
+import os
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, BinaryIO, Callable
+
+from compiler.__main__ import call_compiler
+from compiler.cache import CompileCache
+import compiler.limits as limits
 from compiler.parser import parse
+from compiler.protocol import encode_frame, read_frame
+from compiler.server import (
+    CompileFunction,
+    run_async_server,
+    run_prefork_server,
+    run_server,
+)
 from compiler.tokenizer import tokenize
-from compiler.utils import Token, L, Location
+from compiler.workloads import WORKLOADS
 
 """
-Use this function for local testing
-Run with ./main.sh in root
+Load generator for the `serve` protocol.
+
+Opens `--connections` concurrent connections and sends compile requests
+for a corpus of files, or for synthetic programs, either as fast as the
+server answers or at a target `--rate`. With a rate, requests are
+scheduled up front and latency is measured from the scheduled time, so a
+stalled server shows up as latency rather than as fewer requests.
+`--spawn` starts a local server in a forked process first.
+
+    ./main.sh --spawn=async --workers=4 --connections=32 --requests=5000
 """
 
-input_string = "1 % 2"
+QUANTILES = [0.5, 0.9, 0.99, 0.999]
+SERVER_MODES = ["forking", "prefork", "async"]
+
+
+@dataclass
+class LoadResult:
+    seconds: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    # Busy responses count as errors too
+    errors: int = 0
+    busy: int = 0
+    # How many times each error message was seen
+    messages: dict[str, int] = field(default_factory=dict)
+
+    def summary(self) -> dict[str, Any]:
+        requests = len(self.latencies)
+        latencies = sorted(self.latencies)
+        result: dict[str, Any] = {
+            "requests": requests,
+            "errors": self.errors,
+            "busy": self.busy,
+            "error_rate": round(self.errors / max(requests, 1), 6),
+            "seconds": round(self.seconds, 3),
+            "throughput": round(requests / max(self.seconds, 1e-9), 3),
+        }
+        if latencies:
+            for q in QUANTILES:
+                index = min(int(q * requests), requests - 1)
+                result[f"p{q * 100:g}_ms"] = round(latencies[index] * 1e3, 3)
+            result["max_ms"] = round(latencies[-1] * 1e3, 3)
+        return result
+
+
+class Connection:
+    """
+    A client of the server. One-shot mode opens a connection per request
+    and works with every server mode. Framed mode keeps one connection
+    open, which only the asyncio server supports.
+    """
+
+    def __init__(self, host: str, port: int, framed: bool) -> None:
+        self.address = (host, port)
+        self.framed = framed
+        self.socket: socket.socket | None = None
+        self.file: BinaryIO | None = None
+
+    def request(self, message: dict[str, Any]) -> dict[str, Any]:
+        if not self.framed:
+            with socket.create_connection(self.address) as connection:
+                connection.sendall(json.dumps(message).encode())
+                connection.shutdown(socket.SHUT_WR)
+                with connection.makefile("rb") as file:
+                    result: dict[str, Any] = json.loads(file.read())
+                    return result
+        if self.socket is None or self.file is None:
+            self.socket = socket.create_connection(self.address)
+            self.file = self.socket.makefile("rb")
+        self.socket.sendall(encode_frame(message))
+        return read_frame(self.file)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+def run_load(
+    host: str,
+    port: int,
+    programs: list[str],
+    requests: int,
+    connections: int = 1,
+    rate: float = 0.0,
+    framed: bool = False,
+) -> LoadResult:
+    """
+    Send `requests` compile requests for `programs`, round robin, over
+    `connections` threads, at `rate` requests per second in total or as
+    fast as possible if it is 0.
+    """
+    result = LoadResult()
+    lock = threading.Lock()
+    next_request = 0
+    start = time.perf_counter()
+
+    def worker() -> None:
+        nonlocal next_request
+        connection = Connection(host, port, framed)
+        try:
+            while True:
+                with lock:
+                    i = next_request
+                    next_request += 1
+                if i >= requests:
+                    return
+                scheduled = start + i / rate if rate > 0 else time.perf_counter()
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                code = programs[i % len(programs)]
+                message = {"command": "compile", "code": code}
+                error: str | None = None
+                try:
+                    response = connection.request(message)
+                except (OSError, EOFError, ValueError) as e:
+                    connection.close()
+                    response = {}
+                    error = f"{type(e).__name__}: {e}"
+                else:
+                    if "error" in response:
+                        error = str(response["error"]).strip().splitlines()[-1]
+                latency = time.perf_counter() - scheduled
+                with lock:
+                    result.latencies.append(latency)
+                    if response.get("code") == "busy":
+                        result.busy += 1
+                    if error is not None:
+                        result.errors += 1
+                        result.messages[error] = result.messages.get(error, 0) + 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def load_programs(paths: list[str]) -> list[str]:
+    """The files named, and the files under the directories named."""
+    programs = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files = sorted(p for p in path.rglob("*") if p.is_file())
+        else:
+            files = [path]
+        programs += [file.read_text() for file in files]
+    return programs
+
+
+def synthetic_programs(workload: str, size: int, count: int) -> list[str]:
+    """`count` distinct programs, so that the server's cache doesn't answer."""
+    return [WORKLOADS[workload](size, seed) for seed in range(count)]
+
+
+def front_end(source_code: str, input_file_name: str) -> bytes:
+    """Tokenize and parse only, to load test before code generation exists."""
+    limits.check_source(source_code)
+    limits.check_depth(parse(tokenize(source_code)))
+    return b""
+
+
+def spawn_server(
+    mode: str, compile: CompileFunction, workers: int, host: str = "127.0.0.1"
+) -> tuple[int, int]:
+    """Fork a server on a free port, wait for it, and return its pid and port."""
+    with socket.socket() as s:
+        s.bind((host, 0))
+        port: int = s.getsockname()[1]
+    runs: dict[str, Callable[[], None]] = {
+        "forking": lambda: run_server(host, port, compile, CompileCache()),
+        "prefork": lambda: run_prefork_server(
+            host, port, compile, CompileCache(), workers or os.cpu_count() or 1
+        ),
+        "async": lambda: run_async_server(
+            host, port, compile, CompileCache(), workers or None
+        ),
+    }
+    run = runs[mode]
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run()
+        finally:
+            os._exit(0)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection((host, port)).close()
+            return pid, port
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                stop_server(pid)
+                raise
+            time.sleep(0.02)
+
+
+def stop_server(pid: int) -> None:
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+
+def report(result: LoadResult) -> str:
+    lines = [f"{name}: {value}" for name, value in result.summary().items()]
+    for message, count in sorted(result.messages.items(), key=lambda m: -m[1]):
+        lines.append(f"  {count} x {message}")
+    return "\n".join(lines)
+
 
-input_list = input_string.split()
+def main() -> int:
+    paths: list[str] = []
+    host = "127.0.0.1"
+    port = 3000
+    connections = 8
+    requests = 1000
+    rate = 0.0
+    framed = False
+    spawn: str | None = None
+    workers = 0
+    workload = "realistic"
+    size = 2000
+    distinct = 100
+    use_front_end = False
+    output_file: str | None = None
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r"--host=(.+)", arg)) is not None:
+            host = m[1]
+        elif (m := re.fullmatch(r"--port=(\d+)", arg)) is not None:
+            port = int(m[1])
+        elif (m := re.fullmatch(r"--connections=(\d+)", arg)) is not None:
+            connections = max(1, int(m[1]))
+        elif (m := re.fullmatch(r"--requests=(\d+)", arg)) is not None:
+            requests = int(m[1])
+        elif (m := re.fullmatch(r"--rate=([\d.]+)", arg)) is not None:
+            rate = float(m[1])
+        elif arg == "--framed":
+            framed = True
+        elif (m := re.fullmatch(r"--spawn=(.+)", arg)) is not None:
+            if m[1] not in SERVER_MODES:
+                raise Exception(f"Unknown server mode: {m[1]}")
+            spawn = m[1]
+        elif (m := re.fullmatch(r"--workers=(\d+)", arg)) is not None:
+            workers = int(m[1])
+        elif (m := re.fullmatch(r"--workload=(\w+)", arg)) is not None:
+            if m[1] not in WORKLOADS:
+                raise Exception(f"Unknown workload: {m[1]}")
+            workload = m[1]
+        elif (m := re.fullmatch(r"--size=(\d+)", arg)) is not None:
+            size = int(m[1])
+        elif (m := re.fullmatch(r"--distinct=(\d+)", arg)) is not None:
+            distinct = max(1, int(m[1]))
+        elif arg == "--front-end":
+            use_front_end = True
+        elif (m := re.fullmatch(r"--output=(.+)", arg)) is not None:
+            output_file = m[1]
+        elif arg.startswith("-"):
+            raise Exception(f"Unknown argument: {arg}")
+        else:
+            paths.append(arg)
 
-tokenized = tokenize(input_string)
+    if paths:
+        programs = load_programs(paths)
+    else:
+        programs = synthetic_programs(workload, size, distinct)
 
+    pid: int | None = None
+    if spawn is not None:
+        compile = front_end if use_front_end else call_compiler
+        pid, port = spawn_server(spawn, compile, workers, host)
+    try:
+        result = run_load(host, port, programs, requests, connections, rate, framed)
+    finally:
+        if pid is not None:
+            stop_server(pid)
 
-def main() -> None:
-    print(parse(tokenized))
+    print(report(result))
+    if output_file is not None:
+        with open(output_file, "w") as f:
+            json.dump(result.summary(), f, indent=2)
+    return 0
@@ -0,0 +1,58 @@
+from array import array
+from typing import Iterator, get_args, overload
+from .utils import SPAN_BITS, Kind, LineIndex, Token
+
+KIND_NAMES: list[Kind] = list(get_args(Kind))
+KIND_CODES: dict[Kind, int] = {kind: code for code, kind in enumerate(KIND_NAMES)}
+
+
+class TokenBuffer:
+    """
+    Tokens of one source stored column-wise: a kind code and the start and
+    end offsets of each token, with the source text shared. `Token` objects
+    are only built when indexed.
+    """
+
+    __slots__ = ("source", "lines", "kinds", "starts", "ends")
+
+    def __init__(self, source: str, lines: LineIndex) -> None:
+        self.source = source
+        self.lines = lines
+        self.kinds = array("B")
+        # Offsets fit in 32 bits, like packed spans
+        self.starts = array("I")
+        self.ends = array("I")
+
+    def append(self, kind: Kind, start: int, end: int) -> None:
+        self.kinds.append(KIND_CODES[kind])
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def kind(self, i: int) -> Kind:
+        return KIND_NAMES[self.kinds[i]]
+
+    def text(self, i: int) -> str:
+        return self.source[self.starts[i] : self.ends[i]]
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @overload
+    def __getitem__(self, i: int) -> Token: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "TokenBuffer": ...
+
+    def __getitem__(self, i: int | slice) -> "Token | TokenBuffer":
+        if isinstance(i, slice):
+            sliced = TokenBuffer(self.source, self.lines)
+            sliced.kinds = self.kinds[i]
+            sliced.starts = self.starts[i]
+            sliced.ends = self.ends[i]
+            return sliced
+        span = self.starts[i] << SPAN_BITS | self.ends[i]
+        return Token(self.text(i), self.kind(i), span, self.lines)
+
+    def __iter__(self) -> Iterator[Token]:
+        for i in range(len(self)):
+            yield self[i]
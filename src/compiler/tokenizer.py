@@ -1,6 +1,10 @@
+import codecs
+import mmap
 import re
-from typing import List, Tuple
-from .utils import Token, Location, Kind
+from sys import intern
+from typing import IO, Generator, Iterable, Iterator, Literal
+from .token_buffer import TokenBuffer
+from .utils import SPAN_BITS, Token, Kind, LineIndex
 
 
 OPERATORS = ["+", "-", "*", "/", "=", "==", "!=", "<=", ">=", "<", ">", "%"]
@@ -12,59 +16,180 @@ COMMENTS = ["//", "#"]
 COMMENT_START = ["/*"]
 COMMENT_END = ["*/"]
 
+# Characters `str.splitlines` treats as line boundaries
+LINE_BREAKS = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
 
-## TODO: add other "kinds"
-def parseKind(value: str) -> Kind:
-    if value.isnumeric():
-        return "int_literal"
-    elif value in OPERATORS:
-        return "operator"
-    elif value in PUNCTUATORS:
-        return "punctuator"
-    elif value in COMMENTS:
-        return "comment"
-    elif value in COMMENT_START:
-        return "comment_start"
-    elif value in COMMENT_END:
-        return "comment_end"
-    elif value in CONDITIONALS:
-        return "conditional"
-    else:
-        return "identifier"
+CHUNK_SIZE = 1 << 16
 
 
-def parseLoc(line: int, span: Tuple[int, int]) -> Location:
-    return Location(line, (span[0], span[1]))
+KINDS: dict[str, Kind] = {
+    **{text: "operator" for text in OPERATORS},
+    **{text: "punctuator" for text in PUNCTUATORS},
+    **{text: "comment" for text in COMMENTS},
+    **{text: "comment_start" for text in COMMENT_START},
+    **{text: "comment_end" for text in COMMENT_END},
+    **{text: "conditional" for text in CONDITIONALS},
+}
 
 
+def _alternatives(texts: list[str]) -> str:
+    # Longest first, so that e.g. "==" wins over "="
+    return "|".join(re.escape(t) for t in sorted(texts, key=len, reverse=True))
+
+
+# Each group name is the kind of the token it matches, except for "word"
+# which is either a conditional or an identifier.
 r = re.compile(
-    r"#|\*\/|\/\*|\/\/|==|!=|<=|>=|>|<|\+|\-|\*|\/|%|=|\(|\)|\{|\}|,|;|[a-zA-Z_]+[a-zA-Z0-9_]*|[0-9]+"
+    f"(?P<comment>{_alternatives(COMMENTS)})"
+    f"|(?P<comment_end>{_alternatives(COMMENT_END)})"
+    f"|(?P<comment_start>{_alternatives(COMMENT_START)})"
+    f"|(?P<operator>{_alternatives(OPERATORS)})"
+    f"|(?P<punctuator>{_alternatives(PUNCTUATORS)})"
+    r"|(?P<word>[a-zA-Z_][a-zA-Z0-9_]*)"
+    r"|(?P<int_literal>[0-9]+)"
 )
 
+WORD_KINDS: dict[str, Kind] = {text: "conditional" for text in CONDITIONALS}
 
-def tokenize(source_code: str) -> list[Token]:
-    tokens: List[Token] = []
+# Canonical copies of fixed token texts, so tokens don't hold their own
+SYMBOLS = {text: text for text in OPERATORS + PUNCTUATORS}
 
-    multi_comment = False
 
-    for line, text in enumerate(source_code.splitlines()):
-        single_comment = False
-        ts = r.finditer(text)
-        for t in ts:
-            token = Token(
-                text=t.group(),
-                kind=parseKind(t.group()),
-                loc=parseLoc(line, t.span()),
-            )
-            if token.kind == "comment":
-                single_comment = True
-            if token.kind == "comment_start":
-                multi_comment = True
+def tokenize(
+    source_code: str, scanner: Literal["regex", "dfa"] = "regex"
+) -> list[Token]:
+    if scanner == "dfa":
+        from .dfa import tokenize_bytes
 
-            if not multi_comment and not single_comment:
-                tokens.append(token)
+        return tokenize_bytes(source_code.encode("ascii"))
+    return list(_tokenize_lines(source_code.splitlines(keepends=True)))
 
-            if token.kind == "comment_end":
-                multi_comment = False
 
+def tokenize_buffer(source_code: str) -> TokenBuffer:
+    """Tokenize into a column-wise `TokenBuffer` instead of `Token` objects."""
+    tokens = TokenBuffer(source_code, LineIndex())
+    append = tokens.append
+    for _, kind, start, end in _scan_lines(
+        source_code.splitlines(keepends=True), tokens.lines
+    ):
+        append(kind, start, end)
     return tokens
+
+
+def tokenize_stream(
+    source: IO[str] | IO[bytes] | mmap.mmap, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Token]:
+    """
+    Lazily tokenize a file object or a memory-mapped buffer.
+
+    The source is read `chunk_size` units at a time, so only one chunk
+    and the line being tokenized are kept in memory. Byte sources are
+    decoded as UTF-8, and token offsets count decoded characters.
+    """
+    return _tokenize_lines(_split_lines(_read_chunks(source, chunk_size)))
+
+
+def _read_chunks(
+    source: IO[str] | IO[bytes] | mmap.mmap, chunk_size: int
+) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while chunk := source.read(chunk_size):
+        if isinstance(chunk, str):
+            yield chunk
+        elif text := decoder.decode(chunk):
+            yield text
+    if text := decoder.decode(b"", final=True):
+        yield text
+
+
+def _split_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Re-split arbitrary text chunks into the same lines as
+    `str.splitlines(keepends=True)`.
+    """
+    pending: list[str] = []
+    carry = ""
+    for chunk in chunks:
+        if carry:
+            chunk = carry + chunk
+            carry = ""
+        # A trailing "\r" may be the first half of a "\r\n" in the next chunk
+        if chunk.endswith("\r"):
+            carry = "\r"
+            chunk = chunk[:-1]
+            if not chunk:
+                continue
+
+        lines = chunk.splitlines(keepends=True)
+        if pending:
+            pending.append(lines[0])
+            lines[0] = "".join(pending)
+            pending = []
+        if chunk[-1] not in LINE_BREAKS:
+            pending.append(lines.pop())
+        yield from lines
+
+    if pending or carry:
+        pending.append(carry)
+        yield "".join(pending)
+
+
+def _tokenize_lines(lines: Iterable[str]) -> Iterator[Token]:
+    index = LineIndex()
+    for text, kind, start, end in _scan_lines(lines, index):
+        yield Token(text, kind, start << SPAN_BITS | end, index)
+
+
+def scan_line(
+    text: str, multi_comment: bool = False
+) -> tuple[list[tuple[str, Kind, int, int]], bool]:
+    """
+    Tokenize one line, with offsets relative to its start. `multi_comment`
+    says whether a multi-line comment is open where the line starts, and
+    the returned flag whether one is open where it ends.
+    """
+    tokens = []
+    scanner = _scan_lines([text], LineIndex(), multi_comment)
+    while True:
+        try:
+            tokens.append(next(scanner))
+        except StopIteration as stop:
+            return tokens, stop.value
+
+
+def _scan_lines(
+    lines: Iterable[str], index: LineIndex, multi_comment: bool = False
+) -> Generator[tuple[str, Kind, int, int], None, bool]:
+    """
+    Yield the text, kind and source offsets of each token, recording line
+    starts in `index`. Lines are given with their line breaks, so offsets
+    can be tracked. `multi_comment` says whether the lines start inside a
+    multi-line comment; it is carried across lines, and across chunks in
+    streaming mode. Returns whether a multi-line comment is left open.
+    """
+    offset = 0
+    for text in lines:
+        index.starts.append(offset)
+        for t in r.finditer(text):
+            kind = t.lastgroup
+            if multi_comment:
+                if kind == "comment_end":
+                    multi_comment = False
+                continue
+
+            start, end = t.span()
+            if kind == "word":
+                value = intern(t.group())
+                kind = WORD_KINDS.get(value, "identifier")
+                yield value, kind, offset + start, offset + end
+            elif kind == "int_literal":
+                yield t.group(), "int_literal", offset + start, offset + end
+            elif kind == "comment":
+                break
+            elif kind == "comment_start":
+                multi_comment = True
+            else:
+                value = SYMBOLS.get(t.group(), t.group())
+                yield value, KINDS[value], offset + start, offset + end
+        offset += len(text)
+    return multi_comment
@@ -0,0 +1,83 @@
+from time import perf_counter_ns
+from typing import IO
+
+"""
+Instrumentation hooks for the parser.
+
+`parse` takes an optional tracer and only calls it when one is given, so
+parsing without a tracer pays for nothing but an `is None` check per event.
+"""
+
+
+class Tracer:
+    """Receives parser events. The default implementation ignores them."""
+
+    def consume(self, pos: int, text: str) -> None:
+        """The token at `pos` was consumed."""
+
+    def enter(self, production: str, pos: int) -> None:
+        """A production starts at token `pos`."""
+
+    def exit(self, production: str, pos: int) -> None:
+        """The innermost open production ended before token `pos`."""
+
+    def backtrack(self, production: str, pos: int) -> None:
+        """
+        `production` looked at the token at `pos` and left it unconsumed for
+        an enclosing production to handle.
+        """
+
+
+class FileTracer(Tracer):
+    """Writes one compact line per event: `c`, `>`, `<` or `b`, then details."""
+
+    def __init__(self, file: IO[str]) -> None:
+        self.file = file
+
+    def consume(self, pos: int, text: str) -> None:
+        self.file.write(f"c {pos} {text}\n")
+
+    def enter(self, production: str, pos: int) -> None:
+        self.file.write(f"> {pos} {production}\n")
+
+    def exit(self, production: str, pos: int) -> None:
+        self.file.write(f"< {pos} {production}\n")
+
+    def backtrack(self, production: str, pos: int) -> None:
+        self.file.write(f"b {pos} {production}\n")
+
+
+class CountingTracer(Tracer):
+    """Aggregates counts and inclusive time per production."""
+
+    def __init__(self) -> None:
+        self.consumed = 0
+        self.entries: dict[str, int] = {}
+        self.backtracks: dict[str, int] = {}
+        self.nanoseconds: dict[str, int] = {}
+        self._started: list[int] = []
+
+    def consume(self, pos: int, text: str) -> None:
+        self.consumed += 1
+
+    def enter(self, production: str, pos: int) -> None:
+        self.entries[production] = self.entries.get(production, 0) + 1
+        self._started.append(perf_counter_ns())
+
+    def exit(self, production: str, pos: int) -> None:
+        elapsed = perf_counter_ns() - self._started.pop()
+        self.nanoseconds[production] = self.nanoseconds.get(production, 0) + elapsed
+
+    def backtrack(self, production: str, pos: int) -> None:
+        self.backtracks[production] = self.backtracks.get(production, 0) + 1
+
+    def report(self) -> str:
+        lines = [f"{'production':<16}{'entries':>10}{'backtracks':>12}{'ms':>10}"]
+        for production, count in sorted(
+            self.entries.items(), key=lambda item: -self.nanoseconds.get(item[0], 0)
+        ):
+            backtracks = self.backtracks.get(production, 0)
+            ms = self.nanoseconds.get(production, 0) / 1e6
+            lines.append(f"{production:<16}{count:>10}{backtracks:>12}{ms:>10.3f}")
+        lines.append(f"{self.consumed} tokens consumed")
+        return "\n".join(lines)
@@ -1,3 +1,5 @@
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
 from typing import Literal, Tuple
 
@@ -30,11 +32,68 @@ class Location:
         return False
 
 
-@dataclass
+# Token spans are packed as `start << SPAN_BITS | end`
+SPAN_BITS = 32
+SPAN_MASK = (1 << SPAN_BITS) - 1
+
+
+def pack_span(start: int, end: int) -> int:
+    return start << SPAN_BITS | end
+
+
+class LineIndex:
+    """Start offsets of the lines of one source, in order."""
+
+    __slots__ = ("starts",)
+
+    def __init__(self) -> None:
+        self.starts = array("q")
+
+    def location(self, span: int) -> Location:
+        start = span >> SPAN_BITS
+        line = bisect_right(self.starts, start) - 1
+        line_start = self.starts[line]
+        return Location(line, (start - line_start, (span & SPAN_MASK) - line_start))
+
+
 class Token:
-    text: str
-    kind: Kind
-    loc: Location
+    """
+    A token, with its location either given directly or as a packed span
+    of source offsets that is resolved through a `LineIndex` on demand.
+    """
+
+    __slots__ = ("text", "kind", "span", "lines")
+
+    def __init__(
+        self,
+        text: str,
+        kind: Kind,
+        loc: Location | int,
+        lines: LineIndex | None = None,
+    ) -> None:
+        self.text = text
+        self.kind = kind
+        self.span = loc
+        self.lines = lines
+
+    @property
+    def loc(self) -> Location:
+        if isinstance(self.span, Location):
+            return self.span
+        assert self.lines is not None
+        return self.lines.location(self.span)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        if self.text != other.text or self.kind != other.kind:
+            return False
+        if self.lines is not None and self.lines is other.lines:
+            return self.span == other.span
+        return self.loc == other.loc
+
+    def __repr__(self) -> str:
+        return f"Token(text={self.text!r}, kind={self.kind!r}, loc={self.loc!r})"
 
 
 L = Location(-1, (-1, -1))
@@ -0,0 +1,306 @@
+from typing import Callable
+
+import compiler.ast as ast
+from compiler.bytecode import (
+    BINARY,
+    CHECK_BOOL,
+    CONST,
+    JUMP,
+    JUMP_IF_FALSE,
+    JUMP_IF_FALSE_OR_POP,
+    JUMP_IF_TRUE_OR_POP,
+    LOAD,
+    OPERATORS,
+    POP,
+    STORE,
+    Code,
+    Value,
+    lower,
+)
+from compiler.errors import EvaluationError
+from compiler.folding import BOOLEANS, INT_BITS, INT_MIN
+import compiler.limits as limits
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+"""
+A stack machine for the bytecode in `bytecode`, and a recursive AST
+walker with the same semantics to check it and benchmark it against.
+
+Integers are 64-bit and wrap like in `folding`. Operands are checked at
+run time, since there is no type checker yet: arithmetic and ordering
+take integers, `and`, `or` and conditions take booleans, and `==` and
+`!=` take two values of the same type. Type errors, division by zero and
+reading a variable that was never assigned raise `EvaluationError`.
+"""
+
+INT_MAX = -INT_MIN - 1
+
+# Variables without a value
+_UNBOUND = object()
+
+
+def _type_name(value: object) -> str:
+    if value is None:
+        return "unit"
+    return type(value).__name__
+
+
+def _mismatch(op: str, left: Value, right: Value) -> EvaluationError:
+    return EvaluationError(
+        f"Operator {op} can't take {_type_name(left)} and {_type_name(right)}"
+    )
+
+
+def _wrap(value: int) -> int:
+    if INT_MIN <= value <= INT_MAX:
+        return value
+    return (value - INT_MIN) % (1 << INT_BITS) + INT_MIN
+
+
+def _add(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch("+", left, right)
+    return _wrap(left + right)
+
+
+def _subtract(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch("-", left, right)
+    return _wrap(left - right)
+
+
+def _multiply(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch("*", left, right)
+    return _wrap(left * right)
+
+
+def _quotient(op: str, left: Value, right: Value) -> int:
+    """`left / right` truncated toward zero."""
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch(op, left, right)
+    if right == 0:
+        raise EvaluationError("Division by zero")
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+
+def _divide(left: Value, right: Value) -> Value:
+    return _wrap(_quotient("/", left, right))
+
+
+def _remainder(left: Value, right: Value) -> Value:
+    quotient = _quotient("%", left, right)
+    assert type(left) is int and type(right) is int
+    # Takes the sign of the dividend
+    return _wrap(left - right * quotient)
+
+
+def _less(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch("<", left, right)
+    return left < right
+
+
+def _less_or_equal(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch("<=", left, right)
+    return left <= right
+
+
+def _greater(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch(">", left, right)
+    return left > right
+
+
+def _greater_or_equal(left: Value, right: Value) -> Value:
+    if type(left) is not int or type(right) is not int:
+        raise _mismatch(">=", left, right)
+    return left >= right
+
+
+def _equal(left: Value, right: Value) -> Value:
+    if type(left) is not type(right):
+        raise _mismatch("==", left, right)
+    return left == right
+
+
+def _not_equal(left: Value, right: Value) -> Value:
+    if type(left) is not type(right):
+        raise _mismatch("!=", left, right)
+    return left != right
+
+
+# Implementations of the binary operators
+BINARY_OPERATORS: dict[str, Callable[[Value, Value], Value]] = {
+    "+": _add,
+    "-": _subtract,
+    "*": _multiply,
+    "/": _divide,
+    "%": _remainder,
+    "<": _less,
+    "<=": _less_or_equal,
+    ">": _greater,
+    ">=": _greater_or_equal,
+    "==": _equal,
+    "!=": _not_equal,
+}
+# By the argument of the BINARY instruction
+_BINARY = tuple(BINARY_OPERATORS[op] for op in OPERATORS)
+
+
+def _condition(value: Value, what: str) -> bool:
+    if type(value) is not bool:
+        raise EvaluationError(f"{what} must be a bool, not {_type_name(value)}")
+    return value
+
+
+def execute(code: Code, variables: dict[str, Value] | None = None) -> Value:
+    """
+    Run `code` with `variables` as the initial values, updating them with
+    the values assigned, and return the value it leaves on the stack.
+    """
+    instructions = code.instructions
+    constants = code.constants
+    binary = _BINARY
+    unbound = _UNBOUND
+    variables = {} if variables is None else variables
+    slots: list[object] = [variables.get(name, unbound) for name in code.names]
+    stack: list[Value] = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+    end = len(instructions)
+    # The opcodes are tested roughly by how often they run
+    while pc < end:
+        opcode = instructions[pc]
+        argument = instructions[pc + 1]
+        pc += 2
+        if opcode == CONST:
+            push(constants[argument])
+        elif opcode == BINARY:
+            right = pop()
+            stack[-1] = binary[argument](stack[-1], right)
+        elif opcode == LOAD:
+            value = slots[argument]
+            if value is unbound:
+                name = code.names[argument]
+                raise EvaluationError(f"Variable {name} has no value")
+            push(value)  # type: ignore[arg-type]
+        elif opcode == JUMP_IF_FALSE:
+            condition = pop()
+            if condition is False:
+                pc = argument
+            elif condition is not True:
+                _condition(condition, "Condition")
+        elif opcode == JUMP:
+            pc = argument
+        elif opcode == STORE:
+            slots[argument] = stack[-1]
+        elif opcode == POP:
+            pop()
+        elif opcode == JUMP_IF_FALSE_OR_POP:
+            if _condition(stack[-1], "Operand of and") is False:
+                pc = argument
+            else:
+                pop()
+        elif opcode == JUMP_IF_TRUE_OR_POP:
+            if _condition(stack[-1], "Operand of or") is True:
+                pc = argument
+            else:
+                pop()
+        elif opcode == CHECK_BOOL:
+            _condition(stack[-1], "Operand of and/or")
+        else:
+            raise Exception(f"Unknown opcode: {opcode}")
+
+    for name, value in zip(code.names, slots):
+        if value is not unbound:
+            variables[name] = value  # type: ignore[assignment]
+    return stack[-1]
+
+
+def walk(expr: ast.Expression, variables: dict[str, Value]) -> Value:
+    """
+    Evaluate `expr` by recursing over the tree, updating `variables` with
+    the values assigned. Deep trees go over the recursion limit.
+    """
+    match expr:
+        case ast.Literal(value):
+            return _wrap(value) if type(value) is int else value
+        case ast.Identifier(name):
+            if name in BOOLEANS:
+                return BOOLEANS[name]
+            if name not in variables:
+                raise EvaluationError(f"Variable {name} has no value")
+            return variables[name]
+        case ast.BinaryOp(ast.Identifier(name), "=", right):
+            if name in BOOLEANS:
+                raise Exception(f"Cannot assign to {expr.left}")
+            assigned = variables[name] = walk(right, variables)
+            return assigned
+        case ast.BinaryOp(left, "and", right):
+            if not _condition(walk(left, variables), "Operand of and"):
+                return False
+            return _condition(walk(right, variables), "Operand of and/or")
+        case ast.BinaryOp(left, "or", right):
+            if _condition(walk(left, variables), "Operand of or"):
+                return True
+            return _condition(walk(right, variables), "Operand of and/or")
+        case ast.BinaryOp(left, op, right) if op in BINARY_OPERATORS:
+            left_value = walk(left, variables)
+            return BINARY_OPERATORS[op](left_value, walk(right, variables))
+        case ast.IfThen(condition, then_branch):
+            if _condition(walk(condition, variables), "Condition"):
+                walk(then_branch, variables)
+            return None
+        case ast.IfThenElse(condition, then_branch, else_branch):
+            if _condition(walk(condition, variables), "Condition"):
+                return walk(then_branch, variables)
+            return walk(else_branch, variables)
+    raise Exception(f"Cannot evaluate {expr}")
+
+
+def check_variables(variables: object) -> dict[str, Value]:
+    """
+    Initial variable values from outside, like a JSON request: ints in
+    the 64-bit range or bools, by name.
+    """
+    if not isinstance(variables, dict):
+        raise ValueError(f"Variables must be an object, not {_type_name(variables)}")
+    for name, value in variables.items():
+        if not isinstance(name, str) or name in BOOLEANS:
+            raise ValueError(f"Invalid variable name: {name!r}")
+        if type(value) is int:
+            if not INT_MIN <= value <= INT_MAX:
+                raise ValueError(f"Variable {name} is out of range: {value}")
+        elif type(value) is not bool:
+            raise ValueError(
+                f"Variable {name} must be an int or a bool, not {_type_name(value)}"
+            )
+    return dict(variables)
+
+
+def interpret(source_code: str, variables: dict[str, Value] | None = None) -> Value:
+    """
+    Run a program's source through the front end and the stack machine.
+    The tree isn't folded, since a program run once wouldn't gain from
+    it.
+    """
+    with limits.deadline():
+        limits.check_source(source_code)
+        tokens = tokenize(source_code)
+        limits.check_tokens(len(tokens))
+        expr = parse(tokens)
+        limits.check_depth(expr)
+        return execute(lower(expr), variables)
+
+
+def format_value(value: Value) -> str:
+    if value is None:
+        return "unit"
+    if type(value) is bool:
+        return "true" if value else "false"
+    return str(value)
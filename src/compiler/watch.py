@@ -0,0 +1,369 @@
+import ctypes
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+import compiler.ast as ast
+from compiler.hashcons import HashConsTable
+from compiler.parser import parse
+from compiler.tokenizer import scan_line
+from compiler.utils import SPAN_BITS, Kind, LineIndex, Token
+
+"""
+Watch mode: recompile source files as they change.
+
+Each file's lines, their tokens and the multi-line comment state at each
+line start are kept between builds, so an edit only re-tokenizes the
+lines it touched, plus any following lines whose comment state it
+changed. If the token stream comes out the same, the previous executable
+is reused without parsing. Otherwise the file is parsed through a
+hash-consing table kept across builds, so unchanged subtrees come back as
+the same objects and a root identical to the previous one reuses its
+executable.
+
+Changes are found with inotify on Linux, through ctypes, and by polling
+modification times elsewhere.
+"""
+
+# Tokens of one line: text, kind, and start and end offsets in the line
+LineTokens = list[tuple[str, Kind, int, int]]
+
+
+class IncrementalFile:
+    """The last seen source of one file and what was built from it."""
+
+    def __init__(self) -> None:
+        self.source: str | None = None
+        self.lines: list[str] = []
+        self.line_tokens: list[LineTokens] = []
+        # Whether a multi-line comment is open at the start of each line,
+        # and at the end of the last one
+        self.comment_open: list[bool] = [False]
+        self.rescanned = 0
+        self.table = HashConsTable()
+        # The last root parsed and its executable, and whether they are
+        # for the current tokens
+        self.built: tuple[ast.Expression, bytes] | None = None
+        self.up_to_date = False
+
+    def update(self, source_code: str) -> bool:
+        """
+        Replace the source, re-tokenizing only the lines that need it.
+        Returns whether the token texts and kinds changed.
+        """
+        self.source = source_code
+        old_lines = self.lines
+        new_lines = source_code.splitlines(keepends=True)
+        limit = min(len(old_lines), len(new_lines))
+        prefix = 0
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while (
+            suffix < limit - prefix
+            and old_lines[-1 - suffix] == new_lines[-1 - suffix]
+        ):
+            suffix += 1
+
+        # Rescan from the first changed line until a line of the unchanged
+        # suffix starts in the same comment state as before
+        shift = len(old_lines) - len(new_lines)
+        scanned: list[LineTokens] = []
+        states = [self.comment_open[prefix]]
+        end = prefix
+        while end < len(new_lines):
+            if end >= len(new_lines) - suffix and (
+                states[-1] == self.comment_open[end + shift]
+            ):
+                break
+            tokens, multi_comment = scan_line(new_lines[end], states[-1])
+            scanned.append(tokens)
+            states.append(multi_comment)
+            end += 1
+
+        old_end = end + shift
+        changed = _texts(scanned) != _texts(self.line_tokens[prefix:old_end])
+        self.line_tokens[prefix:old_end] = scanned
+        self.comment_open[prefix : old_end + 1] = states
+        self.lines = new_lines
+        self.rescanned = len(scanned)
+        return changed
+
+    def tokens(self) -> list[Token]:
+        index = LineIndex()
+        tokens = []
+        offset = 0
+        for text, line_tokens in zip(self.lines, self.line_tokens):
+            index.starts.append(offset)
+            for value, kind, start, end in line_tokens:
+                span = (offset + start) << SPAN_BITS | (offset + end)
+                tokens.append(Token(value, kind, span, index))
+            offset += len(text)
+        return tokens
+
+    def compile(
+        self, source_code: str, generate: Callable[[ast.Expression], bytes]
+    ) -> bytes:
+        """Update the source and return its executable, rebuilding what changed."""
+        changed = self.update(source_code)
+        if not changed and self.up_to_date:
+            assert self.built is not None
+            return self.built[1]
+
+        self.up_to_date = False
+        tokens = self.tokens()
+        # Nodes of earlier versions pile up in the table, so start over
+        # once most of it is garbage
+        if len(self.table) > 2 * len(tokens) + 1024:
+            self.table = HashConsTable()
+        expr = parse(tokens, hash_cons=self.table)
+        if self.built is None or self.built[0] is not expr:
+            self.built = (expr, generate(expr))
+        self.up_to_date = True
+        return self.built[1]
+
+
+def _texts(line_tokens: list[LineTokens]) -> list[tuple[str, Kind]]:
+    return [(text, kind) for tokens in line_tokens for text, kind, _, _ in tokens]
+
+
+class Poller:
+    """Finds changed files by comparing modification times and sizes."""
+
+    def __init__(self, roots: list[Path], interval: float = 0.2) -> None:
+        self.roots = roots
+        self.interval = interval
+        self.seen = self._stat()
+
+    def _stat(self) -> dict[Path, tuple[int, int]]:
+        stats = {}
+        for root in self.roots:
+            paths = root.rglob("*") if root.is_dir() else [root]
+            for path in paths:
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if not path.is_dir():
+                    stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        """Changed, added and removed files, or an empty set on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = self._stat()
+            changed = {
+                path
+                for path in stats.keys() | self.seen.keys()
+                if stats.get(path) != self.seen.get(path)
+            }
+            self.seen = stats
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+
+    def close(self) -> None:
+        pass
+
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event, followed by a NUL-padded name of `len` bytes
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Reports files written, moved or deleted under the roots. Directories
+    are watched rather than files, so editors that save by renaming a new
+    file into place are seen too.
+    """
+
+    def __init__(self, roots: list[Path]) -> None:
+        self.roots = roots
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.directories: dict[int, Path] = {}
+        for root in roots:
+            if root.is_dir():
+                self._add_tree(root)
+            else:
+                self._add(root.parent)
+
+    def _add(self, directory: Path) -> None:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), WATCH_MASK
+        )
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(directory))
+        self.directories[wd] = directory
+
+    def _add_tree(self, directory: Path) -> set[Path]:
+        """Watch a directory and the ones under it, returning their files."""
+        self._add(directory)
+        files = set()
+        for path in directory.rglob("*"):
+            if path.is_dir():
+                self._add(path)
+            else:
+                files.add(path)
+        return files
+
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        """Changed, added and removed files, or an empty set on timeout."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        changed: set[Path] = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name_start = offset + INOTIFY_EVENT.size
+                name = data[name_start : name_start + length].rstrip(b"\0")
+                offset = name_start + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped, so anything may have changed
+                    changed |= Poller(self.roots).seen.keys()
+                    continue
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+                path = directory / os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and path.is_dir():
+                        changed |= self._add_tree(path)
+                else:
+                    changed.add(path)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def watcher(roots: list[Path], poll: bool = False) -> InotifyWatcher | Poller:
+    """An inotify watcher where it is available, otherwise a poller."""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            # No inotify in libc, or out of watches
+            pass
+    return Poller(roots)
+
+
+class Watch:
+    """
+    Keeps the outputs of `inputs` up to date. Like `compile`, `output` is
+    the output file for a single input file and a directory otherwise.
+    """
+
+    def __init__(
+        self,
+        inputs: list[str],
+        output: str,
+        generate: Callable[[ast.Expression], bytes],
+        poll: bool = False,
+    ) -> None:
+        self.roots = [Path(input) for input in inputs]
+        self.output = Path(output)
+        self.single = len(self.roots) == 1 and not self.roots[0].is_dir()
+        self.generate = generate
+        self.files: dict[Path, IncrementalFile] = {}
+        self.watcher = watcher(self.roots, poll)
+
+    def output_for(self, path: Path) -> Path | None:
+        """Where the executable of `path` goes, or None if it isn't a source."""
+        if self.single:
+            return self.output if path == self.roots[0] else None
+        if path.is_relative_to(self.output):
+            return None
+        for root in self.roots:
+            if path == root:
+                return self.output / path.name
+            if root.is_dir() and path.is_relative_to(root):
+                return self.output / path.relative_to(root)
+        return None
+
+    def sources(self) -> list[Path]:
+        paths: list[Path] = []
+        for root in self.roots:
+            if root.is_dir():
+                paths += sorted(path for path in root.rglob("*") if path.is_file())
+            else:
+                paths.append(root)
+        return [path for path in paths if self.output_for(path) is not None]
+
+    def build(self, path: Path) -> bool:
+        """Rebuild `path` if its source changed. Returns False on errors."""
+        output = self.output_for(path)
+        if output is None:
+            return True
+        try:
+            source_code = path.read_text()
+        except (FileNotFoundError, IsADirectoryError):
+            self.files.pop(path, None)
+            return True
+        except (OSError, UnicodeDecodeError) as e:
+            # Unreadable for now, like a file without permission to read it
+            print(f"{path}: {e}", file=sys.stderr)
+            self.files.pop(path, None)
+            return False
+        state = self.files.setdefault(path, IncrementalFile())
+        if state.source == source_code:
+            return True
+
+        start = time.perf_counter()
+        try:
+            executable = state.compile(source_code, self.generate)
+        except Exception as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            return False
+        try:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_bytes(executable)
+        except OSError as e:
+            print(f"{output}: {e}", file=sys.stderr)
+            return False
+        elapsed_ms = (time.perf_counter() - start) * 1e3
+        print(
+            f"{path} -> {output} in {elapsed_ms:.1f} ms"
+            f" ({state.rescanned} lines retokenized)"
+        )
+        return True
+
+    def step(self, timeout: float | None = None) -> None:
+        """Wait for changes and rebuild the changed files."""
+        for path in sorted(self.watcher.wait(timeout)):
+            self.build(path)
+
+    def run(self) -> None:
+        for path in self.sources():
+            self.build(path)
+        try:
+            while True:
+                self.step()
+        finally:
+            self.watcher.close()
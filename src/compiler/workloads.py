@@ -0,0 +1,167 @@
+import random
+from typing import Callable
+
+"""
+Deterministic synthetic programs for benchmarking the front end.
+
+Every generator takes an approximate size in bytes and a seed, and
+returns the same source for the same arguments. Some are realistic,
+like mixed expressions. Others are adversarial, like operator chains
+and nesting thousands of levels deep.
+"""
+
+OPERATORS = ["+", "-", "*", "/", "%", "<", "<=", "==", "!=", ">", ">="]
+
+
+def left_chain(size: int, seed: int = 0) -> str:
+    """`a + 1 - b * 2 ...`: one long chain of left associative operators."""
+    rng = random.Random(seed)
+    parts = ["x"]
+    length = 1
+    while length < size:
+        operand = rng.choice(["x", "y", str(rng.randrange(1000))])
+        parts.append(f" {rng.choice(OPERATORS)} {operand}")
+        length += len(parts[-1])
+    return "".join(parts)
+
+
+def nested_parens(size: int, seed: int = 0) -> str:
+    """`((((1 + x) + x) ...`: parentheses nested about `size / 6` deep."""
+    depth = max(1, size // 6)
+    return "(" * depth + "1" + " + x)" * depth
+
+
+def nested_ifs(size: int, seed: int = 0) -> str:
+    """`if a then if a then ... 1 else 2 else 2`, nested in the then branches."""
+    depth = max(1, size // 17)
+    return "if a then " * depth + "1" + " else 2" * depth
+
+
+def comment_heavy(size: int, seed: int = 0) -> str:
+    """Short expressions between line comments and multi-line comments."""
+    rng = random.Random(seed)
+    lines = ["0"]
+    length = 1
+    while length < size:
+        match rng.randrange(3):
+            case 0:
+                line = f"// {'comment ' * rng.randrange(1, 8)}"
+            case 1:
+                line = f"/* {'block\n' * rng.randrange(1, 4)}*/"
+            case _:
+                line = f"+ {rng.randrange(100)} # trailing"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+def identifier_heavy(size: int, seed: int = 0) -> str:
+    """Sums of long, mostly distinct identifiers."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz_"
+    parts = ["start"]
+    length = len(parts[0])
+    while length < size:
+        name = "".join(rng.choice(letters) for _ in range(rng.randrange(8, 32)))
+        parts.append(f" + {name}{rng.randrange(100)}")
+        length += len(parts[-1])
+    return "".join(parts)
+
+
+def realistic(size: int, seed: int = 0) -> str:
+    """
+    A mix of everything, nested only a few levels deep, split into lines
+    of about 80 characters.
+    """
+    rng = random.Random(seed)
+
+    def expression(depth: int) -> str:
+        choice = rng.randrange(10 if depth < 4 else 3)
+        if choice == 0:
+            return str(rng.randrange(1 << 16))
+        if choice <= 2:
+            return rng.choice(["x", "count", "total", "index", "value_1"])
+        if choice <= 6:
+            op = rng.choice(OPERATORS)
+            return f"{expression(depth + 1)} {op} {expression(depth + 1)}"
+        if choice <= 8:
+            return f"({expression(depth + 1)})"
+        condition = expression(depth + 1)
+        then_branch = expression(depth + 1)
+        if rng.randrange(2):
+            return f"(if {condition} then {then_branch})"
+        return f"(if {condition} then {then_branch} else {expression(depth + 1)})"
+
+    parts = [expression(0)]
+    length = len(parts[0])
+    line_length = length
+    while length < size:
+        part = f" {rng.choice(OPERATORS)} {expression(1)}"
+        if line_length + len(part) > 80:
+            part = "\n" + part.lstrip()
+            line_length = 0
+        if rng.randrange(20) == 0:
+            part += " // note"
+        parts.append(part)
+        length += len(part)
+        line_length += len(part)
+    return "".join(parts)
+
+
+def well_typed(size: int, seed: int = 0) -> str:
+    """
+    A program that runs without errors: it assigns x, y and z first, and
+    then adds up short integer expressions in a balanced tree of
+    parentheses, so it is only about log2(size) levels deep.
+    """
+    rng = random.Random(seed)
+    variables = ["x", "y", "z"]
+
+    def integer(depth: int) -> str:
+        choice = rng.randrange(8 if depth < 3 else 2)
+        if choice == 0:
+            return str(rng.randrange(1000))
+        if choice == 1:
+            return rng.choice(variables)
+        if choice <= 4:
+            op = rng.choice(["+", "-", "*"])
+            return f"({integer(depth + 1)} {op} {integer(depth + 1)})"
+        if choice == 5:
+            return f"({integer(depth + 1)} % {rng.randrange(1, 100)})"
+        if choice == 6:
+            return f"({rng.choice(variables)} = {integer(depth + 1)})"
+        return (
+            f"(if {boolean(depth + 1)} then {integer(depth + 1)}"
+            f" else {integer(depth + 1)})"
+        )
+
+    def boolean(depth: int) -> str:
+        if depth < 3 and rng.randrange(4) == 0:
+            op = rng.choice(["and", "or"])
+            return f"({boolean(depth + 1)} {op} {boolean(depth + 1)})"
+        op = rng.choice(["<", "<=", "==", "!=", ">", ">="])
+        return f"{integer(depth + 1)} {op} {integer(depth + 1)}"
+
+    terms = [" + ".join(f"({name} = {rng.randrange(100)})" for name in variables)]
+    # Each sum below adds "(", ") + (" and ")"
+    length = len(terms[0])
+    while length + 7 * len(terms) < size:
+        terms.append(integer(0))
+        length += len(terms[-1])
+    while len(terms) > 1:
+        pairs = zip(terms[::2], terms[1::2])
+        summed = [f"({left}) + ({right})" for left, right in pairs]
+        terms = summed + terms[len(summed) * 2 :]
+    return terms[0]
+
+
+# Generators by name
+WORKLOADS: dict[str, Callable[[int, int], str]] = {
+    "left_chain": left_chain,
+    "nested_parens": nested_parens,
+    "nested_ifs": nested_ifs,
+    "comment_heavy": comment_heavy,
+    "identifier_heavy": identifier_heavy,
+    "realistic": realistic,
+    "well_typed": well_typed,
+}
@@ -0,0 +1,53 @@
+from compiler.ast import BinaryOp, Identifier, IfThen, IfThenElse, Literal
+from compiler.ast_arena import BINARY_OP, LITERAL, from_arena, to_arena
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def test_round_trip() -> None:
+    expr = parse(tokenize("if a then (1 + 2) * b else if c then d = true"))
+    arena, root = to_arena(expr)
+    assert len(arena) == 12
+    assert from_arena(arena, root) == expr
+
+
+def test_children_precede_parents() -> None:
+    expr = BinaryOp(Literal(1), "+", BinaryOp(Literal(1), "+", Literal(2)))
+    arena, root = to_arena(expr)
+    assert root == len(arena) - 1
+    assert list(arena.kinds) == [LITERAL, LITERAL, LITERAL, BINARY_OP, BINARY_OP]
+    assert list(arena.children(root)) == [0, 3]
+    assert arena.constants.values == [1, 2]
+    assert arena.operators.values == ["+"]
+
+
+def test_literal_types_are_kept_apart() -> None:
+    expr = IfThenElse(Literal(True), Literal(1), Literal(False))
+    arena, root = to_arena(expr)
+    assert arena.constants.values == [True, 1, False]
+    assert from_arena(arena, root) == expr
+
+
+def test_shared_subtrees_are_added_once() -> None:
+    shared = BinaryOp(Identifier("x"), "*", Identifier("x"))
+    arena, root = to_arena(IfThen(shared, shared))
+    assert len(arena) == 4
+    result = from_arena(arena, root)
+    assert isinstance(result, IfThen)
+    assert result.condition is result.then_branch
+
+
+def test_subtree_of_root() -> None:
+    arena, _ = to_arena(BinaryOp(Literal(1), "-", Identifier("y")))
+    assert from_arena(arena, 1) == Identifier("y")
+
+
+def test_deep_tree() -> None:
+    depth = 20_000
+    arena, root = to_arena(parse(tokenize("(" * depth + "1" + " + 1)" * depth)))
+    assert len(arena) == 2 * depth + 1
+    expr = from_arena(arena, root)
+    for _ in range(depth):
+        assert isinstance(expr, BinaryOp)
+        expr = expr.left
+    assert expr == Literal(1)
@@ -0,0 +1,47 @@
+import copy
+
+from compiler.bench import compare, count_nodes, run, run_interpreters
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.workloads import WORKLOADS
+
+
+def test_workloads_are_deterministic_and_parse() -> None:
+    for name, generate in WORKLOADS.items():
+        source = generate(5000, 1)
+        assert source == generate(5000, 1), name
+        assert source != generate(5000, 2) or name.startswith("nested"), name
+        assert 4000 <= len(source) <= 6000, name
+        assert count_nodes(parse(tokenize(source))) > 1, name
+
+
+def test_deep_nesting_is_counted() -> None:
+    source = WORKLOADS["nested_parens"](600_000, 0)
+    # 100 000 levels, each with a + and an x
+    assert count_nodes(parse(tokenize(source))) == 200_001
+
+
+def test_compare_reports_regressions() -> None:
+    baseline = run(["left_chain", "nested_ifs"], size=2000, repeat=1)
+    current = copy.deepcopy(baseline)
+    assert compare(baseline, current) == []
+
+    chain = current["results"]["left_chain"]
+    chain["parse"]["nodes_per_second"] *= 0.8
+    chain["tokenize"]["peak_bytes"] *= 2
+    # Faster is fine
+    current["results"]["nested_ifs"]["tokenize"]["tokens_per_second"] *= 2
+    assert compare(baseline, current) == [
+        "left_chain tokenize: peak_bytes +100.0%",
+        "left_chain parse: nodes_per_second -20.0%",
+    ]
+    assert compare(baseline, current, threshold=0.25, memory_threshold=1.5) == []
+
+
+def test_interpreters_are_compared() -> None:
+    baseline = run(["well_typed"], size=2000, repeat=1)
+    baseline["interpret"] = run_interpreters(WORKLOADS["well_typed"](2000, 0), 1)
+    assert baseline["interpret"]["instructions"] > 0
+    current = copy.deepcopy(baseline)
+    current["interpret"]["execute"]["nodes_per_second"] *= 0.5
+    assert compare(baseline, current) == ["interpret execute: nodes_per_second -50.0%"]
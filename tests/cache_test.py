@@ -0,0 +1,83 @@
+import os
+from typing import Callable
+from pathlib import Path
+
+from pytest import MonkeyPatch
+
+from compiler.cache import CompileCache, default_directory
+
+
+def compile_counting(calls: list[str]) -> Callable[[str], bytes]:
+    def compile(source_code: str) -> bytes:
+        calls.append(source_code)
+        return source_code.encode() * 10
+
+    return compile
+
+
+def test_memory_tier_is_lru() -> None:
+    calls: list[str] = []
+    cache = CompileCache(max_entries=2)
+    compile = compile_counting(calls)
+    for source in ["a", "b", "a", "c", "a", "b"]:
+        assert cache.get_or_compile(source, compile) == source.encode() * 10
+    assert calls == ["a", "b", "c", "b"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["memory_evictions"]) == (2, 4, 2)
+    assert stats["disk_evictions"] == 0
+
+
+def test_disk_tier_is_shared(tmp_path: Path) -> None:
+    calls: list[str] = []
+    first = CompileCache(directory=str(tmp_path))
+    first.get_or_compile("1 + 2", compile_counting(calls))
+    second = CompileCache(directory=str(tmp_path))
+    assert second.get_or_compile("1 + 2", compile_counting(calls)) == b"1 + 2" * 10
+    assert calls == ["1 + 2"]
+    assert second.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_size_bound(tmp_path: Path) -> None:
+    cache = CompileCache(max_entries=1, directory=str(tmp_path), max_disk_bytes=250)
+    calls: list[str] = []
+    for source in ["x" * 10, "y" * 10, "z" * 10]:
+        cache.get_or_compile(source, compile_counting(calls))
+    entries = [p for p in tmp_path.iterdir() if not p.name.startswith(".")]
+    assert len(entries) == 2
+    stats = cache.stats()
+    assert stats["disk_bytes"] == 200
+    assert (stats["disk_evictions"], stats["memory_evictions"]) == (1, 2)
+
+
+def test_failed_compilations_are_not_cached() -> None:
+    cache = CompileCache()
+
+    def fail(source_code: str) -> bytes:
+        raise Exception("compile error")
+
+    for _ in range(2):
+        try:
+            cache.get_or_compile("x", fail)
+        except Exception:
+            pass
+    assert cache.stats()["misses"] == 2
+
+
+def test_counters_are_shared_with_forked_workers(tmp_path: Path) -> None:
+    cache = CompileCache(directory=str(tmp_path))
+    cache.get_or_compile("a", compile_counting([]))
+    pid = os.fork()
+    if pid == 0:
+        cache.get_or_compile("a", compile_counting([]))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert cache.stats()["hits"] == 1
+
+
+def test_default_directory_is_per_user(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", "/var/cache/someone")
+    assert default_directory() == "/var/cache/someone/pycompiler"
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setenv("HOME", "/home/someone")
+    assert default_directory() == "/home/someone/.cache/pycompiler"
+    assert CompileCache().stats()["memory_entries_in_process"] == 0
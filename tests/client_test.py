@@ -0,0 +1,87 @@
+import os
+import signal
+import socket
+from pathlib import Path
+
+from pytest import MonkeyPatch, fail
+
+import compiler.client as client
+from compiler.cache import CompileCache
+from compiler.server import run_async_server
+
+
+def compile(source_code: str, input_file_name: str) -> bytes:
+    if "bad" in source_code:
+        raise Exception(f"Bad source: {source_code}")
+    return source_code.encode()[::-1]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+def wait_until_listening(port: int) -> None:
+    client.wait_for_daemon("127.0.0.1", port, 5.0).close()
+
+
+def run_client(monkeypatch: MonkeyPatch, *args: str) -> int:
+    monkeypatch.setattr("sys.argv", ["client", *args])
+    return client.main()
+
+
+def test_client_compiles_on_daemon(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    port = free_port()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_async_server("127.0.0.1", port, compile, CompileCache())
+        finally:
+            os._exit(0)
+    try:
+        wait_until_listening(port)
+        source = tmp_path / "source"
+        output = tmp_path / "output"
+        source.write_text("1 + 2")
+        args = ["compile", str(source), f"--output={output}", f"--port={port}"]
+        assert run_client(monkeypatch, *args) == 0
+        assert output.read_bytes() == b"2 + 1"
+
+        source.write_text("bad")
+        output.unlink()
+        assert run_client(monkeypatch, *args) == 1
+        assert not output.exists()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+def test_client_falls_back_to_compiling_in_process(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+) -> None:
+    source = tmp_path / "source"
+    source.write_text("1 + 2")
+    args = [
+        "compile", str(source), f"--output={tmp_path / 'output'}",
+        f"--port={free_port()}", "--no-start",
+    ]
+    # The in-process compiler has no code generator yet
+    try:
+        run_client(monkeypatch, *args)
+    except NotImplementedError:
+        return
+    fail("Expected the in-process compiler to run")
+
+
+def test_started_daemon_serves_compiles() -> None:
+    port = free_port()
+    daemon = client.start_daemon("127.0.0.1", port)
+    try:
+        wait_until_listening(port)
+        header, _ = client.compile_remotely("127.0.0.1", port, "1 + 2", start=False)
+        assert "Code generation not implemented" in header["error"]
+    finally:
+        daemon.terminate()
+        daemon.wait(10)
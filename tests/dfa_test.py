@@ -0,0 +1,43 @@
+import random
+
+from compiler.dfa import build_dfa, scan
+from compiler.tokenizer import tokenize
+
+SOURCES = [
+    "",
+    "if  3\nwhile \n \n else",
+    "1+2-/<>\n<=>=!====*",
+    "()), {{}}, ; ",
+    "s# 404\n2",
+    "a/*a\nb\n#c\n//\nd*/e",
+    "a // /* b\nc /* # */ d",
+    "if a/*x\r\ny*/then\r\n  b + 12 # c\n\nelse\r(3)// d\n*/",
+    "iff ifthen then1 _else 12ab ! != !x @ elsewhere",
+]
+
+
+def test_dfa_matches_regex_scanner() -> None:
+    for source in SOURCES:
+        assert tokenize(source, scanner="dfa") == tokenize(source)
+
+
+def test_dfa_matches_regex_scanner_on_random_input() -> None:
+    rng = random.Random(0)
+    alphabet = list("+-*/=!<>%(){},;#_ \n\r\t") + ["if", "then", "else", "a", "7"]
+    for _ in range(300):
+        source = "".join(rng.choice(alphabet) for _ in range(rng.randrange(40)))
+        assert tokenize(source, scanner="dfa") == tokenize(source), repr(source)
+
+
+def test_maximal_munch() -> None:
+    dfa = build_dfa({"-": "operator", "->": "operator", "-->": "operator"})
+    assert [(s, e) for _, s, e in scan(b"--->-", dfa)] == [(0, 1), (1, 4), (4, 5)]
+
+
+def test_keyword_prefixes_are_identifiers() -> None:
+    dfa = build_dfa({"while": "conditional"})
+    assert list(scan(b"whil while whiles", dfa)) == [
+        ("identifier", 0, 4),
+        ("conditional", 5, 10),
+        ("identifier", 11, 17),
+    ]
@@ -0,0 +1,91 @@
+from compiler.ast import BinaryOp, Expression, Identifier, IfThenElse, Literal
+from compiler.folding import INT_MIN, evaluate, fold_constants
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def fold(source: str) -> Expression:
+    return fold_constants(parse(tokenize(source)))[0]
+
+
+def test_integer_semantics() -> None:
+    assert fold("1 + 2 * 3 - 4") == Literal(3)
+    assert fold("9223372036854775807 + 1") == Literal(INT_MIN)
+    assert fold("0 - 9223372036854775807 - 1 - 1") == Literal(-INT_MIN - 1)
+    assert fold("7 / 2") == Literal(3)
+    assert fold("(0 - 7) / 2") == Literal(-3)
+    assert fold("(0 - 7) % 2") == Literal(-1)
+    assert fold("7 % (0 - 2)") == Literal(1)
+    assert evaluate("/", INT_MIN, -1) == INT_MIN
+    # Left for run time
+    assert fold("1 / 0") == BinaryOp(Literal(1), "/", Literal(0))
+    assert fold("2 % (1 - 1)") == BinaryOp(Literal(2), "%", Literal(0))
+
+
+def test_comparisons_and_booleans() -> None:
+    assert fold("1 + 1 == 2") == Literal(True)
+    assert fold("3 <= 2") == Literal(False)
+    assert fold("1 < 2 and 2 > 3") == Literal(False)
+    assert fold("true != false or false") == Literal(True)
+    assert fold("false and x") == Identifier("false")
+    assert fold("true and x < 1") == BinaryOp(Identifier("x"), "<", Literal(1))
+    assert fold("false or (x = y == 2)") == BinaryOp(
+        Identifier("x"), "=", BinaryOp(Identifier("y"), "==", Literal(2))
+    )
+    assert fold("true or (y = 1)") == Identifier("true")
+    # x is evaluated first, so it stays
+    assert fold("x and false") == BinaryOp(Identifier("x"), "and", Identifier("false"))
+    # Mismatched types are left for the type checker
+    assert fold("1 == true") == BinaryOp(Literal(1), "==", Identifier("true"))
+
+
+def test_branches_and_identities() -> None:
+    assert fold("if 1 < 2 then a else b") == Identifier("a")
+    assert fold("if false then a else (b + 1) + 0") == BinaryOp(
+        Identifier("b"), "+", Literal(1)
+    )
+    assert fold("if c then 2 * 3 else 1 * (d % 2)") == IfThenElse(
+        Identifier("c"), Literal(6), BinaryOp(Identifier("d"), "%", Literal(2))
+    )
+    assert fold("(x - y) * 1 + 0 - 0 / 1") == BinaryOp(
+        Identifier("x"), "-", Identifier("y")
+    )
+    assert fold("0 - x") == BinaryOp(Literal(0), "-", Identifier("x"))
+    assert fold("1 / x") == BinaryOp(Literal(1), "/", Identifier("x"))
+
+
+def test_type_errors_are_kept() -> None:
+    # The remaining operand's type isn't known, or is wrong
+    for source in [
+        "true + 0",
+        "0 + true",
+        "b * 1",
+        "x / 1",
+        "(x < 2) - 0",
+        "true and x",
+        "false or 5",
+        "true and (if c then 1 else false)",
+    ]:
+        expr = parse(tokenize(source))
+        assert fold_constants(expr) == (expr, 0), source
+    assert fold("true and 5") == BinaryOp(Identifier("true"), "and", Literal(5))
+
+
+def test_removed_nodes_and_sharing() -> None:
+    expr = parse(tokenize("(a + b) * (1 + 2)"))
+    folded, removed = fold_constants(expr)
+    assert removed == 2
+    assert isinstance(expr, BinaryOp) and isinstance(folded, BinaryOp)
+    assert folded.left is expr.left
+
+    unchanged = parse(tokenize("a < b"))
+    assert fold_constants(unchanged) == (unchanged, 0)
+
+
+def test_deep_trees() -> None:
+    n = 20_000
+    folded, removed = fold_constants(parse(tokenize("1" + " + 1" * n)))
+    assert folded == Literal(n + 1) and removed == 2 * n
+    nested = "if true then " * n + "x" + " else 0" * n
+    folded, removed = fold_constants(parse(tokenize(nested)))
+    assert folded == Identifier("x") and removed == 3 * n
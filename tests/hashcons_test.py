@@ -0,0 +1,42 @@
+from compiler.ast import BinaryOp, Identifier, IfThenElse, Literal
+from compiler.hashcons import HashConsTable
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def test_repeated_subexpressions_are_shared() -> None:
+    table = HashConsTable()
+    expr = parse(tokenize("(a + 1) * (a + 1) - (a + 1)"), hash_cons=table)
+    assert expr == parse(tokenize("(a + 1) * (a + 1) - (a + 1)"))
+    assert isinstance(expr, BinaryOp) and isinstance(expr.left, BinaryOp)
+    assert expr.left.left is expr.left.right is expr.right
+    # a, 1, a + 1, (a + 1) * (a + 1) and the root
+    assert len(table) == 5
+
+
+def test_structural_hash_and_equality() -> None:
+    table = HashConsTable()
+    a = table.intern(BinaryOp(Identifier("x"), "<", Literal(2)))
+    b = parse(tokenize("x < 2"), hash_cons=table)
+    c = table.intern(BinaryOp(Identifier("x"), "<", Literal(3)))
+    assert a is b
+    assert table.hash(a) == table.hash(b)
+    assert table.hash(a) != table.hash(c)
+    assert table.equal(a, b) and not table.equal(a, c)
+    assert table.equal(a, BinaryOp(Identifier("x"), "<", Literal(2)))
+
+
+def test_literal_types_are_kept_apart() -> None:
+    table = HashConsTable()
+    expr = table.intern(IfThenElse(Literal(True), Literal(1), Literal(True)))
+    assert isinstance(expr, IfThenElse)
+    assert expr.condition is expr.else_branch
+    assert expr.then_branch is not expr.condition
+
+
+def test_tables_agree_on_hashes() -> None:
+    source = "if a then b * 2 else c"
+    first, second = HashConsTable(), HashConsTable()
+    assert first.hash(parse(tokenize(source), hash_cons=first)) == second.hash(
+        parse(tokenize(source), hash_cons=second)
+    )
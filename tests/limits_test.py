@@ -0,0 +1,99 @@
+import pickle
+import time
+from typing import Callable
+
+from pytest import fail
+
+import compiler.limits as limits
+from compiler.errors import LimitExceededError
+from compiler.limits import Limits
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def rejected(limit: str, check: Callable[[], object]) -> bool:
+    try:
+        check()
+    except LimitExceededError as e:
+        return e.limit == limit
+    return False
+
+
+def with_limits(test: Callable[[], None], installed: Limits) -> None:
+    limits.install(installed)
+    try:
+        test()
+    finally:
+        limits.install(Limits())
+
+
+def test_source_size_counts_bytes() -> None:
+    def test() -> None:
+        limits.check_source("x" * 8)
+        limits.check_source("ä" * 4)
+        assert rejected("max_source_bytes", lambda: limits.check_source("ä" * 5))
+
+    with_limits(test, Limits(max_source_bytes=8))
+
+
+def test_request_size_allows_for_escapes() -> None:
+    def test() -> None:
+        maximum = limits.max_request_bytes()
+        assert maximum is not None
+        limits.check_request(maximum)
+        assert rejected("max_source_bytes", lambda: limits.check_request(maximum + 1))
+
+    with_limits(test, Limits(max_source_bytes=8))
+    assert limits.max_request_bytes() is None
+    limits.check_request(1 << 40)
+
+
+def test_token_count() -> None:
+    def test() -> None:
+        tokens = tokenize("1 + 2 + 3")
+        assert rejected("max_tokens", lambda: limits.check_tokens(len(tokens)))
+        assert rejected("max_tokens", lambda: list(limits.counted(iter(tokens))))
+        assert list(limits.counted(tokens[:4])) == tokens[:4]
+
+    with_limits(test, Limits(max_tokens=4))
+
+
+def test_ast_depth() -> None:
+    def test() -> None:
+        limits.check_depth(parse(tokenize("(1 + 2) * (3 + 4)")))
+        deep = parse(tokenize("if a then if b then 1 + 2"))
+        assert rejected("max_depth", lambda: limits.check_depth(deep))
+
+    with_limits(test, Limits(max_depth=3))
+
+
+def test_deadline() -> None:
+    def test() -> None:
+        start = time.perf_counter()
+        try:
+            with limits.deadline():
+                while True:
+                    pass
+        except LimitExceededError as e:
+            assert e.limit == "deadline"
+        else:
+            fail("Deadline did not expire")
+        assert time.perf_counter() - start < 1
+        # The timer is cancelled when the block ends in time
+        with limits.deadline():
+            pass
+        time.sleep(0.1)
+
+    with_limits(test, Limits(deadline=0.05))
+
+
+def test_errors_survive_pickling() -> None:
+    error = pickle.loads(pickle.dumps(LimitExceededError("Too big", "max_tokens", 5)))
+    assert (str(error), error.limit, error.maximum) == ("Too big", "max_tokens", 5)
+
+
+def test_no_limits_by_default() -> None:
+    limits.check_source("x" * 100_000)
+    limits.check_tokens(100_000)
+    with limits.deadline():
+        pass
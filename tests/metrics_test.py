@@ -0,0 +1,63 @@
+import os
+from pathlib import Path
+
+import compiler.metrics as metrics
+from compiler.metrics import Metrics
+
+
+def test_quantiles_come_from_buckets() -> None:
+    m = Metrics()
+    for nanoseconds in [1000] * 90 + [1_000_000] * 10:
+        m.observe(metrics.PARSE, nanoseconds)
+    # 1000 ns falls in the bucket below 1024 ns, 1 ms in the one below 2**20
+    assert m.quantile(metrics.PARSE, 0.5) == 1024 / 1e9
+    assert m.quantile(metrics.PARSE, 0.9) == 1024 / 1e9
+    assert m.quantile(metrics.PARSE, 0.99) == 2**20 / 1e9
+    phases = m.snapshot()["phases"]
+    assert list(phases) == ["parse"]
+    assert phases["parse"]["count"] == 100
+    assert phases["parse"]["mean_ms"] == 0.1009
+
+
+def test_forked_workers_aggregate() -> None:
+    m = Metrics()
+    metrics.install(m)
+    try:
+        pid = os.fork()
+        if pid == 0:
+            with metrics.request():
+                with metrics.timed(metrics.TOKENIZE):
+                    pass
+            os._exit(0)
+        os.waitpid(pid, 0)
+    finally:
+        metrics.install(None)
+    snapshot = m.snapshot()
+    assert (snapshot["requests"], snapshot["active"]) == (1, 0)
+    assert snapshot["phases"]["tokenize"]["count"] == 1
+    assert snapshot["phases"]["request"]["count"] == 1
+
+
+def test_uninstalled_metrics_record_nothing() -> None:
+    with metrics.request():
+        with metrics.timed(metrics.PARSE):
+            metrics.count(metrics.ERRORS)
+    assert metrics.installed() is None
+
+
+def test_prometheus_export(tmp_path: Path) -> None:
+    path = tmp_path / "metrics.prom"
+    m = Metrics(str(path))
+    m.observe(metrics.SEND, 3)
+    m.count(metrics.REQUESTS)
+    m.maybe_export(lambda: {"cache_hits": 7})
+    text = path.read_text()
+    assert 'compiler_phase_seconds_bucket{phase="send",le="2e-09"} 0' in text
+    assert 'compiler_phase_seconds_bucket{phase="send",le="4e-09"} 1' in text
+    assert 'compiler_phase_seconds_count{phase="send"} 1' in text
+    assert "compiler_requests_total 1" in text
+    assert "compiler_cache_hits 7" in text
+    # Within the interval nothing is written
+    path.unlink()
+    m.maybe_export(lambda: {})
+    assert not path.exists()
@@ -1,10 +1,13 @@
+import io
+
 from pytest import fail
 
 from compiler.ast import BinaryOp, Identifier, IfThenElse, Literal, IfThen
 from compiler.errors import EmptyInputError, UnexpectedTokenError, MissingTokenError
-from compiler.parser import parse
+from compiler.parser import Lookahead, parse
 from compiler.utils import L, Location, Token
-from compiler.tokenizer import tokenize
+from compiler.tokenizer import tokenize, tokenize_buffer, tokenize_stream
+from compiler.tracing import CountingTracer, FileTracer
 
 
 def test_empty() -> None:
@@ -270,3 +273,146 @@ def test_fail_if_else_no_then_statement() -> None:
 
 def test_remainder_operator() -> None:
     assert parse(tokenize("1 % 2")) == BinaryOp(Literal(1), "%", Literal(2))
+
+
+def test_token_buffer_input() -> None:
+    assert parse(tokenize_buffer("if a then (1 + 2) * b else c")) == IfThenElse(
+        condition=Identifier("a"),
+        then_branch=BinaryOp(
+            BinaryOp(Literal(1), "+", Literal(2)), "*", Identifier("b")
+        ),
+        else_branch=Identifier("c"),
+    )
+
+
+def test_token_buffer_error_location() -> None:
+    try:
+        parse(tokenize_buffer("a +\n  )"))
+        fail("Parser did not catch the closing parenthesis")
+    except UnexpectedTokenError as e:
+        assert str(e) == f"{Location(1, (2, 3))}: Unexpected closing parenthesis"
+
+
+def test_assignment_is_right_associative() -> None:
+    assert parse(tokenize("a = b = c or d")) == BinaryOp(
+        Identifier("a"),
+        "=",
+        BinaryOp(
+            Identifier("b"), "=", BinaryOp(Identifier("c"), "or", Identifier("d"))
+        ),
+    )
+
+
+def test_operator_precedence_levels() -> None:
+    assert parse(tokenize("a or b and c == d < e + f * g")) == BinaryOp(
+        Identifier("a"),
+        "or",
+        BinaryOp(
+            Identifier("b"),
+            "and",
+            BinaryOp(
+                Identifier("c"),
+                "==",
+                BinaryOp(
+                    Identifier("d"),
+                    "<",
+                    BinaryOp(
+                        Identifier("e"),
+                        "+",
+                        BinaryOp(Identifier("f"), "*", Identifier("g")),
+                    ),
+                ),
+            ),
+        ),
+    )
+
+
+def test_fail_unexpected_else() -> None:
+    try:
+        parse(tokenize("1 + else"))
+        fail("Parser did not catch the else without if")
+    except UnexpectedTokenError as e:
+        assert str(e) == f"{Location(0, (4, 8))}: Unexpected else"
+
+
+def test_deeply_nested_parentheses() -> None:
+    depth = 100_000
+    expr = parse(tokenize("(" * depth + "1" + ")" * depth + " + 2"))
+    assert expr == BinaryOp(Literal(1), "+", Literal(2))
+
+
+def test_deeply_nested_ifs() -> None:
+    depth = 100_000
+    expr = parse(tokenize("if a then " * depth + "1"))
+    for _ in range(depth):
+        assert isinstance(expr, IfThen)
+        assert expr.condition == Identifier("a")
+        expr = expr.then_branch
+    assert expr == Literal(1)
+
+
+def test_trace_file() -> None:
+    trace = io.StringIO()
+    parse(tokenize("if a then (1)"), tracer=FileTracer(trace))
+    assert trace.getvalue().splitlines() == [
+        "> 0 expression",
+        "> 0 conditional",
+        "c 0 if",
+        "> 1 identifier",
+        "c 1 a",
+        "< 2 identifier",
+        "c 2 then",
+        "> 3 parenthesized",
+        "c 3 (",
+        "> 4 int_literal",
+        "c 4 1",
+        "< 5 int_literal",
+        "c 5 )",
+        "< 6 parenthesized",
+        "b 6 conditional",
+        "< 6 conditional",
+        "< 6 expression",
+    ]
+
+
+def test_counting_tracer() -> None:
+    tracer = CountingTracer()
+    parse(tokenize("a + b * (c - 1)"), tracer=tracer)
+    assert tracer.consumed == 9
+    assert tracer.entries == {
+        "expression": 1,
+        "identifier": 3,
+        "binary_op": 3,
+        "parenthesized": 1,
+        "int_literal": 1,
+    }
+    assert set(tracer.nanoseconds) == set(tracer.entries)
+
+
+def test_token_iterator_input() -> None:
+    source = "if a then (1 + 2) * b else c = d"
+    assert parse(iter(tokenize(source))) == parse(tokenize(source))
+
+
+def test_token_iterator_errors() -> None:
+    try:
+        parse(iter([]))
+        fail("Parser did not fail with empty input")
+    except EmptyInputError as e:
+        assert str(e) == "Input string is empty"
+    try:
+        parse(tokenize_stream(io.StringIO("(1 +\n 2")))
+        fail("Parser did not catch the closing paranthesis missing")
+    except UnexpectedTokenError as e:
+        assert str(e) == f'{Location(1, (1, 2))}: expected ")"'
+
+
+def test_lookahead_window_drops_consumed_tokens() -> None:
+    window = Lookahead(tokenize("a b c d"), size=2)
+    assert window[2].text == "c"
+    assert window[4].kind == "end"
+    try:
+        window[0]
+        fail("Lookahead kept a token outside its window")
+    except IndexError:
+        pass
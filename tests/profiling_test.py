@@ -0,0 +1,43 @@
+import compiler.profiling as profiling
+from compiler.__main__ import call_compiler
+from compiler.profiling import Profiler
+
+
+def test_compiler_phases_are_recorded() -> None:
+    profiler = Profiler()
+    profiling.install(profiler)
+    try:
+        call_compiler("1 + 2 * x", "(source code)")
+    except NotImplementedError:
+        pass
+    finally:
+        profiling.install(None)
+    names = [stats.name for stats in profiler.phases]
+    assert names == ["tokenize", "parse", "check", "fold", "generate"]
+    assert all(stats.seconds >= 0 for stats in profiler.phases)
+    assert "tokenize" in profiler.report()
+
+
+def test_memory_stats_find_allocation_sites() -> None:
+    profiler = Profiler(memory=True, top=3)
+    profiler.start()
+    try:
+        with profiler.phase("allocate"):
+            kept = [bytearray(1000) for _ in range(1000)]
+        with profiler.phase("free"):
+            del kept
+    finally:
+        profiler.stop()
+    allocate, free = profiler.phases
+    assert allocate.allocated >= 1_000_000 and allocate.peak >= allocate.allocated
+    assert free.allocated <= -1_000_000
+    site, size = allocate.sites[0]
+    assert site.startswith(__file__) and size >= 1_000_000
+    assert profiler.peak >= 1_000_000
+    assert "top allocations in allocate" in profiler.report()
+
+
+def test_phases_are_free_without_a_profiler() -> None:
+    assert profiling.installed() is None
+    with profiling.phase("nothing"):
+        pass
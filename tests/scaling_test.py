@@ -0,0 +1,54 @@
+import gc
+from typing import Callable, TypeVar
+
+from pytest import fail
+
+from compiler.bench import best_time, scaling_exponent
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.workloads import WORKLOADS
+
+# Input sizes in bytes, doubling
+SIZES = [16_000, 32_000, 64_000, 128_000]
+# Linear is 1 and quadratic 2, with room for timing noise in between
+MAX_EXPONENT = 1.3
+ATTEMPTS = 3
+
+T = TypeVar("T")
+
+
+def exponent(
+    prepare: Callable[[str], T], phase: Callable[[T], object], name: str
+) -> float:
+    inputs = [prepare(WORKLOADS[name](size, 0)) for size in SIZES]
+    seconds = []
+    for input in inputs:
+        gc.collect()
+        seconds.append(best_time(lambda: phase(input), 3))
+    return scaling_exponent(SIZES, seconds)
+
+
+def assert_linear(prepare: Callable[[str], T], phase: Callable[[T], object]) -> None:
+    for name in WORKLOADS:
+        # A noisy machine can bend one fit, but not several in a row
+        exponents = []
+        for _ in range(ATTEMPTS):
+            exponents.append(exponent(prepare, phase, name))
+            if exponents[-1] <= MAX_EXPONENT:
+                break
+        else:
+            fail(f"{name}: time grows as size ** {min(exponents):.2f}")
+
+
+def test_fitted_exponent() -> None:
+    sizes = [1, 2, 4, 8]
+    assert abs(scaling_exponent(sizes, [3 * n for n in sizes]) - 1) < 1e-9
+    assert abs(scaling_exponent(sizes, [n * n for n in sizes]) - 2) < 1e-9
+
+
+def test_tokenize_scales_linearly() -> None:
+    assert_linear(lambda source: source, lambda source: tokenize(source))
+
+
+def test_parse_scales_linearly() -> None:
+    assert_linear(tokenize, parse)
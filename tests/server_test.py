@@ -0,0 +1,351 @@
+import json
+import os
+import signal
+import socket
+import time
+from base64 import b64decode
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from pytest import fail, raises
+
+from compiler.cache import CompileCache
+import compiler.limits as limits
+from compiler.limits import Limits
+import compiler.metrics as metrics
+from compiler.metrics import Metrics
+from compiler.server import (
+    BUSY,
+    FRAME_HEADER,
+    handle_request,
+    run_async_server,
+    run_prefork_server,
+    run_server,
+    send_chunks,
+)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+def start_server(
+    run: Callable[..., None], *args: Any, **kwargs: Any
+) -> tuple[int, int]:
+    """Start a server in a forked process and return its pid and port."""
+    port = free_port()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run("127.0.0.1", port, *args, **kwargs)
+        finally:
+            os._exit(0)
+    return pid, port
+
+
+def stop_server(pid: int) -> None:
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+
+def connect(port: int) -> socket.socket:
+    # Waits for the server to start listening
+    for _ in range(100):
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    return socket.create_connection(("127.0.0.1", port))
+
+
+def request(port: int, input: dict[str, Any]) -> dict[str, Any]:
+    with connect(port) as connection:
+        connection.sendall(json.dumps(input).encode())
+        connection.shutdown(socket.SHUT_WR)
+        chunks = []
+        while chunk := connection.recv(1 << 16):
+            chunks.append(chunk)
+    result: dict[str, Any] = json.loads(b"".join(chunks))
+    return result
+
+
+def compile(source_code: str, input_file_name: str) -> bytes:
+    if source_code == "slow":
+        time.sleep(1)
+    if "bad" in source_code:
+        raise Exception(f"{input_file_name}: cannot compile")
+    return source_code.encode()[::-1]
+
+
+def test_compile_batch_reports_each_program() -> None:
+    cache = CompileCache()
+    cache.put(cache.key("cached"), b"from cache")
+    codes = ["1 + 2", "bad", "cached", "x"]
+    input = {"command": "compile_batch", "codes": codes}
+    result = handle_request(input, compile, cache)
+    items = {item["index"]: item for item in result["results"]}
+    assert b64decode(items[0]["program"]) == b"2 + 1"
+    assert "cannot compile" in items[1]["error"]
+    assert b64decode(items[2]["program"]) == b"from cache"
+    assert b64decode(items[3]["program"]) == b"x"
+    assert cache.get(cache.key("x")) == b"x"
+
+
+def test_compile_batch_of_one_skips_the_pool() -> None:
+    def compile_here(source_code: str, input_file_name: str) -> bytes:
+        return str(os.getpid()).encode()
+
+    input = {"command": "compile_batch", "codes": ["1", "cached"]}
+    cache = CompileCache()
+    cache.put(cache.key("cached"), b"from cache")
+    result = handle_request(input, compile_here, cache)
+    items = {item["index"]: item for item in result["results"]}
+    assert b64decode(items[0]["program"]) == str(os.getpid()).encode()
+    assert b64decode(items[1]["program"]) == b"from cache"
+
+
+def test_failed_response_is_cut_off_after_it_started() -> None:
+    def failing(sent: list[bytes]) -> Iterator[bytes]:
+        yield from sent
+        raise Exception("compile_batch failed")
+
+    left, right = socket.socketpair()
+    with left, right:
+        try:
+            send_chunks(left, failing([]))
+        except Exception as e:
+            assert str(e) == "compile_batch failed"
+        else:
+            fail("nothing was sent, so the error should be raised")
+        send_chunks(left, failing([b"first frame"]))
+        # Nothing after the frame already sent, not even an error
+        assert right.recv(1 << 16) == b"first frame"
+        assert right.recv(1 << 16) == b""
+
+
+def run_prefork_server_with_metrics(*args: Any, **kwargs: Any) -> None:
+    metrics.install(Metrics())
+    run_prefork_server(*args, **kwargs)
+
+
+def test_prefork_server_replaces_retired_workers() -> None:
+    pid, port = start_server(
+        run_prefork_server_with_metrics,
+        compile,
+        CompileCache(),
+        workers=2,
+        max_requests=2,
+    )
+    try:
+        # More requests than the workers can handle before being replaced
+        for _ in range(6):
+            assert request(port, {"command": "ping"}) == {}
+        result = request(port, {"command": "compile", "code": "1 + 2"})
+        assert b64decode(result["program"]) == b"2 + 1"
+        assert request(port, {"command": "compile", "code": "1 + 2"}) == result
+        stats = request(port, {"command": "stats"})
+        assert stats["cache"]["hits"] + stats["cache"]["misses"] == 2
+        # The stats request itself is still in progress
+        assert stats["metrics"]["requests"] == 9
+        assert stats["metrics"]["active"] == 1
+        assert stats["metrics"]["phases"]["compile"]["count"] == 2
+    finally:
+        stop_server(pid)
+
+
+def test_prefork_server_needs_the_shared_socket_to_retire_workers() -> None:
+    with raises(Exception, match="can't be used with --reuse-port"):
+        run_prefork_server(
+            "127.0.0.1", free_port(), compile, CompileCache(), 2,
+            max_requests=2, reuse_port=True,
+        )
+
+
+def read_exactly(connection: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        assert chunk, "connection closed"
+        data += chunk
+    return data
+
+
+def test_async_server_pipelines_framed_requests() -> None:
+    pid, port = start_server(run_async_server, compile, CompileCache(), workers=2)
+    try:
+        # The one-shot protocol still works on the same port
+        assert request(port, {"command": "ping"}) == {}
+
+        sources = [f"{i} + x" for i in range(20)]
+        messages = [{"command": "compile", "code": code} for code in sources]
+        messages.insert(5, {"command": "ping"})
+        with socket.create_connection(("127.0.0.1", port)) as connection:
+            # Send everything before reading anything
+            for message in messages:
+                data = json.dumps(message).encode()
+                connection.sendall(FRAME_HEADER.pack(len(data)) + data)
+            results = []
+            for _ in messages:
+                (size,) = FRAME_HEADER.unpack(read_exactly(connection, 4))
+                results.append(json.loads(read_exactly(connection, size)))
+        assert results.pop(5) == {}
+        for code, result in zip(sources, results):
+            assert b64decode(result["program"]) == code.encode()[::-1]
+
+        # A batch streams a frame per program and then the count
+        with socket.create_connection(("127.0.0.1", port)) as connection:
+            data = json.dumps({"command": "compile_batch", "codes": sources}).encode()
+            connection.sendall(FRAME_HEADER.pack(len(data)) + data)
+            indices = []
+            while True:
+                (size,) = FRAME_HEADER.unpack(read_exactly(connection, 4))
+                result = json.loads(read_exactly(connection, size))
+                if "count" in result:
+                    break
+                indices.append(result["index"])
+        assert result == {"count": len(sources)}
+        assert sorted(indices) == list(range(len(sources)))
+    finally:
+        stop_server(pid)
+
+
+def read_binary(connection: socket.socket) -> tuple[dict[str, Any], bytes]:
+    (size,) = FRAME_HEADER.unpack(read_exactly(connection, 4))
+    header = json.loads(read_exactly(connection, size))
+    return header, read_exactly(connection, header.get("size", 0))
+
+
+def test_binary_responses_carry_raw_executables(tmp_path: Path) -> None:
+    on_disk = bytes(range(256)) * 100
+    cache = CompileCache(directory=str(tmp_path))
+    cache.put(cache.key("on disk"), on_disk)
+
+    runs: list[Callable[..., None]] = [run_server, run_async_server]
+    for run in runs:
+        pid, port = start_server(run, compile, CompileCache(directory=str(tmp_path)))
+        try:
+            for code, expected in [("on disk", on_disk), ("1 + 2", b"2 + 1")]:
+                with connect(port) as connection:
+                    input = {"command": "compile", "code": code, "format": "binary"}
+                    connection.sendall(json.dumps(input).encode())
+                    connection.shutdown(socket.SHUT_WR)
+                    header, body = read_binary(connection)
+                    assert (header, body) == ({"size": len(expected)}, expected)
+                    assert connection.recv(1) == b""
+
+            with connect(port) as connection:
+                batch = {
+                    "command": "compile_batch",
+                    "codes": ["x", "bad", "on disk"],
+                    "format": "binary",
+                }
+                connection.sendall(json.dumps(batch).encode())
+                connection.shutdown(socket.SHUT_WR)
+                items = {}
+                while "count" not in (response := read_binary(connection))[0]:
+                    header, body = response
+                    items[header["index"]] = header, body
+            assert response[0] == {"count": 3}
+            assert items[0] == ({"index": 0, "size": 1}, b"x")
+            assert "cannot compile" in items[1][0]["error"]
+            assert items[2][1] == on_disk
+        finally:
+            stop_server(pid)
+
+
+def run_server_with_limits(*args: Any, **kwargs: Any) -> None:
+    limits.install(Limits(max_source_bytes=10))
+    run_server(*args, **kwargs)
+
+
+def test_forking_server_rejects_and_sheds() -> None:
+    pid, port = start_server(
+        run_server_with_limits, compile, CompileCache(), max_pending=1
+    )
+    try:
+        assert request(port, {"command": "compile", "code": "x" * 11}) == {
+            "error": "Source is 11 bytes, over the limit of 10",
+            "code": "limit_exceeded",
+            "limit": "max_source_bytes",
+            "maximum": 10,
+        }
+        # Until its process has exited, a request still counts as pending
+        time.sleep(0.2)
+        oversized = request(port, {"command": "compile", "code": "x" * (1 << 17)})
+        assert oversized["limit"] == "max_source_bytes"
+        assert oversized["error"].startswith("Request is over")
+        time.sleep(0.2)
+        with connect(port) as slow:
+            slow.sendall(json.dumps({"command": "compile", "code": "slow"}).encode())
+            slow.shutdown(socket.SHUT_WR)
+            time.sleep(0.2)
+            # Shed without waiting for a client that is still sending
+            with connect(port) as stalled:
+                stalled.sendall(b'{"command": ')
+                stalled.settimeout(0.5)
+                assert json.loads(stalled.recv(1 << 16)) == BUSY
+                assert request(port, {"command": "ping"}) == BUSY
+            assert b"program" in slow.recv(1 << 16)
+        time.sleep(0.2)
+        assert request(port, {"command": "ping"}) == {}
+    finally:
+        stop_server(pid)
+
+
+def test_async_server_sheds_pipelined_requests() -> None:
+    pid, port = start_server(
+        run_async_server, compile, CompileCache(), workers=1, max_pending=1
+    )
+    try:
+        with connect(port) as connection:
+            for message in [
+                {"command": "compile", "code": "slow"},
+                {"command": "ping"},
+            ]:
+                data = json.dumps(message).encode()
+                connection.sendall(FRAME_HEADER.pack(len(data)) + data)
+            assert "program" in read_binary(connection)[0]
+            assert read_binary(connection)[0] == BUSY
+        assert request(port, {"command": "ping"}) == {}
+    finally:
+        stop_server(pid)
+
+
+def run_async_server_with_limits(*args: Any, **kwargs: Any) -> None:
+    limits.install(Limits(max_source_bytes=10))
+    run_async_server(*args, **kwargs)
+
+
+def test_async_server_rejects_oversized_requests() -> None:
+    pid, port = start_server(
+        run_async_server_with_limits, compile, CompileCache(), workers=1
+    )
+    try:
+        oversized = request(port, {"command": "compile", "code": "x" * (1 << 17)})
+        assert oversized["limit"] == "max_source_bytes"
+        assert oversized["error"].startswith("Request is over")
+        assert request(port, {"command": "ping"}) == {}
+    finally:
+        stop_server(pid)
+
+
+def test_async_server_reads_the_disk_tier(tmp_path: Path) -> None:
+    # Compiling it would fail, so the answer has to come from disk
+    seeded = CompileCache(directory=str(tmp_path))
+    seeded.put(seeded.key("bad"), b"from disk")
+    cache = CompileCache(directory=str(tmp_path))
+    pid, port = start_server(run_async_server, compile, cache, workers=1)
+    try:
+        for _ in range(2):
+            result = request(port, {"command": "compile", "code": "bad"})
+            assert b64decode(result["program"]) == b"from disk"
+        result = request(port, {"command": "compile", "code": "new"})
+        assert b64decode(result["program"]) == b"wen"
+        stats = request(port, {"command": "stats"})["cache"]
+        assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (2, 1, 1)
+        assert (tmp_path / cache.key("new")).read_bytes() == b"wen"
+    finally:
+        stop_server(pid)
@@ -0,0 +1,37 @@
+import time
+
+from compiler.tester import (
+    front_end,
+    run_load,
+    spawn_server,
+    stop_server,
+    synthetic_programs,
+)
+
+
+def test_load_against_spawned_servers() -> None:
+    programs = synthetic_programs("realistic", 500, 4) + ["1 +"]
+    for mode, framed in [("async", True), ("forking", False)]:
+        pid, port = spawn_server(mode, front_end, 2)
+        try:
+            result = run_load("127.0.0.1", port, programs, 50, 4, framed=framed)
+        finally:
+            stop_server(pid)
+        summary = result.summary()
+        assert summary["requests"] == 50
+        # Every fifth program doesn't parse
+        assert summary["errors"] == 10 and summary["busy"] == 0
+        [message] = result.messages
+        assert message.startswith("compiler.errors.UnexpectedTokenError")
+        assert 0 < summary["p50_ms"] <= summary["p99_ms"] <= summary["max_ms"]
+
+
+def test_rate_limits_sending() -> None:
+    pid, port = spawn_server("async", front_end, 1)
+    try:
+        start = time.perf_counter()
+        result = run_load("127.0.0.1", port, ["1 + 2"], 20, 2, rate=100)
+        assert time.perf_counter() - start >= 0.19
+    finally:
+        stop_server(pid)
+    assert result.summary()["errors"] == 0
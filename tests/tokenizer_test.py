@@ -1,5 +1,9 @@
-from compiler.tokenizer import tokenize
-from compiler.utils import L, Token, Location
+import io
+import mmap
+from pathlib import Path
+
+from compiler.tokenizer import tokenize, tokenize_buffer, tokenize_stream
+from compiler.utils import SPAN_BITS, L, Token, Location
 
 
 def test_tokenizer_basics() -> None:
@@ -56,3 +60,56 @@ def test_multi_line_comment() -> None:
         Token("a", "identifier", L),
         Token("e", "identifier", L),
     ]
+
+
+def test_comment_markers_inside_comments() -> None:
+    assert tokenize("a // /* b\nc /* # */ d") == [
+        Token("a", "identifier", L),
+        Token("c", "identifier", L),
+        Token("d", "identifier", L),
+    ]
+
+
+STREAM_SOURCE = "if a/*x\r\ny*/then\r\n  b + 12 # c\n\nelse\r(3)// d\n*/"
+
+
+def test_stream_matches_tokenize() -> None:
+    expected = tokenize(STREAM_SOURCE)
+    for chunk_size in [1, 2, 3, 7, 1 << 16]:
+        stream = io.StringIO(STREAM_SOURCE)
+        assert list(tokenize_stream(stream, chunk_size)) == expected
+
+
+def test_stream_bytes_split_inside_character() -> None:
+    source = "a /* \u00e4 */ b\nc"
+    stream = io.BytesIO(source.encode())
+    assert list(tokenize_stream(stream, chunk_size=1)) == tokenize(source)
+
+
+def test_stream_mmap(tmp_path: Path) -> None:
+    path = tmp_path / "source"
+    path.write_bytes(STREAM_SOURCE.encode())
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        assert list(tokenize_stream(m, chunk_size=5)) == tokenize(STREAM_SOURCE)
+
+
+def test_repeated_names_share_text() -> None:
+    tokens = tokenize("foo_bar + foo_bar\n+ foo_bar")
+    assert tokens[0].text is tokens[2].text is tokens[4].text
+    assert tokens[1].text is tokens[3].text
+
+
+def test_locations_are_resolved_from_offsets() -> None:
+    tokens = tokenize("a\r\n  bb /* x\n */ c")
+    assert tokens[1].span == 5 << SPAN_BITS | 7
+    assert tokens[1].loc == Location(1, (2, 4))
+    assert tokens[2].loc == Location(2, (4, 5))
+
+
+def test_token_buffer_matches_tokenize() -> None:
+    source = "if a/*x\ny*/then\n  b + 12 # c\nelse (3)"
+    tokens = tokenize_buffer(source)
+    assert len(tokens) == 10
+    assert list(tokens) == tokenize(source)
+    assert tokens.kind(5) == "int_literal" and tokens.text(5) == "12"
+    assert list(tokens[2:5]) == tokenize(source)[2:5]
@@ -0,0 +1,144 @@
+from pytest import raises
+
+from compiler.bytecode import CONST, LOAD, STORE, disassemble, lower
+from compiler.cache import CompileCache
+from compiler.errors import EvaluationError
+from compiler.folding import INT_MIN, fold_constants
+from compiler.parser import parse
+from compiler.server import handle_request
+from compiler.tokenizer import tokenize
+from compiler.vm import Value, check_variables, execute, interpret, walk
+from compiler.workloads import well_typed
+
+
+def run(source: str, variables: dict[str, Value] | None = None) -> Value:
+    """Run `source` without folding, checking that the walker agrees."""
+    expr = parse(tokenize(source))
+    walked = dict(variables or {})
+    executed = dict(variables or {})
+    value = execute(lower(expr), executed)
+    assert walk(expr, walked) == value
+    assert walked == executed
+    return value
+
+
+def test_values_and_operators() -> None:
+    assert run("1 + 2 * 3 - 4") == 3
+    assert run("(0 - 7) / 2") == -3
+    assert run("(0 - 7) % 2") == -1
+    assert run("7 % (0 - 2)") == 1
+    assert run("9223372036854775807 + x", {"x": 1}) == INT_MIN
+    assert run("x * x", {"x": 1 << 40}) == 0
+    assert run("1 < 2 == true") is True
+    assert run("false != (1 >= 2)") is False
+    assert run("if x > 1 then 10 else 20", {"x": 2}) == 10
+    assert run("if x > 1 then 10 else 20", {"x": 1}) == 20
+    assert run("if x > 1 then 10", {"x": 2}) is None
+
+
+def test_assignment_updates_variables() -> None:
+    variables: dict[str, Value] = {"x": 1}
+    assert execute(lower(parse(tokenize("y = x = x + 1"))), variables) == 2
+    assert variables == {"x": 2, "y": 2}
+    assert run("(x = 3) + x", {}) == 6
+
+
+def test_and_or_short_circuit() -> None:
+    # The right side would divide by zero
+    assert run("false and 1 / 0 == 1") is False
+    assert run("true or 1 / 0 == 1") is True
+    assert run("true and 1 / x == 1", {"x": 1}) is True
+    assert run("(x = 1) > 2 and (x = 5) > 2", {}) is False
+    assert run("x", {"x": 0}) == 0
+
+
+def test_errors() -> None:
+    for source, message in [
+        ("1 + true", "Operator \\+ can't take int and bool"),
+        ("y", "Variable y has no value"),
+        ("1 / (x - x)", "Division by zero"),
+        ("if 1 then 2", "Condition must be a bool, not int"),
+        ("true and x", "Operand of and/or must be a bool, not int"),
+        ("(if false then 1) == 1", "Operator == can't take unit and int"),
+    ]:
+        expr = parse(tokenize(source))
+        with raises(EvaluationError, match=message):
+            execute(lower(expr), {"x": 1})
+        with raises(EvaluationError, match=message):
+            walk(expr, {"x": 1})
+    with raises(Exception, match="Cannot assign"):
+        lower(parse(tokenize("1 = 2")))
+    with raises(Exception, match="Cannot assign"):
+        lower(parse(tokenize("true = false")))
+
+
+def test_bytecode_layout() -> None:
+    code = lower(parse(tokenize("x = x + 1 + 1")))
+    assert code.constants == [1]
+    assert code.names == ["x"]
+    assert code.instructions.typecode == "i"
+    opcodes = code.instructions[::2].tolist()
+    assert opcodes[0] == LOAD and opcodes[-1] == STORE
+    assert opcodes.count(CONST) == 2
+    # True and 1 are different constants
+    assert lower(parse(tokenize("true == (1 == 1)"))).constants == [True, 1]
+    assert "JUMP_IF_FALSE" in disassemble(lower(parse(tokenize("if a then b"))))
+
+
+def test_generated_programs_agree() -> None:
+    for seed in range(10):
+        source = well_typed(3000, seed)
+        expr = parse(tokenize(source))
+        value = walk(expr, {})
+        assert execute(lower(expr)) == value
+        assert execute(lower(fold_constants(expr)[0])) == value
+        assert interpret(source) == value
+
+
+def test_ill_typed_programs_fail_like_the_walker() -> None:
+    for source, variables in [
+        ("true and 5", {}),
+        ("false or 5", {}),
+        ("b + 0", {"b": True}),
+        ("0 + b", {"b": True}),
+        ("b * 1", {"b": False}),
+        ("b / 1", {"b": True}),
+        ("if true then b + 0 else 1", {"b": True}),
+    ]:
+        with raises(EvaluationError):
+            walk(parse(tokenize(source)), dict(variables))
+        with raises(EvaluationError):
+            interpret(source, dict(variables))
+
+
+def test_deep_programs_run() -> None:
+    n = 20_000
+    assert interpret("x" + " + 1" * n, {"x": 0}) == n
+    source = "if a then " * n + "1" + " else 2" * n
+    assert interpret(source, {"a": True}) == 1
+    assert interpret(source, {"a": False}) == 2
+
+
+def test_server_interprets() -> None:
+    input = {"command": "interpret", "code": "y = x * 2", "variables": {"x": 21}}
+    result = handle_request(input, lambda code, name: b"", CompileCache())
+    assert result == {"value": 42, "variables": {"x": 21, "y": 42}}
+
+
+def test_server_checks_variables() -> None:
+    cache = CompileCache()
+    for variables, message in [
+        ({"x": "1"}, "must be an int or a bool, not str"),
+        ({"x": 1.5}, "must be an int or a bool, not float"),
+        ({"x": [1]}, "must be an int or a bool, not list"),
+        ({"x": 1 << 63}, "out of range"),
+        ({"true": 1}, "Invalid variable name"),
+        ([1], "must be an object"),
+    ]:
+        input = {"command": "interpret", "code": "x", "variables": variables}
+        with raises(ValueError, match=message):
+            handle_request(input, lambda code, name: b"", cache)
+    assert check_variables({"x": -(1 << 63), "b": False}) == {
+        "x": -(1 << 63),
+        "b": False,
+    }
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import compiler.ast as ast
+from compiler.tokenizer import tokenize
+from compiler.watch import IncrementalFile, InotifyWatcher, Poller, Watch
+
+
+def assert_tokens(file: IncrementalFile, source: str) -> None:
+    file.update(source)
+    assert file.tokens() == tokenize(source)
+
+
+def test_edits_retokenize_only_affected_lines() -> None:
+    lines = [f"a{i} + {i}\n" for i in range(1000)]
+    file = IncrementalFile()
+    assert_tokens(file, "".join(lines))
+    assert file.rescanned == 1000
+
+    lines[500] = "b + 2\n"
+    assert_tokens(file, "".join(lines))
+    assert file.rescanned == 1
+
+    # Opening a comment retokenizes up to where it is closed
+    lines[10] = "x /* open\n"
+    lines[20] = "closed */ + y\n"
+    assert_tokens(file, "".join(lines))
+    assert file.rescanned == 11
+    lines[20] = "still open\n"
+    assert_tokens(file, "".join(lines))
+    assert file.rescanned == 980
+
+    del lines[10:]
+    assert_tokens(file, "".join(lines))
+    assert_tokens(file, "")
+    assert_tokens(file, "1 +\r\n2 // x")
+
+
+def test_unchanged_tokens_reuse_executable() -> None:
+    built: list[ast.Expression] = []
+
+    def generate(expr: ast.Expression) -> bytes:
+        built.append(expr)
+        return str(len(built)).encode()
+
+    file = IncrementalFile()
+    assert file.compile("(a + 1) * b\n- c", generate) == b"1"
+    assert file.compile("(a + 1) * b  // comment\n- c", generate) == b"1"
+    assert file.compile("(a + 1) * b\n- d", generate) == b"2"
+    # Unchanged subtrees are the same objects
+    first, second = built
+    assert isinstance(first, ast.BinaryOp) and isinstance(second, ast.BinaryOp)
+    assert first.left is second.left
+    # A failed build isn't mistaken for the last good one
+    try:
+        file.compile("(a + 1) * b\n-", generate)
+    except Exception:
+        pass
+    assert file.compile("(a + 1) * b\n- d", generate) == b"2"
+
+
+def test_watch_rebuilds_changed_files(tmp_path: Path) -> None:
+    sources = tmp_path / "src"
+    (sources / "sub").mkdir(parents=True)
+    (sources / "a").write_text("1 + 2")
+    output = tmp_path / "out"
+
+    for poll in [True, False]:
+        watch = Watch([str(sources)], str(output), lambda _: b"built", poll)
+        assert isinstance(watch.watcher, Poller if poll else InotifyWatcher)
+        for path in watch.sources():
+            watch.build(path)
+        assert (output / "a").read_bytes() == b"built"
+
+        (sources / "sub" / "b").write_text("x")
+        (sources / "a").unlink()
+        watch.step(5.0)
+        assert (output / "sub" / "b").read_bytes() == b"built"
+        assert sources / "a" not in watch.files
+        watch.watcher.close()
+        (sources / "sub" / "b").unlink()
+        (sources / "a").write_text("1 + 2")
+
+
+
+def test_unreadable_files_fail_without_stopping(tmp_path: Path) -> None:
+    sources = tmp_path / "src"
+    sources.mkdir()
+    (sources / "binary").write_bytes(b"\xff\xfe not utf-8")
+    (sources / "good").write_text("1")
+    output = tmp_path / "out"
+    watch = Watch([str(sources)], str(output), lambda _: b"built", True)
+    try:
+        assert watch.build(sources / "binary") is False
+        assert watch.build(sources / "good") is True
+        assert not (output / "binary").exists()
+        (sources / "binary").write_text("2")
+        assert watch.build(sources / "binary") is True
+        assert (output / "binary").read_bytes() == b"built"
+    finally:
+        watch.watcher.close()